@@ -0,0 +1,105 @@
+"""
+Encryption throughput and memory benchmark.
+
+Peak memory is the largest amount traced by `tracemalloc` while decrypting the payload from a file,
+it should stay near `workers * segment size` whatever the payload size is.
+
+Run with the same env as the application, e.g.:
+    PYTHONPATH=src python -m backend.benchmarks.encryption --size-mb 256 --workers 1 2 4 8 --cipher aes-gcm
+"""
+import argparse
+import io
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+from typing import BinaryIO
+
+from backend.storage.constants import CipherAlgorithm
+from backend.storage.encryption import decrypt_stream, encrypt_stream, new_nonce
+from backend.storage.typing_ import BytesChunk
+
+MB = 1024 * 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--size-mb", type=int, default=256, help="size of the encrypted payload")
+    _ = parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    _ = parser.add_argument("--segment-size", type=int, nargs="+", default=[64 * 1024, MB])
+    _ = parser.add_argument(
+        "--cipher",
+        type=CipherAlgorithm,
+        nargs="+",
+        default=list(CipherAlgorithm),
+        help=f"one or more of: {', '.join(cipher.value for cipher in CipherAlgorithm)}",
+    )
+    _ = parser.add_argument("--repeat", type=int, default=3, help="best of N runs is reported")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * MB)
+    nonce = new_nonce()
+
+    print(  # noqa: T201
+        f"{'cipher':>18} {'segment':>10} {'workers':>8} {'encrypt MB/s':>14} {'decrypt MB/s':>14} {'peak KiB':>10}",
+    )
+    for cipher, segment_size in itertools.product(args.cipher, args.segment_size):
+        encrypted_data = b"".join(
+            encrypt_stream(io.BytesIO(data), nonce, cipher=cipher, segment_size=segment_size, workers=1),
+        )
+
+        for workers in sorted(set(args.workers)):
+            encrypt_speed = _measure(
+                partial(
+                    encrypt_stream,
+                    nonce=nonce,
+                    cipher=cipher,
+                    segment_size=segment_size,
+                    workers=workers,
+                    reuse_buffers=True,
+                ),
+                data,
+                repeat=args.repeat,
+            )
+            decrypt = partial(decrypt_stream, nonce=nonce, workers=workers, reuse_buffers=True)
+            decrypt_speed = _measure(decrypt, encrypted_data, repeat=args.repeat)
+            peak_memory = _measure_peak_memory(decrypt, encrypted_data)
+            print(  # noqa: T201
+                f"{cipher.value:>18} {segment_size:>10} {workers:>8} "
+                f"{encrypt_speed:>14.1f} {decrypt_speed:>14.1f} {peak_memory / 1024:>10.0f}",
+            )
+
+
+def _measure(stream: Callable[[BinaryIO], Iterator[BytesChunk]], data: bytes, *, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _consume(stream(io.BytesIO(data)))
+        best = min(best, time.perf_counter() - start)
+    return len(data) / MB / best
+
+
+def _measure_peak_memory(stream: Callable[[BinaryIO], Iterator[BytesChunk]], data: bytes) -> int:
+    with tempfile.TemporaryFile() as file_:
+        _ = file_.write(data)
+        _ = file_.seek(os.SEEK_SET)
+
+        tracemalloc.start()
+        try:
+            _consume(stream(file_))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return peak
+
+
+def _consume(chunks: Iterable[BytesChunk]) -> None:
+    for _ in chunks:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Listing benchmark: rows per second of building listing items from raw mongo documents, without a database.
+
+Compares the pydantic projection beanie used for `ls_page` and `get_all` against `FileListItem.from_document`.
+Run with the same env as the application, e.g.:
+    PYTHONPATH=src python -m backend.benchmarks.file_listing --rows 100000 --repeat 5
+"""
+import argparse
+import datetime as dt
+import time
+from collections.abc import Callable, Mapping
+from typing import Any
+
+from beanie.odm.utils.parsing import parse_obj
+from pydantic import BaseModel
+
+from backend.storage.constants import SupportedFileTypes
+from backend.storage.dao_schemas.file_meta import FileListItem
+from backend.storage.typing_ import FileName, FilePath
+
+
+class _ValidatedListItem(BaseModel):
+
+    """Listing row as it was validated before `FileListItem`."""
+
+    path: FilePath
+    filename: FileName
+    type_: SupportedFileTypes
+    icon_hash: str | None = None
+    size: int = 0
+    created_date: dt.datetime | None = None
+    updated_date: dt.datetime | None = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--rows", type=int, default=100_000)
+    _ = parser.add_argument("--repeat", type=int, default=5, help="best of N runs is reported")
+    args = parser.parse_args()
+
+    documents = _generate_documents(args.rows)
+    print(f"{'path':>22} {'rows/s':>12}")  # noqa: T201
+    for name, build in [
+        ("pydantic projection", _validate),
+        ("slotted record", _construct),
+    ]:
+        elapsed = _measure(build, documents, repeat=args.repeat)
+        print(f"{name:>22} {args.rows / elapsed:>12,.0f}")  # noqa: T201
+
+
+def _validate(documents: list[Mapping[str, Any]]) -> None:
+    for document in documents:
+        _ = parse_obj(_ValidatedListItem, document)
+
+
+def _construct(documents: list[Mapping[str, Any]]) -> None:
+    path = FilePath()
+    for document in documents:
+        _ = FileListItem.from_document(document, path)
+
+
+def _measure(
+    build: Callable[[list[Mapping[str, Any]]], None],
+    documents: list[Mapping[str, Any]],
+    *,
+    repeat: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(documents)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _generate_documents(rows: int) -> list[Mapping[str, Any]]:
+    # The way rows come from mongo: dates as strings of `bson_encoders`, enums as values
+    date = dt.datetime(2024, 1, 1, tzinfo=dt.UTC).isoformat(sep=" ", timespec="seconds")
+    return [
+        {
+            "path": "/photos/2024",
+            "filename": f"IMG_{row:06}.jpg",
+            "type_": SupportedFileTypes.JPEG.value,
+            "icon_hash": f"{row:032x}",
+            "size": row * 1024,
+            "created_date": date,
+            "updated_date": date,
+        }
+        for row in range(rows)
+    ]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Thumbnail benchmark: one decode for all renditions against decoding the photo for every size.
+
+Run with the same env as the application, e.g.:
+    PYTHONPATH=src python -m backend.benchmarks.thumbnails --width 6000 --height 4000 --size 128 512 1024
+"""
+import argparse
+import io
+import time
+from collections.abc import Callable
+
+from PIL import Image
+
+from backend.storage.constants import SupportedFileTypes
+from backend.storage.icon import Size, get_renditions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--width", type=int, default=6000)
+    _ = parser.add_argument("--height", type=int, default=4000)
+    _ = parser.add_argument("--size", type=int, nargs="+", default=[128, 512, 1024], help="square rendition sizes")
+    _ = parser.add_argument("--repeat", type=int, default=3, help="best of N runs is reported")
+    args = parser.parse_args()
+
+    sizes = {str(size): (size, size) for size in args.size}
+    print(f"{'format':>7} {'path':>28} {'ms':>10}")  # noqa: T201
+    for image_format in ["JPEG", "PNG"]:
+        data = _generate_photo(args.width, args.height, image_format)
+
+        for name, build in [
+            ("full decode for every size", _full_decode_per_size),
+            ("thumbnail for every size", _thumbnail_per_size),
+            ("one draft decode", _one_decode),
+        ]:
+            elapsed = _measure(build, data, sizes, repeat=args.repeat)
+            print(f"{image_format:>7} {name:>28} {elapsed * 1000:>10.1f}")  # noqa: T201
+
+
+def _full_decode_per_size(data: bytes, sizes: dict[str, Size]) -> None:
+    for size in sizes.values():
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail(size, reducing_gap=None)
+            image.save(io.BytesIO(), format="PNG")
+
+
+def _thumbnail_per_size(data: bytes, sizes: dict[str, Size]) -> None:
+    # The way icons were built before renditions: `thumbnail` drafts JPEG too, but decodes once per size
+    for size in sizes.values():
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail(size)
+            image.save(io.BytesIO(), format="PNG")
+
+
+def _one_decode(data: bytes, sizes: dict[str, Size]) -> None:
+    _ = get_renditions(file_type=SupportedFileTypes.JPEG, file_=io.BytesIO(data), sizes=sizes)
+
+
+def _measure(
+    build: Callable[[bytes, dict[str, Size]], None],
+    data: bytes,
+    sizes: dict[str, Size],
+    *,
+    repeat: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(data, sizes)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _generate_photo(width: int, height: int, image_format: str) -> bytes:
+    # Noise on top of a gradient compresses about as well as a real photo
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 32)
+    image = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+
+    output_file = io.BytesIO()
+    image.save(output_file, format=image_format)
+    return output_file.getvalue()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Response, status
+
+from backend.storage.constants import ThumbnailFormat
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
+
+router = APIRouter()
+
+# Thumbnails are addressed by the hash of their content, so a response for a hash never changes
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/icons/{thumbnail_hash}", name="icon", response_class=Response)
+async def icon(
+    thumbnail_hash: Annotated[str, Path(pattern="^[0-9a-f]{64}$")],
+    thumbnail_dao: Annotated[MongoThumbnailDAO, Depends(MongoThumbnailDAO)],
+    accept: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> Response:
+    """Serve WebP to clients which explicitly accept it and PNG to everyone else."""
+    formats = [ThumbnailFormat.WEBP, ThumbnailFormat.PNG] if _is_webp_accepted(accept) else [ThumbnailFormat.PNG]
+    headers = {"Cache-Control": CACHE_CONTROL, "Vary": "Accept"}
+
+    # Looked up first, so a hash which was never stored is not found even for `If-None-Match: *`
+    thumbnail = await thumbnail_dao.get(thumbnail_hash)
+    if thumbnail is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Icon not found")
+
+    formats = [image_format for image_format in formats if image_format in thumbnail]
+    # Any acceptable format the client already has is good, content of a hash never changes
+    if not_modified_format := _get_not_modified_format(if_none_match, thumbnail_hash, formats):
+        headers["ETag"] = _get_etag(thumbnail_hash, not_modified_format)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    image_format = formats[0]
+    headers["ETag"] = _get_etag(thumbnail_hash, image_format)
+    return Response(content=thumbnail[image_format], media_type=f"image/{image_format.value}", headers=headers)
+
+
+def _is_webp_accepted(accept: str | None) -> bool:
+    for media_range in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        if media_type.lower() != "image/webp":
+            continue
+
+        quality = next((param.removeprefix("q=") for param in params if param.startswith("q=")), "1")
+        try:
+            return float(quality) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def _get_not_modified_format(
+    if_none_match: str | None,
+    thumbnail_hash: str,
+    formats: list[ThumbnailFormat],
+) -> ThumbnailFormat | None:
+    if not if_none_match:
+        return None
+
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    for image_format in formats:
+        if "*" in tags or _get_etag(thumbnail_hash, image_format) in tags:
+            return image_format
+    return None
+
+
+def _get_etag(thumbnail_hash: str, image_format: ThumbnailFormat) -> str:
+    return f'"{thumbnail_hash}.{image_format.value}"'
@@ -0,0 +1,12 @@
+from typing import Annotated, Any
+
+from fastapi import APIRouter, Depends
+
+from backend.core.metrics import MetricsRegistry, get_metrics_registry
+
+router = APIRouter()
+
+
+@router.get("/metrics", name="metrics")
+async def metrics(registry: Annotated[MetricsRegistry, Depends(get_metrics_registry)]) -> dict[str, Any]:
+    return registry.snapshot()
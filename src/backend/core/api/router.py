@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 
-from backend.core.api.endpoints import base
+from backend.core.api.endpoints import base, icons, metrics
 
 api_router = APIRouter()
 api_router.include_router(base.router, tags=["base"], prefix="")
+api_router.include_router(metrics.router, tags=["metrics"], prefix="")
+api_router.include_router(icons.router, tags=["icons"], prefix="")
@@ -0,0 +1,108 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Generic, TypeVar
+
+from backend.core.metrics import MetricsRegistry
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+D = TypeVar("D")
+
+
+class LRUCache(Generic[K, V]):
+
+    """
+    In-process LRU cache with a TTL, bounded by entry count and by total size of values.
+
+    Meant for the event loop thread only, so there are no locks. Exposes `{name}_cache_hits_total`,
+    `{name}_cache_misses_total`, `{name}_cache_evictions_total`, `{name}_cache_entries` and `{name}_cache_bytes`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        name: str,
+        *,
+        max_entries: int,
+        max_bytes: int,
+        ttl: float,
+        get_size: Callable[[V], int],
+        metrics: MetricsRegistry,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._get_size = get_size
+        self._entries: OrderedDict[K, tuple[float, int, V]] = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._hits = metrics.counter(f"{name}_cache_hits_total")
+        self._misses = metrics.counter(f"{name}_cache_misses_total")
+        self._evictions = metrics.counter(f"{name}_cache_evictions_total")
+        self._entries_gauge = metrics.gauge(f"{name}_cache_entries")
+        self._bytes_gauge = metrics.gauge(f"{name}_cache_bytes")
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    @property
+    def generation(self) -> int:
+        """Changes on every invalidation, take it before reading a value to `set`."""
+        return self._generation
+
+    def get(self, key: K, default: D) -> V | D:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self._misses.inc()
+            return default
+
+        self._entries.move_to_end(key)
+        self._hits.inc()
+        return entry[2]
+
+    def set(self, key: K, value: V, *, generation: int | None = None) -> None:
+        """Cache `value`, unless something was invalidated after `generation`, so `value` may be stale already."""
+        if not self.is_enabled or (generation is not None and generation != self._generation):
+            return
+
+        self._remove(key)
+        size = self._get_size(value)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._evictions.inc()
+        self._update_gauges()
+
+    def invalidate(self, key: K) -> None:
+        self._generation += 1
+        self._remove(key)
+        self._update_gauges()
+
+    def invalidate_where(self, predicate: Callable[[K], bool]) -> None:
+        """Drop every entry whose key matches `predicate`, takes time linear in the cache size."""
+        self._generation += 1
+        for key in [key for key in self._entries if predicate(key)]:
+            self._remove(key)
+        self._update_gauges()
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+        self._bytes = 0
+        self._update_gauges()
+
+    def _remove(self, key: K) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _update_gauges(self) -> None:
+        self._entries_gauge.set(len(self._entries))
+        self._bytes_gauge.set(self._bytes)
@@ -10,6 +10,17 @@ class Environment(enum.Enum):
     PRODUCTION = "prod"
 
 
+class ExecutorType(enum.Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class MongoCompressor(enum.Enum):
+    ZSTD = "zstd"
+    ZLIB = "zlib"
+    SNAPPY = "snappy"
+
+
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 PROJECT_DIR = BASE_DIR.parent.parent
 
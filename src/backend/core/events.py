@@ -1,17 +1,28 @@
+import asyncio
+import contextlib
 from functools import lru_cache
 
 from beanie import init_beanie
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
+from backend.core.executor import get_executor
+from backend.core.mongo_monitoring import get_mongo_listener
 from backend.core.settings import get_settings
+from backend.storage.controllers.file_meta import FileMetaController
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
+from backend.storage.dao.os_file_meta import OSFileMetaDAO
+from backend.storage.tasks import build_pending_icons, invalidate_file_meta_cache
+
+CHANGE_STREAM_RETRY_INTERVAL = 30
 
 
 async def setup_mongo() -> None:
-    client = get_mongo_client()
     await init_beanie(
-        database=client.db_name,
+        database=get_mongo_database(),
         document_models=[
             "backend.storage.documents.file_meta.FileMetaDocument",
+            "backend.storage.documents.thumbnail.ThumbnailDocument",
         ],
     )
 
@@ -22,8 +33,72 @@ async def teardown_mongo() -> None:
     get_mongo_client.cache_clear()
 
 
+def setup_executor() -> None:
+    _ = get_executor()
+
+
+def teardown_executor() -> None:
+    executor = get_executor()
+    executor.shutdown()
+    get_executor.cache_clear()
+
+
+def setup_thumbnail_worker() -> asyncio.Task[None] | None:
+    settings = get_settings()
+    if not settings.storage_lazy_thumbnails:
+        return None
+
+    controller = FileMetaController(
+        db_dao=MongoFileMetaDAO(),
+        os_dao=OSFileMetaDAO(),
+        thumbnail_dao=MongoThumbnailDAO(),
+    )
+    return asyncio.create_task(build_pending_icons(controller, interval=settings.storage_thumbnail_interval))
+
+
+async def teardown_thumbnail_worker(worker: asyncio.Task[None] | None) -> None:
+    await _cancel_task(worker)
+
+
+def setup_cache_invalidator() -> asyncio.Task[None] | None:
+    settings = get_settings()
+    if not settings.storage_meta_cache_entries:
+        return None
+
+    return asyncio.create_task(
+        invalidate_file_meta_cache(
+            MongoFileMetaDAO(),
+            ttl=settings.storage_meta_cache_ttl,
+            fallback_ttl=settings.storage_meta_cache_fallback_ttl,
+            retry_interval=CHANGE_STREAM_RETRY_INTERVAL,
+        ),
+    )
+
+
+async def teardown_cache_invalidator(invalidator: asyncio.Task[None] | None) -> None:
+    await _cancel_task(invalidator)
+
+
+async def _cancel_task(task: asyncio.Task[None] | None) -> None:
+    if task is None:
+        return
+
+    _ = task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+def get_mongo_database() -> AsyncIOMotorDatabase:
+    return get_mongo_client().db_name
+
+
 @lru_cache
 def get_mongo_client() -> AsyncIOMotorClient:
     settings = get_settings()
 
-    return AsyncIOMotorClient(str(settings.mongo.dsn), tz_aware=True)
+    return AsyncIOMotorClient(
+        str(settings.mongo.dsn),
+        tz_aware=True,
+        event_listeners=[get_mongo_listener()] if settings.mongo.monitoring else [],
+        **settings.mongo.get_client_options(),
+    )
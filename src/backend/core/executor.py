@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, ParamSpec, TypeVar
+
+from backend.core.constants import ExecutorType
+from backend.core.metrics import MetricsRegistry, get_metrics_registry
+from backend.core.settings import get_settings
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+_SENTINEL: Any = object()
+
+
+class CPUExecutor:
+
+    """
+    Runs blocking CPU work (encryption, thumbnails) off the event loop.
+
+    Exposes `executor_tasks_pending` (submitted, but not finished yet), `executor_task_wait_seconds`
+    and `executor_task_run_seconds` metrics to size the pool.
+    """
+
+    def __init__(self, executor: Executor, metrics: MetricsRegistry) -> None:
+        self.executor = executor
+        self._pending = metrics.gauge("executor_tasks_pending")
+        self._total = metrics.counter("executor_tasks_total")
+        self._wait_seconds = metrics.histogram("executor_task_wait_seconds")
+        self._run_seconds = metrics.histogram("executor_task_run_seconds")
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+
+        self._pending.inc()
+        try:
+            result, started_at, run_seconds = await loop.run_in_executor(
+                self.executor,
+                functools.partial(_timed_call, func, *args, **kwargs),
+            )
+        finally:
+            self._pending.dec()
+
+        self._total.inc()
+        self._wait_seconds.observe(max(started_at - submitted_at, 0))
+        self._run_seconds.observe(run_seconds)
+        return result
+
+    async def iterate(self, iterator: Iterator[T]) -> AsyncIterator[T]:
+        """
+        Advance a sync iterator item by item off the event loop.
+
+        Iterators can't be sent to another process, so with a process pool they are advanced
+        in the default thread pool of the loop.
+        """
+        if isinstance(self.executor, ThreadPoolExecutor):
+            while (item := await self.run(next, iterator, _SENTINEL)) is not _SENTINEL:
+                yield item
+            return
+
+        loop = asyncio.get_running_loop()
+        while (item := await loop.run_in_executor(None, next, iterator, _SENTINEL)) is not _SENTINEL:
+            yield item
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _timed_call(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> tuple[T, float, float]:
+    started_at = time.time()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, started_at, time.perf_counter() - start
+
+
+async def prefetch(iterator: Iterator[T], *, size: int) -> AsyncIterator[T]:
+    """
+    Advance a blocking sync iterator in a thread, up to `size` items ahead of the consumer.
+
+    Unlike `CPUExecutor.iterate`, the next items are read while the consumer awaits something else.
+    """
+    queue: asyncio.Queue[T | Exception] = asyncio.Queue(maxsize=size)
+
+    async def produce() -> None:
+        try:
+            while (item := await asyncio.to_thread(next, iterator, _SENTINEL)) is not _SENTINEL:
+                await queue.put(item)
+        except Exception as e:  # noqa: BLE001
+            await queue.put(e)
+            return
+        await queue.put(_SENTINEL)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not _SENTINEL:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        _ = producer.cancel()
+
+
+@lru_cache
+def get_executor() -> CPUExecutor:
+    settings = get_settings()
+
+    executor: Executor
+    if settings.executor_type == ExecutorType.PROCESS:
+        executor = ProcessPoolExecutor(max_workers=settings.executor_max_workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=settings.executor_max_workers, thread_name_prefix="cpu-work")
+
+    return CPUExecutor(executor, get_metrics_registry())
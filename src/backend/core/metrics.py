@@ -0,0 +1,104 @@
+import bisect
+import math
+import threading
+from functools import lru_cache
+from typing import Any, TypeVar
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, math.inf)
+
+MetricT = TypeVar("MetricT", "Counter", "Gauge", "Histogram")
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value: float = 0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self) -> float:
+        return self._value
+
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._count = 0
+        self._sum: float = 0
+
+    @property
+    def total(self) -> int:
+        return self._count
+
+    def observe(self, value: float) -> None:
+        index = min(bisect.bisect_left(self.buckets, value), len(self.buckets) - 1)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            count, sum_ = self._count, self._sum
+
+        cumulative = 0
+        buckets: dict[str, int] = {}
+        for bound, bucket_count in zip(self.buckets, counts, strict=True):
+            cumulative += bucket_count
+            buckets["+Inf" if math.isinf(bound) else str(bound)] = cumulative
+
+        return {"count": count, "sum": sum_, "buckets": buckets}
+
+
+class MetricsRegistry:
+
+    """In-process metrics, exposed as json by the `/metrics` endpoint."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str) -> Counter:
+        return self._get_or_create(name, Counter)
+
+    def gauge(self, name: str) -> Gauge:
+        return self._get_or_create(name, Gauge)
+
+    def histogram(self, name: str) -> Histogram:
+        return self._get_or_create(name, Histogram)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+    def _get_or_create(self, name: str, metric_type: type[MetricT]) -> MetricT:
+        with self._lock:
+            metric = self._metrics.setdefault(name, metric_type())
+
+        if type(metric) is not metric_type:
+            raise TypeError(f"Metric {name} is already registered as {type(metric).__name__}")
+        return metric
+
+
+@lru_cache
+def get_metrics_registry() -> MetricsRegistry:
+    return MetricsRegistry()
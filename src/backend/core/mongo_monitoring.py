@@ -0,0 +1,90 @@
+import threading
+import time
+from functools import lru_cache
+
+from pymongo import monitoring
+
+from backend.core.metrics import MetricsRegistry, get_metrics_registry
+
+MICROSECONDS_IN_SECOND = 1_000_000
+
+
+class MongoMetricsListener(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+
+    """
+    Mongo latency split between the server and the connection pool.
+
+    `mongo_command_{name}_seconds` histograms time a command from sending it to its reply, the wait for a pooled
+    connection before that is in `mongo_pool_checkout_wait_seconds`. Pool usage is in `mongo_pool_connections`
+    and `mongo_pool_connections_in_use` gauges. Listeners are called in the threads running pymongo operations.
+    """
+
+    def __init__(self, metrics: MetricsRegistry) -> None:
+        self._metrics = metrics
+        self._command_failures = metrics.counter("mongo_command_failures_total")
+        self._checkout_wait = metrics.histogram("mongo_pool_checkout_wait_seconds")
+        self._checkout_failures = metrics.counter("mongo_pool_checkout_failures_total")
+        self._connections = metrics.gauge("mongo_pool_connections")
+        self._connections_in_use = metrics.gauge("mongo_pool_connections_in_use")
+        # A thread checks out one connection at a time, events of pymongo 4.6 don't carry the wait
+        self._checkout = threading.local()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._observe_command(event.command_name, event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._observe_command(event.command_name, event.duration_micros)
+        self._command_failures.inc()
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:  # noqa: ARG002
+        self._connections.inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:  # noqa: ARG002
+        self._connections.dec()
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:  # noqa: ARG002
+        self._checkout.started_at = time.perf_counter()
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:  # noqa: ARG002
+        self._observe_checkout_wait()
+        self._checkout_failures.inc()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:  # noqa: ARG002
+        self._observe_checkout_wait()
+        self._connections_in_use.inc()
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:  # noqa: ARG002
+        self._connections_in_use.dec()
+
+    def _observe_command(self, command_name: str, duration_micros: int) -> None:
+        histogram = self._metrics.histogram(f"mongo_command_{command_name.lower()}_seconds")
+        histogram.observe(duration_micros / MICROSECONDS_IN_SECOND)
+
+    def _observe_checkout_wait(self) -> None:
+        started_at = getattr(self._checkout, "started_at", None)
+        if started_at is not None:
+            self._checkout_wait.observe(time.perf_counter() - started_at)
+            self._checkout.started_at = None
+
+
+@lru_cache
+def get_mongo_listener() -> MongoMetricsListener:
+    return MongoMetricsListener(get_metrics_registry())
@@ -0,0 +1,9 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from backend.core.constants import ExecutorType
+
+
+class ExecutorSettings(BaseSettings):
+    executor_type: ExecutorType = ExecutorType.THREAD
+    executor_max_workers: int | None = Field(default=None, gt=0)
@@ -4,12 +4,13 @@ from pydantic_settings import SettingsConfigDict
 
 from .base import env_file
 from .common import CommonSettings
+from .executor import ExecutorSettings
 from .mongo import MongoSettings
 from .security import WebSecureSettings
 from .storage import StorageSettings
 
 
-class Settings(CommonSettings, StorageSettings):
+class Settings(CommonSettings, StorageSettings, ExecutorSettings):
     security: WebSecureSettings = WebSecureSettings()  # pyright: ignore reportGeneralTypeIssues
     mongo: MongoSettings = MongoSettings() # pyright: ignore reportGeneralTypeIssues
 
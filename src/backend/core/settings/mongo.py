@@ -1,14 +1,32 @@
-from pydantic import MongoDsn, computed_field
+from typing import Any
+
+from pydantic import MongoDsn, NonNegativeInt, PositiveFloat, PositiveInt, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from backend.core.constants import MongoCompressor
+
 from .base import env_file
 
+MS_IN_SECOND = 1000
+
 
 class MongoSettings(BaseSettings):
     username: str
     password: str
     database: str
     host: str
+    # Connection pool of every process, timeouts are in seconds and `None` waits forever
+    max_pool_size: PositiveInt = 100
+    min_pool_size: NonNegativeInt = 0
+    max_idle_time: PositiveFloat | None = None
+    wait_queue_timeout: PositiveFloat | None = None
+    connect_timeout: PositiveFloat = 20
+    socket_timeout: PositiveFloat | None = None
+    server_selection_timeout: PositiveFloat = 30
+    # Wire compression in order of preference, `zstd` needs optional `zstandard` package, `snappy` `python-snappy`
+    compressors: list[MongoCompressor] = []
+    # Command latency and pool metrics, see `backend.core.mongo_monitoring`
+    monitoring: bool = True
 
     model_config = SettingsConfigDict(env_prefix="MONGO_", env_file=env_file, extra="allow")
 
@@ -20,3 +38,20 @@ class MongoSettings(BaseSettings):
             password=self.password,
             host=self.host,
         )
+
+    def get_client_options(self) -> dict[str, Any]:
+        """Return pool, timeout and compression keyword arguments of `AsyncIOMotorClient`."""
+        return {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": _to_ms(self.max_idle_time),
+            "waitQueueTimeoutMS": _to_ms(self.wait_queue_timeout),
+            "connectTimeoutMS": _to_ms(self.connect_timeout),
+            "socketTimeoutMS": _to_ms(self.socket_timeout),
+            "serverSelectionTimeoutMS": _to_ms(self.server_selection_timeout),
+            "compressors": [compressor.value for compressor in self.compressors],
+        }
+
+
+def _to_ms(seconds: float | None) -> int | None:
+    return None if seconds is None else round(seconds * MS_IN_SECOND)
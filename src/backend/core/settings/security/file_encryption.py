@@ -1,6 +1,18 @@
+from typing import Annotated
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
+from backend.storage.constants import CipherAlgorithm
+
+AESKey = Annotated[bytes, Field(min_length=32, max_length=32)]
+
 
 class FileEncryptionSettings(BaseSettings):
-    aes_key: bytes = Field(min_length=32, max_length=32)
+    aes_key: AESKey
+    # Master keys rotated out, still accepted to unwrap data keys until `rotate_master_key` command re-wraps them.
+    # The last one is the key blobs from before envelope encryption were encrypted with
+    previous_aes_keys: list[AESKey] = []
+    cipher: CipherAlgorithm = CipherAlgorithm.AES_EAX
+    encryption_segment_size: int = Field(default=64 * 1024, gt=0, le=2**32 - 1)
+    encryption_workers: int = Field(default=1, gt=0)
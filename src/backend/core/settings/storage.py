@@ -1,7 +1,59 @@
+import importlib.util
 import pathlib
+import zlib
 
+from pydantic import Field, NonNegativeInt, PositiveInt, ValidationInfo, field_validator
 from pydantic_settings import BaseSettings
 
+from backend.storage.constants import CompressionAlgorithm, SupportedFileTypes
+
+# Levels accepted by `zlib.compressobj` and by `ZstdCompressor` (ZSTD_minCLevel()..ZSTD_maxCLevel(), 0 is default)
+COMPRESSION_LEVELS = {
+    CompressionAlgorithm.ZLIB: (zlib.Z_DEFAULT_COMPRESSION, zlib.Z_BEST_COMPRESSION),
+    CompressionAlgorithm.ZSTD: (-(1 << 17), 22),
+}
+
 
 class StorageSettings(BaseSettings):
     storage_path: pathlib.Path
+    storage_compression: CompressionAlgorithm | None = None
+    storage_compression_level: int | None = None
+    storage_compressed_file_types: list[SupportedFileTypes] = [SupportedFileTypes.PDF]
+    # Don't decode images on upload: icons are built on first request or by a background pass
+    storage_lazy_thumbnails: bool = False
+    storage_thumbnail_interval: float = Field(default=60, gt=0)
+    # Extra image sizes built from the same decode as the icon, e.g. {"preview": [512, 512], "gallery": [1024, 1024]}
+    storage_renditions: dict[str, tuple[PositiveInt, PositiveInt]] = {}
+    # Thumbnails are stored as PNG and, if Pillow is built with libwebp, as WebP too
+    storage_thumbnail_webp: bool = True
+    # Images decoding to more pixels (about 4 bytes each) get a fallback icon. JPEG counts after draft downscaling
+    storage_thumbnail_max_pixels: PositiveInt = 40_000_000
+    # Per process read-through cache of file meta, 0 entries disables it.
+    # Writes of other processes invalidate it through a change stream (replica sets only). Without one,
+    # fallback TTL bounds how long they may go unnoticed, by default 0: the cache is off until the stream is open
+    storage_meta_cache_entries: NonNegativeInt = 10_000
+    storage_meta_cache_bytes: PositiveInt = 64 * 1024 * 1024
+    storage_meta_cache_ttl: float = Field(default=300, ge=0)
+    storage_meta_cache_fallback_ttl: float = Field(default=0, ge=0)
+
+    @field_validator("storage_compression")
+    @classmethod
+    def check_compression(cls, v: CompressionAlgorithm | None) -> CompressionAlgorithm | None:
+        # Checked on start, uploads would fail one by one otherwise
+        if v == CompressionAlgorithm.ZSTD and importlib.util.find_spec("zstandard") is None:
+            msg = "zstd compression requires `zstandard` package, install `zstd` extra"
+            raise ValueError(msg)
+        return v
+
+    @field_validator("storage_compression_level")
+    @classmethod
+    def check_compression_level(cls, v: int | None, info: ValidationInfo) -> int | None:
+        compression = info.data.get("storage_compression")
+        if v is None or compression is None:
+            return v
+
+        min_level, max_level = COMPRESSION_LEVELS[compression]
+        if not min_level <= v <= max_level:
+            msg = f"{compression.value} compression level must be from {min_level} to {max_level}, got {v}"
+            raise ValueError(msg)
+        return v
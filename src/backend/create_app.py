@@ -5,7 +5,16 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
 from backend.core.api.router import api_router
-from backend.core.events import setup_mongo, teardown_mongo
+from backend.core.events import (
+    setup_cache_invalidator,
+    setup_executor,
+    setup_mongo,
+    setup_thumbnail_worker,
+    teardown_cache_invalidator,
+    teardown_executor,
+    teardown_mongo,
+    teardown_thumbnail_worker,
+)
 from backend.core.logging_config import logging_setup
 from backend.core.middlewares import set_middlewares
 from backend.core.settings import get_settings
@@ -16,7 +25,13 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
     await setup_mongo()
+    setup_executor()
+    thumbnail_worker = setup_thumbnail_worker()
+    cache_invalidator = setup_cache_invalidator()
     yield
+    await teardown_cache_invalidator(cache_invalidator)
+    await teardown_thumbnail_worker(thumbnail_worker)
+    teardown_executor()
     await teardown_mongo()
 
 
@@ -0,0 +1,119 @@
+"""
+Rebuild icons and renditions of all files after `THUMBNAIL_SIZE`, `STORAGE_RENDITIONS` or thumbnail formats change.
+
+Files are read in `_id` order in batches, decrypted and decoded in a pool of `--workers` low priority processes,
+and their meta is updated with one bulk write per batch. `--max-rate` caps files per second, so the command
+can run next to the application:
+    PYTHONPATH=src python -m backend.storage.commands.backfill_thumbnails --workers 2 --max-rate 20
+The last processed `_id` is saved to `--checkpoint` after every batch, an interrupted run continues from there.
+The checkpoint is removed when the command finishes.
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from beanie import PydanticObjectId
+
+from backend.core.events import setup_mongo, teardown_mongo
+from backend.core.executor import CPUExecutor
+from backend.core.metrics import get_metrics_registry
+from backend.storage.controllers.file_meta import FileMetaController
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
+from backend.storage.dao.os_file_meta import OSFileMetaDAO
+
+WORKER_NICENESS = 10
+
+
+async def _run(*, workers: int, checkpoint: pathlib.Path, batch_size: int, max_rate: float | None) -> int:
+    await setup_mongo()
+    executor = CPUExecutor(
+        ProcessPoolExecutor(max_workers=workers, initializer=_lower_priority),
+        get_metrics_registry(),
+    )
+    controller = FileMetaController(
+        db_dao=MongoFileMetaDAO(),
+        os_dao=OSFileMetaDAO(),
+        thumbnail_dao=MongoThumbnailDAO(),
+    )
+    try:
+        return await backfill_thumbnails(
+            controller,
+            executor,
+            checkpoint=checkpoint,
+            batch_size=batch_size,
+            max_rate=max_rate,
+        )
+    finally:
+        executor.shutdown()
+        await teardown_mongo()
+
+
+async def backfill_thumbnails(
+    controller: FileMetaController,
+    executor: CPUExecutor,
+    *,
+    checkpoint: pathlib.Path | None = None,
+    batch_size: int = 100,
+    max_rate: float | None = None,
+) -> int:
+    last_id = _read_checkpoint(checkpoint)
+    updated = 0
+
+    while db_files := await controller.db_dao.get_thumbnail_sources(after=last_id, limit=batch_size):
+        started_at = time.monotonic()
+        updated += await controller.rebuild_thumbnails(db_files, executor=executor)
+        last_id = db_files[-1].id
+        _write_checkpoint(checkpoint, last_id)
+
+        if max_rate:
+            await asyncio.sleep(max(len(db_files) / max_rate - (time.monotonic() - started_at), 0))
+
+    if checkpoint:
+        checkpoint.unlink(missing_ok=True)
+    return updated
+
+
+def _read_checkpoint(checkpoint: pathlib.Path | None) -> PydanticObjectId | None:
+    if not checkpoint or not checkpoint.exists():
+        return None
+    return PydanticObjectId(checkpoint.read_text().strip())
+
+
+def _write_checkpoint(checkpoint: pathlib.Path | None, last_id: PydanticObjectId) -> None:
+    if not checkpoint:
+        return
+
+    temp_checkpoint = checkpoint.with_name(f"{checkpoint.name}.tmp")
+    _ = temp_checkpoint.write_text(str(last_id))
+    _ = temp_checkpoint.replace(checkpoint)
+
+
+def _lower_priority() -> None:
+    _ = os.nice(WORKER_NICENESS)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--workers", type=int, default=2, help="processes decoding images")
+    _ = parser.add_argument("--batch-size", type=int, default=100, help="files read and written per round trip")
+    _ = parser.add_argument("--max-rate", type=float, default=None, help="files per second, unlimited by default")
+    _ = parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        default=pathlib.Path("thumbnail_backfill.checkpoint"),
+        help="file keeping progress of an interrupted run",
+    )
+    args = parser.parse_args()
+
+    updated = asyncio.run(
+        _run(workers=args.workers, checkpoint=args.checkpoint, batch_size=args.batch_size, max_rate=args.max_rate),
+    )
+    print(f"Rebuilt thumbnails of {updated} files")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
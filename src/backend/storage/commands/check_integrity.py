@@ -0,0 +1,49 @@
+"""
+Check that file meta in mongo and the storage tree match.
+
+Both sides are streamed in one sorted pass, so the check runs in constant memory on any storage size.
+Progress goes to stderr. With `--repair`, meta of missing files is deleted and meta of unknown directories
+is created; files without meta are only reported:
+    PYTHONPATH=src python -m backend.storage.commands.check_integrity --repair
+"""
+import argparse
+import asyncio
+import sys
+
+from backend.core.events import setup_mongo, teardown_mongo
+from backend.storage.controllers.dir_meta import DirMetaController, IntegrityReport
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao.os_file_meta import OSFileMetaDAO
+
+
+def _print_progress(report: IntegrityReport) -> None:
+    print(  # noqa: T201
+        f"Checked {report.checked}: {report.not_in_db} not in DB, {report.not_in_os} not in OS,"
+        f" {report.repaired} repaired",
+        file=sys.stderr,
+    )
+
+
+async def _run(*, repair: bool, batch_size: int) -> IntegrityReport:
+    await setup_mongo()
+    try:
+        controller = DirMetaController(db_dao=MongoFileMetaDAO(), os_dao=OSFileMetaDAO())
+        return await controller.check_integrity(repair=repair, batch_size=batch_size, on_progress=_print_progress)
+    finally:
+        await teardown_mongo()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--repair", action="store_true", help="fix meta of mismatched files")
+    _ = parser.add_argument("--batch-size", type=int, default=1000, help="items between progress reports and repairs")
+    args = parser.parse_args()
+
+    try:
+        _ = asyncio.run(_run(repair=args.repair, batch_size=args.batch_size))
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Remove duplicated file meta and make the `(path, filename)` index unique.
+
+Older versions checked for an existing file before writing, so concurrent uploads of the same path could leave
+several documents for one file, and the application can't start while they exist. Of every duplicate set
+one document is kept, by `(updated_date, _id)`: the most recently updated one, a document that was never updated
+(no `updated_date`) loses to any updated one, and among those the last inserted wins. Run once before upgrading,
+the command is idempotent:
+    PYTHONPATH=src python -m backend.storage.commands.dedupe_file_meta
+"""
+import argparse
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import DESCENDING
+
+from backend.core.events import get_mongo_database, teardown_mongo
+from backend.storage.documents.file_meta import FileMetaDocument
+
+PATH_INDEX_NAME = "unique file path"
+
+
+async def _run() -> int:
+    # Beanie isn't initialized: it would fail to create the unique index over duplicates
+    collection = get_mongo_database()[FileMetaDocument.Settings.name]
+    try:
+        deleted = await dedupe_file_meta(collection)
+        await make_path_index_unique(collection)
+    finally:
+        await teardown_mongo()
+    return deleted
+
+
+async def dedupe_file_meta(collection: AsyncIOMotorCollection) -> int:
+    """Delete all but the newest document of every `(path, filename)`, returns the number of deleted documents."""
+    # Mongo sorts a missing `updated_date` like null, before any date (stored as strings). `_id` breaks ties:
+    # it's unique and grows with insertion time, so the winner never depends on the order documents are read in
+    deleted = 0
+
+    duplicates = collection.aggregate(
+        [
+            {"$group": {"_id": {"path": "$path", "filename": "$filename"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    async for duplicate in duplicates:
+        documents = collection.find(
+            duplicate["_id"],
+            projection={"_id": True},
+            sort=[("updated_date", DESCENDING), ("_id", DESCENDING)],
+        )
+        _, *stale_ids = [document["_id"] async for document in documents]
+        result = await collection.delete_many({"_id": {"$in": stale_ids}})
+        deleted += result.deleted_count
+
+    return deleted
+
+
+async def make_path_index_unique(collection: AsyncIOMotorCollection) -> None:
+    indexes = await collection.index_information()
+    if indexes.get(PATH_INDEX_NAME, {}).get("unique"):
+        return
+
+    if PATH_INDEX_NAME in indexes:
+        await collection.drop_index(PATH_INDEX_NAME)
+    _ = await collection.create_indexes(
+        [index for index in FileMetaDocument.Settings.indexes if index.document["name"] == PATH_INDEX_NAME],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.parse_args()
+
+    deleted = asyncio.run(_run())
+    print(f"Deleted {deleted} duplicated documents, {PATH_INDEX_NAME} index is unique")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
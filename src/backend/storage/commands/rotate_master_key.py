@@ -0,0 +1,47 @@
+"""
+Re-wrap data keys of all files with the current master key.
+
+Blobs are not touched, only a few bytes of meta per file are rewritten. To rotate the master key
+put the new one to `SECURITY_AES_KEY` and the old one to `SECURITY_PREVIOUS_AES_KEYS`, restart the application and run:
+    PYTHONPATH=src python -m backend.storage.commands.rotate_master_key
+When it finishes, the old key can be removed from `SECURITY_PREVIOUS_AES_KEYS`.
+The command can be interrupted and run again, already rotated files are skipped.
+"""
+import argparse
+import asyncio
+
+from backend.core.events import setup_mongo, teardown_mongo
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.keys import get_current_key_id, rewrap_key
+
+
+async def _run(*, batch_size: int) -> int:
+    await setup_mongo()
+    try:
+        return await rotate_master_key(MongoFileMetaDAO(), batch_size=batch_size)
+    finally:
+        await teardown_mongo()
+
+
+async def rotate_master_key(db_dao: MongoFileMetaDAO, *, batch_size: int = 1000) -> int:
+    key_id = get_current_key_id()
+    rotated = 0
+
+    async for batch in db_dao.get_keys_to_rotate(key_id, batch_size=batch_size):
+        keys = [(file_key, *rewrap_key(file_key.data_key, file_key.key_id)) for file_key in batch]
+        rotated += await db_dao.update_keys(keys)
+
+    return rotated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--batch-size", type=int, default=1000, help="files read and written per round trip")
+    args = parser.parse_args()
+
+    rotated = asyncio.run(_run(batch_size=args.batch_size))
+    print(f"Re-wrapped keys of {rotated} files with master key {get_current_key_id()}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
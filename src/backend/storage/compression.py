@@ -0,0 +1,107 @@
+import io
+import zlib
+from collections.abc import Iterable, Iterator
+from types import ModuleType
+from typing import TYPE_CHECKING, BinaryIO
+
+from backend.core.settings import get_settings
+from backend.storage.constants import CompressionAlgorithm, SupportedFileTypes
+from backend.storage.typing_ import BytesChunk
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_compression(file_type: SupportedFileTypes) -> tuple[CompressionAlgorithm | None, int | None]:
+    settings = get_settings()
+
+    if not settings.storage_compression or file_type not in settings.storage_compressed_file_types:
+        return None, None
+    return settings.storage_compression, settings.storage_compression_level
+
+
+def compress_stream(
+    raw_file: BinaryIO,
+    algorithm: CompressionAlgorithm,
+    level: int | None = None,
+) -> Iterator[bytes]:
+    match algorithm:
+        case CompressionAlgorithm.ZLIB:
+            yield from _zlib_compress_stream(raw_file, level)
+        case CompressionAlgorithm.ZSTD:
+            compressor = _get_zstandard().ZstdCompressor(level=3 if level is None else level)
+            yield from compressor.read_to_iter(raw_file, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+
+
+def decompress_stream(chunks: Iterable[BytesChunk], algorithm: CompressionAlgorithm) -> Iterator[bytes]:
+    """Decompress `chunks` lazily, never inflating more than `CHUNK_SIZE` bytes at once."""
+    match algorithm:
+        case CompressionAlgorithm.ZLIB:
+            yield from _zlib_decompress_stream(chunks)
+        case CompressionAlgorithm.ZSTD:
+            decompressor = _get_zstandard().ZstdDecompressor()
+            yield from decompressor.read_to_iter(IterStream(chunks), read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+
+
+class IterStream(io.RawIOBase):
+
+    """Read-only file object over an iterable of bytes chunks."""
+
+    def __init__(self, chunks: Iterable[BytesChunk]) -> None:
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._leftover = memoryview(b"")
+
+    def readable(self) -> bool:  # noqa: FNE005
+        return True
+
+    def readinto(self, buffer: "WriteableBuffer") -> int:
+        while not self._leftover:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._leftover = memoryview(chunk)
+
+        output = memoryview(buffer).cast("B")
+        size = min(len(output), len(self._leftover))
+        output[:size] = self._leftover[:size]
+        self._leftover = self._leftover[size:]
+        return size
+
+
+def _zlib_compress_stream(raw_file: BinaryIO, level: int | None) -> Iterator[bytes]:
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+
+    while chunk := raw_file.read(CHUNK_SIZE):
+        if compressed_chunk := compressor.compress(chunk):
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def _zlib_decompress_stream(chunks: Iterable[BytesChunk]) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj()
+
+    for chunk in chunks:
+        data = chunk
+        while data:
+            if raw_chunk := decompressor.decompress(data, CHUNK_SIZE):
+                yield raw_chunk
+            data = decompressor.unconsumed_tail
+
+    if raw_chunk := decompressor.flush():
+        yield raw_chunk
+    if not decompressor.eof:
+        raise ValueError("Compressed stream is truncated")
+
+
+def _get_zstandard() -> ModuleType:
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires `zstandard` package to be installed")
+    return zstandard
@@ -10,6 +10,31 @@ class SupportedFileTypes(str, enum.Enum):
     PDF = "pdf"
 
 
+class CipherAlgorithm(str, enum.Enum):
+    AES_EAX = "aes-eax"
+    AES_GCM = "aes-gcm"
+    CHACHA20_POLY1305 = "chacha20-poly1305"
+
+
+class CompressionAlgorithm(str, enum.Enum):
+    ZLIB = "zlib"
+    ZSTD = "zstd"
+
+
+class ListingSort(str, enum.Enum):
+    # Values are file meta fields
+    NAME = "filename"
+    CREATED_DATE = "created_date"
+
+
+class ThumbnailFormat(str, enum.Enum):
+    # Values are also Pillow format names and `image/*` media subtypes
+    PNG = "png"
+    WEBP = "webp"
+
+
 THUMBNAIL_SIZE = (128, 128)
+ICON_RENDITION = "icon"
 STATIC_DIR = pathlib.Path(__file__).parent / "static"
 PDF_THUMBNAIL = STATIC_DIR / "pdf-icon-128.png"
+PDF_PREVIEW = STATIC_DIR / "pdf-icon-392.png"
@@ -1,14 +1,44 @@
+import base64
+import contextlib
 import logging
+from collections.abc import Callable, Sequence
 from typing import AsyncIterator
 
-from backend.storage.constants import SupportedFileTypes
+from pydantic import BaseModel
+
+from backend.core.executor import get_executor, prefetch
+from backend.storage.constants import ListingSort, SupportedFileTypes
 from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
 from backend.storage.dao.os_file_meta import OSFileMetaDAO
-from backend.storage.dao_schemas.file_meta import DirMetaDAOSchema
+from backend.storage.dao_schemas.file_meta import (
+    DirMetaDAOSchema,
+    DirStatsDAOSchema,
+    FileListItem,
+    ListingCursor,
+)
 from backend.storage.typing_ import FileName, FilePath, OptionalFileAttributes
 
 logger = logging.getLogger(__name__)
 
+LS_PAGE_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+OS_PREFETCH_DIRS = 64
+
+
+class IntegrityReport(BaseModel):
+
+    """Counts of an integrity check, `errors` keeps only the first `MAX_REPORTED_ERRORS` messages."""
+
+    checked: int = 0
+    not_in_db: int = 0
+    not_in_os: int = 0
+    repaired: int = 0
+    errors: list[str] = []
+
+    def add_error(self, message: str) -> None:
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
 
 class DirMetaController:
     def __init__(self, db_dao: MongoFileMetaDAO, os_dao: OSFileMetaDAO) -> None:
@@ -23,17 +53,17 @@ class DirMetaController:
         new_path: FilePath,
         new_filename: FileName,
     ) -> None:
-        _ = await self.create_dir(path=new_path, filename=new_filename)
+        _ = self.os_dao.create_dir(path=new_path, filename=new_filename, exist_ok=True)
 
         self.os_dao.rename(old_path=old_path / old_filename, new_path=new_path / new_filename)
 
+        # The directory document keeps its aggregates, the subtree moves them between parents
         data_to_update = OptionalFileAttributes({"path": new_path, "filename": new_filename})
         await self.db_dao.update(path=old_path, filename=old_filename, data_to_update=data_to_update)
-        await self.db_dao.regex_update(
-            key="path",
-            old_value=str(old_path / old_filename),
-            new_value=str(new_path / new_filename),
-        )
+        await self.db_dao.move_subtree(old_path / old_filename, new_path / new_filename)
+        # Meta of a directory that was only in the filesystem
+        schema = DirMetaDAOSchema(path=new_path, filename=new_filename, type_=SupportedFileTypes.DIR)
+        await self.db_dao.save(schema, replace=True)
 
         await self.delete_dir(path=old_path, filename=old_filename)
 
@@ -45,38 +75,214 @@ class DirMetaController:
 
         return file_path
 
+    async def create_dirs(self, dirs: Sequence[tuple[FilePath, FileName]]) -> list[Exception | None]:
+        """Create many `(path, filename)` directories with one bulk write of meta, returns an error or `None` each."""
+        errors: list[Exception | None] = [None] * len(dirs)
+        schemas: dict[int, DirMetaDAOSchema] = {}
+
+        for index, (path, filename) in enumerate(dirs):
+            try:
+                _ = self.os_dao.create_dir(path=path, filename=filename, exist_ok=True)
+            except OSError as e:
+                errors[index] = e
+                continue
+            schemas[index] = DirMetaDAOSchema(path=path, filename=filename, type_=SupportedFileTypes.DIR)
+
+        save_errors = await self.db_dao.save_many(list(schemas.values()), replace=True)
+        for index, error in zip(schemas, save_errors, strict=True):
+            errors[index] = error
+
+        return errors
+
+    async def get_dir_stats(self, *, path: FilePath, filename: FileName) -> DirStatsDAOSchema:
+        """Return total size, number of files and last change time of the whole subtree, without walking it."""
+        stats = await self.db_dao.get_dir_stats(path=path, filename=filename)
+        if stats is None:
+            raise FileNotFoundError(f"{path / filename} is not exists")
+        return stats
+
     async def delete_dir(self, *, path: FilePath, filename: FileName) -> None:
         self.os_dao.delete(path=path / filename)
-        await self.db_dao.regex_delete(
-            key="path",
-            value=str(path / filename),
-        )
+        await self.db_dao.delete_subtree(path / filename)
         await self.db_dao.delete(path=path, filename=filename)
 
-    async def ls(self, *, path: FilePath) -> AsyncIterator[FilePath]:
-        async for document in self.db_dao.ls(path):
-            if not self.os_dao.is_exists(document.path / document.filename):
-                await self.db_dao.delete(path=document.path, filename=document.filename)
-                continue
-            yield document.path / document.filename
+    async def ls(self, *, path: FilePath, sort: ListingSort = ListingSort.NAME) -> AsyncIterator[FilePath]:
+        cursor = None
+        while True:
+            items, cursor = await self.ls_page(path=path, page_size=LS_PAGE_SIZE, sort=sort, cursor=cursor)
+            for item in items:
+                yield item
+            if cursor is None:
+                return
+
+    async def ls_page(
+        self,
+        *,
+        path: FilePath,
+        page_size: int,
+        sort: ListingSort = ListingSort.NAME,
+        cursor: str | None = None,
+    ) -> tuple[list[FilePath], str | None]:
+        """
+        Return a page of `path` items and the cursor of the next page, `None` after the last one.
+
+        The page is checked against one `scandir` of `path`, run in the executor after the page is read, so a file
+        uploaded meanwhile is in it. Items missing in the filesystem are checked once more, skipped and removed from DB
+        with one query, so a page may be shorter than `page_size`.
+        """
+        if page_size < 1:
+            raise ValueError(f"Page size must be positive, got {page_size}")
+
+        documents = await self.db_dao.ls_page(path, limit=page_size + 1, sort=sort, after=_decode_cursor(cursor))
+
+        next_cursor = _encode_cursor(documents[page_size - 1]) if len(documents) > page_size else None
+        filenames = [document.filename for document in documents[:page_size]]
+        missing = await get_executor().run(_get_missing_in_os, self.os_dao, path, filenames)
+        await self.db_dao.delete_many(path=path, filenames=missing)
+
+        items = [path / filename for filename in filenames if filename not in missing]
+        return items, next_cursor
+
+    async def check_integrity(
+        self,
+        *,
+        repair: bool = False,
+        batch_size: int = 1000,
+        on_progress: Callable[[IntegrityReport], None] | None = None,
+    ) -> IntegrityReport:
+        """
+        Merge-join file meta with the storage tree, both streamed in `(path, filename)` order.
+
+        The tree is walked in a thread while mongo is read. `on_progress` gets the report every `batch_size`
+        checked items. With `repair`, meta of missing files is deleted and meta of unknown directories is created,
+        in bulk; unknown files are only reported, they can't be decrypted without meta. The walk may be long over
+        by then, so every item is checked in the filesystem once more right before its meta is changed.
+        Without `repair`, `FileNotFoundError` is raised if anything doesn't match.
+        """
+        report = IntegrityReport()
+        stale_files: list[tuple[FilePath, FileName]] = []
+        unknown_dirs: list[DirMetaDAOSchema] = []
+
+        async for path, filename, in_db, in_os, is_dir in self._join_with_os():
+            report.checked += 1
+            if in_db and not in_os:
+                report.add_error(f"NOT IN OS: {path / filename}")
+                report.not_in_os += 1
+                logger.warning(f"Path {path / filename} exists in mongo, but not exist really")
+                stale_files.append((path, filename))
+            elif in_os and not in_db:
+                report.add_error(f"NOT IN DB: {path / filename}")
+                report.not_in_db += 1
+                logger.warning(f"Path {path / filename} exists in filesystem, but not exist in mongo")
+                if is_dir:
+                    unknown_dirs.append(DirMetaDAOSchema(path=path, filename=filename, type_=SupportedFileTypes.DIR))
+
+            if repair and len(stale_files) + len(unknown_dirs) >= batch_size:
+                report.repaired += await self._repair(stale_files, unknown_dirs)
+            if on_progress and report.checked % batch_size == 0:
+                on_progress(report)
+
+        if repair:
+            report.repaired += await self._repair(stale_files, unknown_dirs)
+        if on_progress:
+            on_progress(report)
+
+        if report.errors and not repair:
+            str_errors = "\n".join(report.errors)
+            raise FileNotFoundError(
+                f"Files: \n{str_errors}\n not exists ({report.not_in_os} not in OS, {report.not_in_db} not in DB)",
+            )
+        return report
+
+    async def _join_with_os(self) -> AsyncIterator[tuple[FilePath, FileName, bool, bool, bool]]:
+        """Yield `(path, filename, in_db, in_os, is_dir)` of every item either in mongo or in the storage tree."""
+        root = self.os_dao.get_root()
+        async with contextlib.aclosing(self.db_dao.get_all()) as db_documents, contextlib.aclosing(
+            _iter_os_entries(self.os_dao),
+        ) as os_entries:
+            document = await anext(db_documents, None)
+            os_entry = await anext(os_entries, None)
+
+            while document or os_entry:
+                if document and not _is_in_tree(document.path, root):
+                    # Not in the walk, checked on its own
+                    in_os = self.os_dao.is_exists(document.path / document.filename)
+                    yield document.path, document.filename, True, in_os, document.type_ == SupportedFileTypes.DIR
+                    document = await anext(db_documents, None)
+                    continue
+
+                db_key = (str(document.path), document.filename) if document else None
+                os_key = os_entry[:2] if os_entry else None
+
+                if document and (os_key is None or (db_key and db_key < os_key)):
+                    yield document.path, document.filename, True, False, document.type_ == SupportedFileTypes.DIR
+                    document = await anext(db_documents, None)
+                elif os_entry and (db_key is None or (os_key and os_key < db_key)):
+                    path, filename, is_dir = os_entry
+                    yield FilePath(path), filename, False, True, is_dir
+                    os_entry = await anext(os_entries, None)
+                elif document and os_entry:
+                    yield document.path, document.filename, True, True, os_entry[2]
+                    document = await anext(db_documents, None)
+                    os_entry = await anext(os_entries, None)
+
+    async def _repair(self, stale_files: list[tuple[FilePath, FileName]], unknown_dirs: list[DirMetaDAOSchema]) -> int:
+        # Files uploaded and directories deleted since the walk are left alone
+        executor = get_executor()
+        missing_files = await executor.run(_get_missing_files, self.os_dao, stale_files)
+        existing_dirs = await executor.run(_get_existing_dirs, self.os_dao, unknown_dirs)
+
+        repaired = await self.db_dao.delete_files(missing_files)
+        errors = await self.db_dao.save_many(existing_dirs, replace=True)
+        repaired += errors.count(None)
+
+        stale_files.clear()
+        unknown_dirs.clear()
+        return repaired
+
+
+def _get_missing_in_os(os_dao: OSFileMetaDAO, path: FilePath, filenames: list[FileName]) -> list[FileName]:
+    """Return `filenames` missing in directory `path`, one `scandir` and a `stat` of every missing one."""
+    os_names = os_dao.get_names(path)
+    # The file may be created after the scan: its meta is written before its blob is moved in place
+    return [filename for filename in filenames if filename not in os_names and not os_dao.is_exists(path / filename)]
+
+
+def _get_missing_files(
+    os_dao: OSFileMetaDAO,
+    files: list[tuple[FilePath, FileName]],
+) -> list[tuple[FilePath, FileName]]:
+    return [(path, filename) for path, filename in files if not os_dao.is_exists(path / filename)]
+
+
+def _get_existing_dirs(os_dao: OSFileMetaDAO, dirs: list[DirMetaDAOSchema]) -> list[DirMetaDAOSchema]:
+    return [schema for schema in dirs if os_dao.is_exists(schema.path / schema.filename)]
+
+
+def _is_in_tree(path: FilePath, root: FilePath) -> bool:
+    return path == root or root in path.parents
+
+
+async def _iter_os_entries(os_dao: OSFileMetaDAO) -> AsyncIterator[tuple[str, FileName, bool]]:
+    async for directory, entries in prefetch(os_dao.walk_sorted(), size=OS_PREFETCH_DIRS):
+        for name, is_dir in entries:
+            yield str(directory), name, is_dir
 
-    async def check_integrity(self) -> None:
-        errors = []
 
-        for os_filepath in self.os_dao.get_all():
-            path = os_filepath.parent
-            filename = FileName(os_filepath.name)
+def _encode_cursor(document: FileListItem) -> str:
+    cursor = ListingCursor(
+        is_dir=document.type_ == SupportedFileTypes.DIR,
+        filename=document.filename,
+        created_date=document.created_date,
+    )
+    return base64.urlsafe_b64encode(cursor.model_dump_json().encode()).decode()
 
-            if not await self.db_dao.is_exists(filename=filename, path=path):
-                errors.append(f"NOT IN DB: {os_filepath}")
-                logger.warning(f"Path {os_filepath} exists in filesystem, but not exist in mongo")
 
-        async for document in self.db_dao.get_all():
-            db_filepath = document.path / document.filename
-            if not self.os_dao.is_exists(db_filepath):
-                errors.append(f"NOT IN OS: {db_filepath}")
-                logger.warning(f"Path {db_filepath} exists in mongo, but not exist really")
+def _decode_cursor(cursor: str | None) -> ListingCursor | None:
+    if cursor is None:
+        return None
 
-        if errors:
-            str_errors = "\n".join(errors)
-            raise FileNotFoundError(f"Files: \n{str_errors}\n not exists")
+    try:
+        return ListingCursor.model_validate_json(base64.urlsafe_b64decode(cursor))
+    except ValueError as e:
+        raise ValueError("Invalid listing cursor") from e
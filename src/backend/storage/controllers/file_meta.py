@@ -1,36 +1,246 @@
+import asyncio
 import io
 import logging
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import BinaryIO
 
+from beanie import PydanticObjectId
+
+from backend.core.executor import CPUExecutor, get_executor
+from backend.core.metrics import get_metrics_registry
+from backend.core.settings import get_settings
+from backend.storage.compression import IterStream, compress_stream, decompress_stream, get_compression
+from backend.storage.constants import ICON_RENDITION, SupportedFileTypes, ThumbnailFormat
 from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
 from backend.storage.dao.os_file_meta import OSFileMetaDAO
 from backend.storage.dao_schemas.file_meta import FileMetaDAOSchema
-from backend.storage.encryption import decrypt, encrypt
-from backend.storage.icon import get_thumbnail
+from backend.storage.encryption import decrypt_stream, encrypt_stream, new_nonce
+from backend.storage.icon import (
+    ImageTooLargeError,
+    Rendition,
+    Size,
+    UndecodableImageError,
+    get_fallback_renditions,
+    get_rendition_sizes,
+    get_renditions,
+    get_thumbnail_formats,
+    get_thumbnail_hash,
+)
+from backend.storage.keys import get_data_key, new_data_key, wrap_key
 from backend.storage.path_helper import get_file_type
-from backend.storage.typing_ import FileName, FilePath
+from backend.storage.typing_ import BytesChunk, FileName, FilePath
 
 logger = logging.getLogger(__name__)
 
 
 class FileMetaController:
-    def __init__(self, db_dao: MongoFileMetaDAO, os_dao: OSFileMetaDAO) -> None:
+    def __init__(self, db_dao: MongoFileMetaDAO, os_dao: OSFileMetaDAO, thumbnail_dao: MongoThumbnailDAO) -> None:
         self.db_dao = db_dao
         self.os_dao = os_dao
+        self.thumbnail_dao = thumbnail_dao
 
     async def create_file(self, *, path: FilePath, filename: FileName, data: io.BytesIO, replace: bool) -> None:
-        file_type = get_file_type(filename)
-        icon = get_thumbnail(file_type=file_type, file_=data)
-        encrypted_data, nonce = encrypt(data)
+        renditions = await self._build_new_renditions(path=path, filename=filename, data=data)
+        (thumbnail_hashes,) = await self._save_thumbnails(renditions)
+        schema = self._new_schema(path=path, filename=filename, data=data, thumbnail_hashes=thumbnail_hashes)
+        previous = await self.db_dao.get(path=path, filename=filename, use_cache=False) if replace else None
+
+        # The blob is encrypted aside first: until the meta is saved, readers get the previous file as a whole
+        temp_path = await get_executor().run(_encrypt_to_temp, self.os_dao, schema=schema, data=data)
+        commit_error: OSError | None = None
 
-        schema = FileMetaDAOSchema(path=path, filename=filename, type_=file_type, icon=icon, nonce=nonce)
+        def commit() -> None:
+            nonlocal commit_error
+            commit_error = self._commit_blob(schema, temp_path)
 
         try:
-            await self.db_dao.save(schema, replace=replace)
+            await self.db_dao.save(schema, replace=replace, on_saved=commit)
         except FileExistsError:
+            self.os_dao.discard(temp_path)
             self.os_dao.delete(path=path / filename)
             raise
+        except BaseException:
+            self.os_dao.discard(temp_path)
+            raise
+
+        if commit_error:
+            await self._restore(schema, previous)
+            raise commit_error
+
+    async def create_files(
+        self,
+        files: Sequence[tuple[FilePath, FileName, io.BytesIO]],
+        *,
+        replace: bool,
+    ) -> list[Exception | None]:
+        """
+        Create many `(path, filename, data)` files at once, returns an error or `None` per file.
+
+        Thumbnails are built and blobs encrypted aside concurrently in the executor, thumbnails and meta
+        of all files are written with one bulk write each. Blobs are moved in place once their meta is written,
+        like `create_file` does. A failed file doesn't stop the rest, a failed replace keeps the previous file.
+        """
+        errors: list[Exception | None] = [None] * len(files)
+        files_renditions: dict[int, dict[str, Rendition]] = {}
+        results = await asyncio.gather(
+            *(self._build_new_renditions(path=path, filename=filename, data=data) for path, filename, data in files),
+            return_exceptions=True,
+        )
+        for index, result in enumerate(results):
+            if isinstance(result, dict):
+                files_renditions[index] = result
+            elif isinstance(result, Exception):
+                errors[index] = result
+            else:
+                raise result
+
+        files_hashes = await self._save_thumbnails(*files_renditions.values())
+        schemas = {
+            index: self._new_schema(
+                path=files[index][0],
+                filename=files[index][1],
+                data=files[index][2],
+                thumbnail_hashes=thumbnail_hashes,
+            )
+            for index, thumbnail_hashes in zip(files_renditions, files_hashes, strict=True)
+        }
+
+        temp_paths = await self._encrypt_files_to_temp(schemas, [data for _, _, data in files], errors)
+        await self._save_files(schemas, temp_paths, errors, replace=replace)
+        return errors
+
+    async def _encrypt_files_to_temp(
+        self,
+        schemas: dict[int, FileMetaDAOSchema],
+        files_data: Sequence[io.BytesIO],
+        errors: list[Exception | None],
+    ) -> dict[int, FilePath]:
+        """Stage blobs of `schemas` by file index concurrently, files that fail are taken out of `schemas`."""
+        executor = get_executor()
+        results = await asyncio.gather(
+            *(
+                executor.run(_encrypt_to_temp, self.os_dao, schema=schema, data=files_data[index])
+                for index, schema in schemas.items()
+            ),
+            return_exceptions=True,
+        )
+
+        temp_paths: dict[int, FilePath] = {}
+        for index, result in zip(list(schemas), results, strict=True):
+            if isinstance(result, Exception):
+                errors[index] = result
+                del schemas[index]
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                temp_paths[index] = result
+        return temp_paths
+
+    async def _save_files(
+        self,
+        schemas: dict[int, FileMetaDAOSchema],
+        temp_paths: dict[int, FilePath],
+        errors: list[Exception | None],
+        *,
+        replace: bool,
+    ) -> None:
+        """Save meta of staged files in one bulk write, moving blobs of saved files in place right after it."""
+        keys = [(schema.path, schema.filename) for schema in schemas.values()]
+        previous = await self.db_dao.get_many(keys) if replace else {}
+        not_committed: list[int] = []
+
+        def commit(save_errors: list[Exception | None]) -> None:
+            for index, error in zip(schemas, save_errors, strict=True):
+                if error:
+                    errors[index] = error
+                elif commit_error := self._commit_blob(schemas[index], temp_paths[index]):
+                    errors[index] = commit_error
+                    not_committed.append(index)
+
+        try:
+            _ = await self.db_dao.save_many(list(schemas.values()), replace=replace, on_saved=commit)
+        finally:
+            # Blobs of files whose meta wasn't saved
+            for temp_path in temp_paths.values():
+                self.os_dao.discard(temp_path)
+
+        for index in not_committed:
+            schema = schemas[index]
+            await self._restore(schema, previous.get((schema.path, schema.filename)))
 
-        self.os_dao.create(data=encrypted_data, filename=filename, path=path, replace=True)
+    def _commit_blob(self, schema: FileMetaDAOSchema, temp_path: FilePath) -> OSError | None:
+        """
+        Move a staged blob in place once its meta is saved, returns the error if it can't be moved.
+
+        It's called by the DAO right after the meta write, with no `await` in between, so listings of this process
+        never see the new meta without its blob and never drop it.
+        """
+        try:
+            self.os_dao.commit(temp_path, path=schema.path, filename=schema.filename)
+        except OSError as e:
+            self.os_dao.discard(temp_path)
+            return e
+        return None
+
+    async def _restore(self, schema: FileMetaDAOSchema, previous: FileMetaDAOSchema | None) -> None:
+        """Put back meta replaced by `schema` whose blob couldn't be written, the previous blob is still in place."""
+        if previous is None:
+            await self.db_dao.delete(path=schema.path, filename=schema.filename)
+            return
+
+        # Validated from a full dump, so every field is written back, also those the previous meta didn't have
+        await self.db_dao.save(FileMetaDAOSchema.model_validate(previous.model_dump()), replace=True)
+
+    async def _build_new_renditions(
+        self,
+        *,
+        path: FilePath,
+        filename: FileName,
+        data: io.BytesIO,
+    ) -> dict[str, Rendition]:
+        file_type = get_file_type(filename)
+        if _is_icon_pending(file_type):
+            return {}
+
+        try:
+            return await get_executor().run(
+                get_renditions,
+                file_type=file_type,
+                file_=data,
+                sizes=get_rendition_sizes(),
+                formats=get_thumbnail_formats(),
+            )
+        except ImageTooLargeError:
+            return self._get_fallback_renditions(path / filename)
+
+    def _new_schema(
+        self,
+        *,
+        path: FilePath,
+        filename: FileName,
+        data: io.BytesIO,
+        thumbnail_hashes: dict[str, str],
+    ) -> FileMetaDAOSchema:
+        file_type = get_file_type(filename)
+        data_key, key_id = wrap_key(new_data_key())
+        compression, compression_level = get_compression(file_type)
+
+        return FileMetaDAOSchema(
+            path=path,
+            filename=filename,
+            type_=file_type,
+            icon_hash=thumbnail_hashes.pop(ICON_RENDITION, None),
+            icon_pending=_is_icon_pending(file_type),
+            renditions=thumbnail_hashes,
+            nonce=new_nonce(),
+            data_key=data_key,
+            key_id=key_id,
+            cipher=get_settings().security.cipher,
+            compression=compression,
+            compression_level=compression_level,
+            size=data.getbuffer().nbytes,
+        )
 
     async def rename_file(
         self,
@@ -42,23 +252,171 @@ class FileMetaController:
     ) -> None:
         _ = await self._get_existed_file_from_db(path=old_path, filename=old_filename)
 
+        # Renaming over another file would overwrite its blob, while its meta stays
+        if await self.db_dao.is_exists(path=new_path, filename=new_filename):
+            raise FileExistsError(f"{new_path}/{new_filename} exists in DB")
+        self.os_dao.check_not_exists(new_path / new_filename)
+
         self.os_dao.rename(old_path=old_path / old_filename, new_path=new_path / new_filename)
-        await self.db_dao.update(
-            path=old_path,
-            filename=old_filename,
-            data_to_update={"filename": new_filename, "path": new_path},
-        )
+        try:
+            await self.db_dao.update(
+                path=old_path,
+                filename=old_filename,
+                data_to_update={"filename": new_filename, "path": new_path},
+            )
+        except BaseException:
+            # E.g. the target was created meanwhile, the blob goes back to its meta
+            self.os_dao.rename(old_path=new_path / new_filename, new_path=old_path / old_filename)
+            raise
 
     async def get_file(self, *, path: FilePath, filename: FileName) -> io.BytesIO:
         db_file = await self._get_existed_file_from_db(path=path, filename=filename)
 
-        encrypted_file = self.os_dao.get(path / filename)
-        decrypted_file = decrypt(encrypted_file, db_file.nonce)
-        return decrypted_file
+        return await get_executor().run(_decrypt_from_os, self.os_dao, schema=db_file)
+
+    async def stream_file(self, *, path: FilePath, filename: FileName) -> AsyncIterator[bytes]:
+        db_file = await self._get_existed_file_from_db(path=path, filename=filename)
+
+        with self.os_dao.get_stream(path / filename) as encrypted_file:
+            async for chunk in get_executor().iterate(_decrypt_stream(encrypted_file, schema=db_file)):
+                yield chunk
+
+    async def get_icon(
+        self,
+        *,
+        path: FilePath,
+        filename: FileName,
+        rendition: str = ICON_RENDITION,
+        image_format: ThumbnailFormat = ThumbnailFormat.PNG,
+    ) -> io.BytesIO | None:
+        db_file = await self._get_existed_file_from_db(path=path, filename=filename)
+
+        if db_file.icon_pending:
+            return (await self._build_renditions(db_file)).get(rendition, {}).get(image_format)
+        if rendition == ICON_RENDITION and db_file.icon_hash is None:
+            return db_file.icon if image_format == ThumbnailFormat.PNG else None
+
+        thumbnail_hash = db_file.icon_hash if rendition == ICON_RENDITION else db_file.renditions.get(rendition)
+        thumbnail = await self.thumbnail_dao.get(thumbnail_hash) if thumbnail_hash else None
+        return io.BytesIO(thumbnail[image_format]) if thumbnail and image_format in thumbnail else None
+
+    async def build_pending_icons(
+        self,
+        *,
+        limit: int,
+        after: PydanticObjectId | None = None,
+    ) -> PydanticObjectId | None:
+        """
+        Build up to `limit` icons left pending by lazy thumbnails mode, in `_id` order starting after `after`.
+
+        Returns `_id` of the last file taken, `None` if none is left. A file which fails is logged and stays pending,
+        passing the returned `_id` as `after` moves past it.
+        """
+        db_files = await self.db_dao.get_pending_icons(after=after, limit=limit)
+        results = await asyncio.gather(
+            *(self._build_renditions(db_file) for db_file in db_files),
+            return_exceptions=True,
+        )
+
+        for db_file, result in zip(db_files, results, strict=True):
+            if isinstance(result, Exception):
+                logger.warning(f"Can't build pending icon of {db_file.path / db_file.filename}", exc_info=result)
+            elif isinstance(result, BaseException):
+                raise result
+        return db_files[-1].id if db_files else None
+
+    async def rebuild_thumbnails(
+        self,
+        db_files: Sequence[FileMetaDAOSchema],
+        *,
+        executor: CPUExecutor | None = None,
+    ) -> int:
+        """
+        Rebuild icons and renditions of `db_files` with current sizes and formats, returns how many files were updated.
+
+        Files are decoded concurrently in `executor`, thumbnails and meta are written with one bulk write each.
+        A file which can't be read is logged and skipped, its meta isn't touched.
+        """
+        executor = executor or get_executor()
+        results = await asyncio.gather(
+            *(self._get_renditions_from_os(db_file, executor) for db_file in db_files),
+            return_exceptions=True,
+        )
+
+        rebuilt: list[tuple[FileMetaDAOSchema, dict[str, Rendition]]] = []
+        for db_file, result in zip(db_files, results, strict=True):
+            if isinstance(result, dict):
+                rebuilt.append((db_file, result))
+            elif isinstance(result, Exception):
+                logger.warning(f"Can't rebuild thumbnails of {db_file.path / db_file.filename}", exc_info=result)
+            else:
+                raise result
+
+        thumbnail_hashes = await self._save_thumbnails(*(renditions for _, renditions in rebuilt))
+        return await self.db_dao.update_renditions(
+            [
+                (db_file, hashes.pop(ICON_RENDITION, None), hashes)
+                for (db_file, _), hashes in zip(rebuilt, thumbnail_hashes, strict=True)
+            ],
+        )
+
+    async def _build_renditions(self, db_file: FileMetaDAOSchema) -> dict[str, Rendition]:
+        renditions = await self._get_renditions_from_os(db_file, get_executor())
+
+        (thumbnail_hashes,) = await self._save_thumbnails(renditions)
+        await self.db_dao.set_renditions(
+            db_file,
+            icon_hash=thumbnail_hashes.pop(ICON_RENDITION, None),
+            renditions=thumbnail_hashes,
+        )
+        return renditions
+
+    async def _get_renditions_from_os(self, db_file: FileMetaDAOSchema, executor: CPUExecutor) -> dict[str, Rendition]:
+        try:
+            return await executor.run(
+                _renditions_from_os,
+                self.os_dao,
+                schema=db_file,
+                sizes=get_rendition_sizes(),
+                formats=get_thumbnail_formats(),
+            )
+        except ImageTooLargeError:
+            return self._get_fallback_renditions(db_file.path / db_file.filename)
+        except UndecodableImageError:
+            # Stored without icon, so a broken image isn't decoded again on every request.
+            # Other errors (reading, decryption, executor) may be transient, they are raised
+            logger.exception(f"Can't build icon for {db_file.path / db_file.filename}")
+            return {}
+
+    def _get_fallback_renditions(self, filepath: FilePath) -> dict[str, Rendition]:
+        logger.warning(f"Image {filepath} exceeds pixel budget, fallback icon is used")
+        get_metrics_registry().counter("thumbnail_pixel_budget_exceeded_total").inc()
+        return get_fallback_renditions(get_rendition_sizes(), get_thumbnail_formats())
+
+    async def _save_thumbnails(self, *files_renditions: dict[str, Rendition]) -> list[dict[str, str]]:
+        """Store renditions of every file in the thumbnail store, returns their hashes by rendition name per file."""
+        to_save: dict[str, dict[ThumbnailFormat, bytes]] = {}
+        files_hashes: list[dict[str, str]] = []
+
+        for renditions in files_renditions:
+            thumbnail_hashes: dict[str, str] = {}
+            for name, rendition in renditions.items():
+                thumbnail = {image_format: output_file.getvalue() for image_format, output_file in rendition.items()}
+                # PNG is always built, so it identifies the thumbnail in every format
+                thumbnail_hashes[name] = get_thumbnail_hash(thumbnail[ThumbnailFormat.PNG])
+                to_save[thumbnail_hashes[name]] = thumbnail
+            files_hashes.append(thumbnail_hashes)
+
+        await self.thumbnail_dao.save(to_save)
+        return files_hashes
 
     async def _get_existed_file_from_db(self, *, path: FilePath, filename: FileName) -> "FileMetaDAOSchema":
         db_file = await self.db_dao.get(filename=filename, path=path)
+        if db_file and self.os_dao.is_exists(path / filename):
+            return db_file
 
+        # The cached meta may be stale, nothing is deleted on the strength of it
+        db_file = await self.db_dao.get(filename=filename, path=path, use_cache=False)
         if not db_file or not self.os_dao.is_exists(path / filename):
             await self.delete_file(path=path, filename=filename)
             raise FileNotFoundError(f"{path / filename} is not exists")
@@ -68,3 +426,72 @@ class FileMetaController:
     async def delete_file(self, *, path: FilePath, filename: FileName) -> None:
         self.os_dao.delete(path=path / filename)
         await self.db_dao.delete(path=path, filename=filename)
+
+
+def _is_icon_pending(file_type: SupportedFileTypes) -> bool:
+    return get_settings().storage_lazy_thumbnails and file_type != SupportedFileTypes.PDF
+
+
+# Module level helpers, so they can be pickled into a process pool executor
+
+
+def _encrypt_to_temp(os_dao: OSFileMetaDAO, *, schema: FileMetaDAOSchema, data: io.BytesIO) -> FilePath:
+    return os_dao.stage(path=schema.path, data=_encrypt_stream(schema, data))
+
+
+def _encrypt_stream(schema: FileMetaDAOSchema, data: io.BytesIO) -> Iterator[BytesChunk]:
+    raw_file: BinaryIO = data
+    if schema.compression:
+        raw_file = io.BufferedReader(IterStream(compress_stream(data, schema.compression, schema.compression_level)))
+
+    return encrypt_stream(
+        raw_file,
+        schema.nonce,
+        cipher=schema.cipher,
+        key=get_data_key(schema.data_key, schema.key_id),
+        reuse_buffers=True,
+    )
+
+
+def _renditions_from_os(
+    os_dao: OSFileMetaDAO,
+    *,
+    schema: FileMetaDAOSchema,
+    sizes: dict[str, Size],
+    formats: list[ThumbnailFormat],
+) -> dict[str, Rendition]:
+    # PDF icons are static, the blob isn't needed
+    raw_file = None if schema.type_ == SupportedFileTypes.PDF else _decrypt_from_os(os_dao, schema=schema)
+    try:
+        return get_renditions(file_type=schema.type_, file_=raw_file, sizes=sizes, formats=formats)
+    except OSError as e:
+        # Pillow's `UnidentifiedImageError` and truncated image errors, the decrypted file is in memory
+        raise UndecodableImageError(str(e)) from e
+
+
+def _decrypt_from_os(os_dao: OSFileMetaDAO, *, schema: FileMetaDAOSchema) -> io.BytesIO:
+    raw_file = io.BytesIO()
+
+    with os_dao.get_stream(schema.path / schema.filename) as encrypted_file:
+        raw_file.writelines(_decrypt_stream(encrypted_file, schema=schema, reuse_buffers=True))
+
+    _ = raw_file.seek(0)
+    return raw_file
+
+
+def _decrypt_stream(
+    encrypted_file: BinaryIO,
+    *,
+    schema: FileMetaDAOSchema,
+    reuse_buffers: bool = False,
+) -> Iterator[BytesChunk]:
+    chunks = decrypt_stream(
+        encrypted_file,
+        schema.nonce,
+        cipher=schema.cipher,
+        key=get_data_key(schema.data_key, schema.key_id),
+        reuse_buffers=reuse_buffers,
+    )
+    if schema.compression:
+        return decompress_stream(chunks, schema.compression)
+    return chunks
@@ -1,20 +1,113 @@
 import datetime as dt
-from typing import AsyncIterator
+import sys
+from collections.abc import Callable, Mapping, Sequence
+from functools import lru_cache
+from typing import Any, AsyncIterator, Literal
 
-from beanie.operators import RegEx, Set
+import pymongo
+from beanie import PydanticObjectId
+from beanie.odm.utils.encoder import Encoder
+from beanie.operators import Set
+from motor.motor_asyncio import AsyncIOMotorChangeStream
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
-from backend.storage.constants import SupportedFileTypes
-from backend.storage.dao_schemas.file_meta import DirMetaDAOSchema, FileMetaDAOSchema
+from backend.core.cache import LRUCache
+from backend.core.metrics import get_metrics_registry
+from backend.core.settings import get_settings
+from backend.storage.constants import ListingSort, SupportedFileTypes
+from backend.storage.dao_schemas.file_meta import (
+    DirMetaDAOSchema,
+    DirStatsDAOSchema,
+    FileKeyDAOSchema,
+    FileListItem,
+    FileMetaDAOSchema,
+    FileThumbnailSourceDAOSchema,
+    ListingCursor,
+)
 from backend.storage.documents.file_meta import FileMetaDocument
 from backend.storage.typing_ import FileName, FilePath, OptionalFileAttributes
 
+DUPLICATE_KEY_ERROR = 11000
+FILE_TYPES = [file_type.value for file_type in SupportedFileTypes if file_type != SupportedFileTypes.DIR]
+# Rough size of a cached schema without its icon and variable length fields
+CACHE_ENTRY_OVERHEAD = 1024
+
+_GET = "get"
+_EXISTS = "exists"
+_MISSING = object()
+# Change stream events about single documents, others (drop, rename, invalidate) concern the whole collection
+_DOCUMENT_OPERATIONS = {"insert", "update", "replace", "delete"}
+_AGGREGATED_FIELDS = {"type_": True, "size": True}
+_LIST_ITEM_FIELDS = {
+    field: True for field in ["path", "filename", "type_", "icon_hash", "size", "created_date", "updated_date"]
+} | {"_id": False}
+
+# Changes of `(size, files_count)` by directory `(path, filename)`
+DirDeltas = dict[tuple[str, FileName], tuple[int, int]]
+FileMetaCacheKey = tuple[Literal["get", "exists"], str, FileName]
+FileMetaCache = LRUCache[FileMetaCacheKey, FileMetaDAOSchema | bool]
+
+
+@lru_cache
+def get_file_meta_cache() -> FileMetaCache:
+    settings = get_settings()
+    return LRUCache(
+        "file_meta",
+        max_entries=settings.storage_meta_cache_entries,
+        max_bytes=settings.storage_meta_cache_bytes,
+        # Until a change stream is followed, see `backend.storage.tasks.invalidate_file_meta_cache`
+        ttl=settings.storage_meta_cache_fallback_ttl,
+        get_size=_get_cached_size,
+        metrics=get_metrics_registry(),
+    )
+
 
 class MongoFileMetaDAO:
-    async def get(self, *, path: FilePath, filename: FileName) -> FileMetaDAOSchema | None:
-        return await FileMetaDocument.find_one(
+
+    """
+    File meta in mongo, `get` and `is_exists` are read through a per process `FileMetaCache`.
+
+    Every write invalidates cached entries of the files it touches once it's done, so the process sees its own
+    writes at once. Writes of other processes arrive through `watch_changes`, or show up within the cache TTL.
+    """
+
+    def __init__(self, cache: FileMetaCache | None = None) -> None:
+        self.cache = cache or get_file_meta_cache()
+
+    async def get(self, *, path: FilePath, filename: FileName, use_cache: bool = True) -> FileMetaDAOSchema | None:
+        """
+        Read meta through the cache, only found meta is cached.
+
+        Read with `use_cache=False` before anything is deleted or restored because of the result:
+        a cached entry may miss a write of another process.
+        """
+        key: FileMetaCacheKey = (_GET, str(path), filename)
+        generation = self.cache.generation
+        cached = self.cache.get(key, _MISSING) if use_cache else _MISSING
+        if cached is not _MISSING:
+            return _copy_cached(cached)  # pyright: ignore reportGeneralTypeIssues
+
+        data = await FileMetaDocument.find_one(
             FileMetaDocument.path == path,
             FileMetaDocument.filename == filename,
         ).project(FileMetaDAOSchema)
+        if data is not None:
+            self.cache.set(key, data, generation=generation)
+        return _copy_cached(data)
+
+    async def get_many(
+        self,
+        files: Sequence[tuple[FilePath, FileName]],
+    ) -> dict[tuple[FilePath, FileName], FileMetaDAOSchema]:
+        """Read meta of many `(path, filename)` files in one query, bypassing the cache. Missing files are left out."""
+        if not files:
+            return {}
+
+        documents = await FileMetaDocument.find(
+            {"$or": [{"path": str(path), "filename": filename} for path, filename in files]},
+        ).project(FileMetaDAOSchema).to_list()
+        return {(document.path, document.filename): document for document in documents}
 
     async def update(
         self,
@@ -23,98 +116,395 @@ class MongoFileMetaDAO:
         filename: FileName,
         data_to_update: OptionalFileAttributes,
     ) -> None:
-        await FileMetaDocument.find_one(
-            FileMetaDocument.path == path,
-            FileMetaDocument.filename == filename,
-        ).update(Set(data_to_update | {"updated_date": dt.datetime.now(tz=dt.timezone.utc)}))  # pyright: ignore reportGeneralTypeIssues
+        """
+        Update meta, a renamed file is moved between directory aggregates. Renamed directories keep theirs.
+
+        Renaming over existing meta raises `FileExistsError`, like `save` without `replace` does.
+        """
+        new_path = data_to_update.get("path", path)
+        new_filename = data_to_update.get("filename", filename)
+        try:
+            previous = await FileMetaDocument.get_motor_collection().find_one_and_update(
+                {"path": str(path), "filename": filename},
+                {"$set": _encode(data_to_update | {"updated_date": dt.datetime.now(tz=dt.timezone.utc)})},
+                projection=_AGGREGATED_FIELDS,
+            )
+        except DuplicateKeyError as e:
+            raise FileExistsError(f"{new_path}/{new_filename} exists in DB") from e
+        finally:
+            self._invalidate(path, filename)
+            self._invalidate(new_path, new_filename)
+
+        if (size := _get_file_size(previous)) is not None:
+            deltas: DirDeltas = {}
+            _add_to_dirs(deltas, path, size=-size, count=-1)
+            _add_to_dirs(deltas, new_path, size=size, count=1)
+            await self._update_dirs(deltas)
+
+    async def set_renditions(
+        self,
+        data: FileMetaDAOSchema,
+        *,
+        icon_hash: str | None,
+        renditions: dict[str, str],
+    ) -> None:
+        """Store lazily built icon and renditions, unless the file was replaced in the meantime."""
+        try:
+            _ = await FileMetaDocument.find_one(
+                FileMetaDocument.path == data.path,
+                FileMetaDocument.filename == data.filename,
+                FileMetaDocument.nonce == data.nonce,
+            ).update(Set({"icon_hash": icon_hash, "renditions": renditions, "icon_pending": False}))  # pyright: ignore reportGeneralTypeIssues
+        finally:
+            self._invalidate(data.path, data.filename)
+
+    async def update_renditions(self, renditions: list[tuple[FileMetaDAOSchema, str | None, dict[str, str]]]) -> int:
+        """
+        Store rebuilt icons and renditions in one unordered bulk write, returns the number of updated files.
+
+        Like `set_renditions`, files replaced since they were read are skipped. Legacy inline icons are dropped.
+        """
+        if not renditions:
+            return 0
+
+        collection = FileMetaDocument.get_motor_collection()
+        try:
+            result = await collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"path": str(data.path), "filename": data.filename, "nonce": data.nonce},
+                        {
+                            "$set": {
+                                "icon": None,
+                                "icon_hash": icon_hash,
+                                "renditions": file_renditions,
+                                "icon_pending": False,
+                            },
+                        },
+                    )
+                    for data, icon_hash, file_renditions in renditions
+                ],
+                ordered=False,
+            )
+        finally:
+            for data, _, _ in renditions:
+                self._invalidate(data.path, data.filename)
+        return result.modified_count
+
+    async def get_thumbnail_sources(
+        self,
+        *,
+        after: PydanticObjectId | None,
+        limit: int,
+    ) -> list[FileThumbnailSourceDAOSchema]:
+        """Return up to `limit` files in `_id` order, starting after `after`, so a scan can be resumed."""
+        query = FileMetaDocument.find(FileMetaDocument.type_ != SupportedFileTypes.DIR)
+        if after:
+            query = query.find(FileMetaDocument.id > after)
+
+        return await query.sort(+FileMetaDocument.id).limit(limit).project(FileThumbnailSourceDAOSchema).to_list()  # pyright: ignore reportGeneralTypeIssues
+
+    async def get_pending_icons(
+        self,
+        *,
+        after: PydanticObjectId | None,
+        limit: int,
+    ) -> list[FileThumbnailSourceDAOSchema]:
+        """Return up to `limit` files waiting for an icon in `_id` order, starting after `after`."""
+        query = FileMetaDocument.find(FileMetaDocument.icon_pending == True)  # noqa: E712
+        if after:
+            query = query.find(FileMetaDocument.id > after)
+
+        return await query.sort(+FileMetaDocument.id).limit(limit).project(FileThumbnailSourceDAOSchema).to_list()  # pyright: ignore reportGeneralTypeIssues
 
-    async def save(self, data: FileMetaDAOSchema | DirMetaDAOSchema, *, replace: bool) -> None:
-        is_exists = await self.is_exists(path=data.path, filename=data.filename)
-        if is_exists and not replace:
-            raise FileExistsError(f"{data.path}/{data.filename} exists in DB")
+    async def save(
+        self,
+        data: FileMetaDAOSchema | DirMetaDAOSchema,
+        *,
+        replace: bool,
+        on_saved: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        Write meta in a single round trip.
 
+        Concurrent writers are serialized by the unique `(path, filename)` index: without `replace`
+        the loser gets `FileExistsError`, with `replace` the upsert updates the winner's document.
+        Aggregates of parent directories are updated with one more write. `on_saved` is called right after
+        the meta is written, before that write, e.g. to move the blob in place.
+        """
         document = FileMetaDocument.model_validate(data.model_dump())
+        previous = None
+
+        try:
+            if replace:
+                data_to_update, data_to_insert = _get_upsert_data(data, document)
+
+                previous = await FileMetaDocument.get_motor_collection().find_one_and_update(
+                    {"path": str(document.path), "filename": document.filename},
+                    {"$set": _encode(data_to_update), "$setOnInsert": _encode(data_to_insert)},
+                    projection=_AGGREGATED_FIELDS,
+                    upsert=True,
+                )
+            else:
+                _ = await document.create()
+        except DuplicateKeyError as e:
+            raise FileExistsError(f"{data.path}/{data.filename} exists in DB") from e
+        finally:
+            self._invalidate(data.path, data.filename)
+
+        try:
+            if on_saved:
+                on_saved()
+        finally:
+            if isinstance(data, FileMetaDAOSchema):
+                deltas: DirDeltas = {}
+                _add_to_dirs(deltas, data.path, **_get_replaced_delta(data, previous))
+                await self._update_dirs(deltas)
+
+    async def save_many(
+        self,
+        data: Sequence[FileMetaDAOSchema | DirMetaDAOSchema],
+        *,
+        replace: bool,
+        on_saved: Callable[[list[Exception | None]], None] | None = None,
+    ) -> list[Exception | None]:
+        """
+        Write meta of many files in one unordered bulk write, like `save` does for one.
+
+        Returns an error or `None` per item: a failed item doesn't stop the rest, `on_saved` gets them right after
+        the bulk write. Replaced files are read beforehand in one query, to move directory aggregates
+        by their size change.
+        """
+        errors: list[Exception | None] = [None] * len(data)
+        if not data:
+            return errors
 
-        if replace:
-            data_to_update = data.model_dump(exclude={"path", "type_", "filename"}, exclude_unset=True)
-
-            _ = await FileMetaDocument.find_one(  # pyright: ignore reportUnknownVariableType
-                FileMetaDocument.path == document.path,
-                FileMetaDocument.filename == document.filename,
-            ).upsert(
-                Set(
-                    data_to_update
-                    | {"updated_date": dt.datetime.now(tz=dt.timezone.utc).isoformat(sep=" ", timespec="seconds")},
-                ),
-                on_insert=document,
-            )  # pyright: ignore reportGeneralTypeIssues
-        else:
-            _ = await document.create()
+        collection = FileMetaDocument.get_motor_collection()
+        previous_sizes = await self._get_sizes(
+            [(item.path, item.filename) for item in data if replace and isinstance(item, FileMetaDAOSchema)],
+        )
+        operations = [_get_save_operation(item, replace=replace) for item in data]
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            upserted = {upsert["index"] for upsert in e.details["upserted"]}
+            for error in e.details["writeErrors"]:
+                item = data[error["index"]]
+                errors[error["index"]] = (
+                    FileExistsError(f"{item.path}/{item.filename} exists in DB")
+                    if error["code"] == DUPLICATE_KEY_ERROR
+                    else OperationFailure(error["errmsg"], error["code"], error)
+                )
+        finally:
+            for item in data:
+                self._invalidate(item.path, item.filename)
+
+        deltas: DirDeltas = {}
+        for index, item in enumerate(data):
+            if errors[index] is None and isinstance(item, FileMetaDAOSchema):
+                is_new = not replace or index in upserted
+                key = (str(item.path), item.filename)
+                previous = None if is_new or key not in previous_sizes else {"size": previous_sizes[key]}
+                _add_to_dirs(deltas, item.path, **_get_replaced_delta(item, previous))
+
+        try:
+            if on_saved:
+                on_saved(errors)
+        finally:
+            await self._update_dirs(deltas)
+        return errors
 
     async def delete(self, *, path: FilePath, filename: FileName, type_: SupportedFileTypes | None = None) -> None:
-        data_to_search = {"filename": filename, "path": path}
+        data_to_search = {"filename": filename, "path": str(path)}
         if type_:
-            data_to_search |= {"type_": type_}
+            data_to_search |= {"type_": type_.value}
 
-        _ = await FileMetaDocument.find_one(data_to_search).delete()
+        try:
+            previous = await FileMetaDocument.get_motor_collection().find_one_and_delete(
+                data_to_search,
+                projection=_AGGREGATED_FIELDS,
+            )
+        finally:
+            self._invalidate(path, filename)
 
-    async def regex_delete(self, key: str, value: str) -> None:
-        _ = await FileMetaDocument.find(
-            RegEx(
-                getattr(FileMetaDocument, key),
-                pattern=f"^{value}",
-                options="m",
-            ),
-        ).delete()
+        if (size := _get_file_size(previous)) is not None:
+            deltas: DirDeltas = {}
+            _add_to_dirs(deltas, path, size=-size, count=-1)
+            await self._update_dirs(deltas)
 
-    async def ls(self, path: FilePath) -> AsyncIterator[FileMetaDAOSchema | DirMetaDAOSchema]:
-        async for document in FileMetaDocument.find(
-            FileMetaDocument.path == path,
-            FileMetaDocument.type_ != SupportedFileTypes.DIR,
-        ).project(FileMetaDAOSchema):
-            yield document
+    async def delete_many(self, *, path: FilePath, filenames: Sequence[FileName]) -> None:
+        if not filenames:
+            return
 
-        async for document in FileMetaDocument.find(
-            FileMetaDocument.path == path,
-            FileMetaDocument.type_ == SupportedFileTypes.DIR,
-        ).project(DirMetaDAOSchema):
-            yield document
+        try:
+            _ = await self._delete_documents({"path": str(path), "filename": {"$in": list(filenames)}})
+        finally:
+            for filename in filenames:
+                self._invalidate(path, filename)
 
-    async def regex_update(self, key: str, old_value: str, new_value: str) -> None:
+    async def delete_subtree(self, path: FilePath) -> None:
+        """Delete meta of everything inside directory `path`, the directory itself is kept (with zero aggregates)."""
         collection = FileMetaDocument.get_motor_collection()
+        size, count = await self._get_subtree_totals(path)
+        try:
+            _ = await collection.delete_many(_get_subtree_filter(path))
+        finally:
+            self._invalidate_subtree(path)
 
-        _ = await collection.update_many(
-            filter=RegEx(
-                getattr(FileMetaDocument, key),
-                pattern=f"^{old_value}",
-                options="m",
-            ),
-            update=[
-                Set(
-                    {
-                        key: {
-                            "$replaceAll": {
-                                "input": f"${key}",
-                                "find": old_value,
-                                "replacement": new_value,
+        deltas: DirDeltas = {}
+        _add_to_dirs(deltas, path, size=-size, count=-count)
+        await self._update_dirs(deltas)
+
+    async def ls_page(
+        self,
+        path: FilePath,
+        *,
+        limit: int,
+        sort: ListingSort = ListingSort.NAME,
+        after: ListingCursor | None = None,
+    ) -> list[FileListItem]:
+        """
+        Return up to `limit` items of `path` following `after`: files first, then directories, each ordered by `sort`.
+
+        Every query reads a bounded range of a `listing by ...` index, so a page costs the same in any directory.
+        File types are listed with `$in`, which mongo merges in index order.
+        """
+        collection = FileMetaDocument.get_motor_collection()
+        items: list[FileListItem] = []
+        sort_keys = [(sort.value, pymongo.ASCENDING), ("filename", pymongo.ASCENDING)]
+        if sort == ListingSort.NAME:
+            sort_keys = sort_keys[1:]
+
+        for is_dir in [False, True]:
+            if (after and after.is_dir and not is_dir) or len(items) >= limit:
+                continue
+
+            query: dict[str, Any] = {
+                "path": str(path),
+                "type_": SupportedFileTypes.DIR.value if is_dir else {"$in": FILE_TYPES},
+            }
+            if after and after.is_dir == is_dir:
+                query |= _get_keyset_filter(sort, after)
+
+            documents = collection.find(query, projection=_LIST_ITEM_FIELDS, sort=sort_keys, limit=limit - len(items))
+            items += [FileListItem.from_document(document, path) async for document in documents]
+
+        return items
+
+    async def move_subtree(self, old_path: FilePath, new_path: FilePath) -> None:
+        """
+        Move meta of everything inside directory `old_path` to `new_path`, only the path prefix is replaced.
+
+        Totals of the subtree move from the parents of `old_path` to the parents of `new_path`, the directory
+        document itself is renamed with `update` and keeps its aggregates.
+        """
+        collection = FileMetaDocument.get_motor_collection()
+        old_prefix = str(old_path).rstrip("/")
+        size, count = await self._get_subtree_totals(old_path)
+
+        try:
+            _ = await collection.update_many(
+                filter=_get_subtree_filter(old_path),
+                update=[
+                    Set(
+                        {
+                            "path": {
+                                "$concat": [
+                                    str(new_path).rstrip("/"),
+                                    {"$substrCP": ["$path", len(old_prefix), {"$strLenCP": "$path"}]},
+                                ],
                             },
+                            "updated_date": dt.datetime.now(tz=dt.timezone.utc).isoformat(sep=" ", timespec="seconds"),
                         },
-                        "updated_date": dt.datetime.now(tz=dt.timezone.utc).isoformat(sep=" ", timespec="seconds"),
-                    },
-                ),
-            ],
+                    ),
+                ],
+            )
+        finally:
+            self._invalidate_subtree(old_path)
+            self._invalidate_subtree(new_path)
+
+        deltas: DirDeltas = {}
+        _add_to_dirs(deltas, old_path.parent, size=-size, count=-count)
+        _add_to_dirs(deltas, new_path.parent, size=size, count=count)
+        await self._update_dirs(deltas)
+
+    async def get_all(self, *, batch_size: int = 1000) -> AsyncIterator[FileListItem]:
+        """Stream meta of all files and directories in `(path, filename)` order, read along the unique index."""
+        documents = FileMetaDocument.get_motor_collection().find(
+            {},
+            projection=_LIST_ITEM_FIELDS,
+            sort=[("path", pymongo.ASCENDING), ("filename", pymongo.ASCENDING)],
+            batch_size=batch_size,
         )
+        path_str, path = "", FilePath()
+        async for document in documents:
+            if document["path"] != path_str:
+                path_str, path = document["path"], FilePath(document["path"])
+            yield FileListItem.from_document(document, path)
+
+    async def delete_files(self, files: Sequence[tuple[FilePath, FileName]]) -> int:
+        """Delete meta of `(path, filename)` files with one query, returns the number of deleted ones."""
+        if not files:
+            return 0
+
+        try:
+            return await self._delete_documents(
+                {"$or": [{"path": str(path), "filename": filename} for path, filename in files]},
+            )
+        finally:
+            for path, filename in files:
+                self._invalidate(path, filename)
+
+    async def get_dir_stats(self, *, path: FilePath, filename: FileName) -> DirStatsDAOSchema | None:
+        return await FileMetaDocument.find_one(
+            FileMetaDocument.path == path,
+            FileMetaDocument.filename == filename,
+            FileMetaDocument.type_ == SupportedFileTypes.DIR,
+        ).project(DirStatsDAOSchema)
+
+    async def get_keys_to_rotate(self, key_id: str, *, batch_size: int) -> AsyncIterator[list[FileKeyDAOSchema]]:
+        """Yield batches of file keys not wrapped by `key_id` master key."""
+        batch: list[FileKeyDAOSchema] = []
+
+        async for document in FileMetaDocument.find(
+            FileMetaDocument.type_ != SupportedFileTypes.DIR,
+            FileMetaDocument.key_id != key_id,
+            batch_size=batch_size,
+        ).project(FileKeyDAOSchema):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
 
-    async def get_all(self) -> AsyncIterator[FileMetaDAOSchema | DirMetaDAOSchema]:
-        async for document in FileMetaDocument.find(FileMetaDocument.type_ != SupportedFileTypes.DIR).project(
-            FileMetaDAOSchema,
-        ):
-            yield document
+    async def update_keys(self, keys: list[tuple[FileKeyDAOSchema, bytes, str]]) -> int:
+        """
+        Replace wrapped keys in one unordered bulk write, returns the number of updated files.
 
-        async for document in FileMetaDocument.find(FileMetaDocument.type_ == SupportedFileTypes.DIR).project(
-            DirMetaDAOSchema,
-        ):
-            yield document
+        A file is updated only if its key wasn't changed since it was read.
+        """
+        if not keys:
+            return 0
+
+        collection = FileMetaDocument.get_motor_collection()
+        try:
+            result = await collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": old_key.id, "key_id": old_key.key_id},
+                        {"$set": {"data_key": data_key, "key_id": key_id}},
+                    )
+                    for old_key, data_key, key_id in keys
+                ],
+                ordered=False,
+            )
+        finally:
+            # Keys are matched by `_id`, not by path, rotation is rare enough to drop everything
+            self.cache.clear()
+        return result.modified_count
 
     async def is_exists(
         self,
@@ -122,9 +512,226 @@ class MongoFileMetaDAO:
         filename: FileName,
         path: FilePath,
     ) -> bool:
-        return bool(
-            await FileMetaDocument.find_one(
-                FileMetaDocument.path == path,
-                FileMetaDocument.filename == filename,
-            ),
+        if self.cache.get((_GET, str(path), filename), _MISSING) is not _MISSING:
+            return True
+
+        key: FileMetaCacheKey = (_EXISTS, str(path), filename)
+        generation = self.cache.generation
+        is_exists = self.cache.get(key, _MISSING)
+        if is_exists is _MISSING:
+            is_exists = bool(
+                await FileMetaDocument.find(
+                    FileMetaDocument.path == path,
+                    FileMetaDocument.filename == filename,
+                ).count(),
+            )
+            # Like in `get`, a miss isn't cached: the file may be created by another process any moment
+            if is_exists:
+                self.cache.set(key, is_exists, generation=generation)
+        return bool(is_exists)
+
+    def watch_changes(self) -> AsyncIOMotorChangeStream:
+        """
+        Follow changes of file meta made by any process, needs a replica set.
+
+        Old path and filename of renamed and deleted files are known only with pre-images enabled on the collection.
+        """
+        return FileMetaDocument.get_motor_collection().watch(
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+        )
+
+    def invalidate_changed(self, change: Mapping[str, Any]) -> None:
+        """Drop cache entries of a `watch_changes` event, or the whole cache if it's unknown which files changed."""
+        operation = change["operationType"]
+        before, after = change.get("fullDocumentBeforeChange"), change.get("fullDocument")
+        key_fields = {"path", "filename"}
+        is_renamed = operation == "replace" or (
+            operation == "update" and bool(key_fields & change["updateDescription"]["updatedFields"].keys())
+        )
+        is_known = operation in _DOCUMENT_OPERATIONS and (
+            before is not None or operation == "insert" or (after is not None and not is_renamed)
+        )
+        if not is_known:
+            self.cache.clear()
+            return
+
+        for document in (before, after):
+            if document is not None:
+                self._invalidate(FilePath(document["path"]), document["filename"])
+
+    async def _get_sizes(self, files: Sequence[tuple[FilePath, FileName]]) -> dict[tuple[str, FileName], int]:
+        if not files:
+            return {}
+
+        # Files saved without size aren't in directory aggregates, they are left out
+        documents = FileMetaDocument.get_motor_collection().find(
+            {
+                "$or": [{"path": str(path), "filename": filename} for path, filename in files],
+                "size": {"$exists": True},
+            },
+            projection={"path": True, "filename": True, "size": True},
+        )
+        return {(document["path"], document["filename"]): document["size"] async for document in documents}
+
+    async def _get_subtree_totals(self, path: FilePath) -> tuple[int, int]:
+        """Return total size and number of files inside directory `path`, as counted in directory aggregates."""
+        totals = await (
+            FileMetaDocument.get_motor_collection()
+            .aggregate(
+                [
+                    {
+                        "$match": _get_subtree_filter(path)
+                        | {"type_": {"$ne": SupportedFileTypes.DIR.value}, "size": {"$exists": True}},
+                    },
+                    {"$group": {"_id": None, "size": {"$sum": "$size"}, "count": {"$sum": 1}}},
+                ],
+            )
+            .to_list(None)
+        )
+        return (totals[0]["size"], totals[0]["count"]) if totals else (0, 0)
+
+    async def _delete_documents(self, query: dict[str, Any]) -> int:
+        """Delete documents matching `query` and take deleted files out of directory aggregates."""
+        collection = FileMetaDocument.get_motor_collection()
+        documents = await collection.find(query, projection={"path": True, **_AGGREGATED_FIELDS}).to_list(None)
+        if not documents:
+            return 0
+
+        # Deleted by `_id`, so only the documents that were read are subtracted
+        result = await collection.delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+        deltas: DirDeltas = {}
+        for document in documents:
+            if (size := _get_file_size(document)) is not None:
+                _add_to_dirs(deltas, FilePath(document["path"]), size=-size, count=-1)
+        await self._update_dirs(deltas)
+        return result.deleted_count
+
+    async def _update_dirs(self, deltas: DirDeltas) -> None:
+        """Apply changes to aggregates of directories with an atomic `$inc` each, in one unordered bulk write."""
+        if not deltas:
+            return
+
+        now = dt.datetime.now(tz=dt.timezone.utc).isoformat(sep=" ", timespec="seconds")
+        _ = await FileMetaDocument.get_motor_collection().bulk_write(
+            [
+                UpdateOne(
+                    {"path": path, "filename": filename, "type_": SupportedFileTypes.DIR.value},
+                    {"$inc": {"size": size, "files_count": count}, "$max": {"last_modified": now}},
+                )
+                for (path, filename), (size, count) in deltas.items()
+            ],
+            ordered=False,
         )
+
+    def _invalidate(self, path: FilePath, filename: FileName) -> None:
+        self.cache.invalidate((_GET, str(path), filename))
+        self.cache.invalidate((_EXISTS, str(path), filename))
+
+    def _invalidate_subtree(self, path: FilePath) -> None:
+        prefix = str(path).rstrip("/")
+        self.cache.invalidate_where(lambda key: key[1] == prefix or key[1].startswith(f"{prefix}/"))
+
+
+def _copy_cached(data: FileMetaDAOSchema | None) -> FileMetaDAOSchema | None:
+    """Callers read and seek the icon, so every caller gets its own copy."""
+    return data.model_copy(deep=True) if data else None
+
+
+def _get_cached_size(value: FileMetaDAOSchema | bool) -> int:
+    if not isinstance(value, FileMetaDAOSchema):
+        return CACHE_ENTRY_OVERHEAD
+    icon_size = value.icon.getbuffer().nbytes if value.icon else 0
+    return (
+        CACHE_ENTRY_OVERHEAD
+        + icon_size
+        + sum(sys.getsizeof(field) for field in (value.filename, str(value.path), value.nonce, value.data_key))
+        + sum(sys.getsizeof(name) + sys.getsizeof(url) for name, url in value.renditions.items())
+    )
+
+
+def _encode(data: dict[str, Any]) -> dict[str, Any]:
+    return Encoder(custom_encoders=FileMetaDocument.Settings.bson_encoders).encode(data)
+
+
+def _add_to_dirs(deltas: DirDeltas, path: FilePath, *, size: int, count: int) -> None:
+    for key in _get_dir_keys(path):
+        total_size, total_count = deltas.get(key, (0, 0))
+        deltas[key] = (total_size + size, total_count + count)
+
+
+def _get_dir_keys(path: FilePath) -> list[tuple[str, FileName]]:
+    """Return `(path, filename)` of directory `path` and of all its parents: directories counting files in `path`."""
+    return [(str(directory.parent), FileName(directory.name)) for directory in [path, *path.parents] if directory.name]
+
+
+def _get_file_size(document: dict[str, Any] | None) -> int | None:
+    """
+    Return size of a file document counted in directory aggregates.
+
+    `None` for a missing document, a directory or a file saved before sizes were stored: it isn't in the aggregates.
+    """
+    if document is None or document["type_"] == SupportedFileTypes.DIR.value:
+        return None
+    return document.get("size")
+
+
+def _get_replaced_delta(data: FileMetaDAOSchema, previous: dict[str, Any] | None) -> dict[str, int]:
+    # A replaced file saved without size wasn't counted, so it's counted like a new one
+    if previous is None or "size" not in previous:
+        return {"size": data.size, "count": 1}
+    return {"size": data.size - previous["size"], "count": 0}
+
+
+def _get_save_operation(data: FileMetaDAOSchema | DirMetaDAOSchema, *, replace: bool) -> InsertOne[Any] | UpdateOne:
+    document = FileMetaDocument.model_validate(data.model_dump())
+    if replace:
+        data_to_update, data_to_insert = _get_upsert_data(data, document)
+        return UpdateOne(
+            {"path": str(document.path), "filename": document.filename},
+            {"$set": _encode(data_to_update), "$setOnInsert": _encode(data_to_insert)},
+            upsert=True,
+        )
+
+    document.set_created_date()
+    return InsertOne(_encode(document.model_dump(exclude={"id", "revision_id"})))
+
+
+def _get_upsert_data(
+    data: FileMetaDAOSchema | DirMetaDAOSchema,
+    document: FileMetaDocument,
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    """Split `data` into fields replacing an existing document and fields set only on insert."""
+    data_to_update = data.model_dump(exclude={"path", "type_", "filename"}, exclude_unset=True)
+    data_to_update["updated_date"] = dt.datetime.now(tz=dt.timezone.utc).isoformat(sep=" ", timespec="seconds")
+    # Stamped like `insert` does, the default of the schema is naive
+    document.set_created_date()
+    data_to_insert = document.model_dump(exclude={"id", "revision_id", *data_to_update})
+    return data_to_update, data_to_insert
+
+
+def _get_keyset_filter(sort: ListingSort, after: ListingCursor) -> dict[str, Any]:
+    if sort == ListingSort.NAME:
+        return {"filename": {"$gt": after.filename}}
+
+    created_date = Encoder(custom_encoders=FileMetaDocument.Settings.bson_encoders).encode(after.created_date)
+    if created_date is None:
+        # Missing dates go first
+        return {"$or": [{"created_date": None, "filename": {"$gt": after.filename}}, {"created_date": {"$ne": None}}]}
+    return {
+        "$or": [
+            {"created_date": {"$gt": created_date}},
+            {"created_date": created_date, "filename": {"$gt": after.filename}},
+        ],
+    }
+
+
+def _get_subtree_filter(path: FilePath) -> dict[str, Any]:
+    """
+    Match files directly in `path` and in its subdirectories, but not in its siblings (`/a/bc` for `/a/b`).
+
+    Descendants are a contiguous `path` range, since "0" follows "/", so both branches are bounded
+    by the `unique file path` index instead of scanning the collection.
+    """
+    prefix = str(path).rstrip("/")
+    return {"$or": [{"path": prefix}, {"path": {"$gte": f"{prefix}/", "$lt": f"{prefix}0"}}]}
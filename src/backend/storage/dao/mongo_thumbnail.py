@@ -0,0 +1,28 @@
+from pymongo import UpdateOne
+
+from backend.storage.constants import ThumbnailFormat
+from backend.storage.documents.thumbnail import ThumbnailDocument
+
+
+class MongoThumbnailDAO:
+    async def get(self, thumbnail_hash: str) -> dict[ThumbnailFormat, bytes] | None:
+        document = await ThumbnailDocument.get(thumbnail_hash)
+        return {image_format: bytes(data) for image_format, data in document.data.items()} if document else None
+
+    async def save(self, thumbnails: dict[str, dict[ThumbnailFormat, bytes]]) -> None:
+        """Store thumbnails keyed by their hash, already stored ones are not written again."""
+        if not thumbnails:
+            return
+
+        collection = ThumbnailDocument.get_motor_collection()
+        _ = await collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": thumbnail_hash},
+                    {"$setOnInsert": {"data": {image_format.value: data for image_format, data in formats.items()}}},
+                    upsert=True,
+                )
+                for thumbnail_hash, formats in thumbnails.items()
+            ],
+            ordered=False,
+        )
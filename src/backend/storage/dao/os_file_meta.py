@@ -1,9 +1,17 @@
+import contextlib
+import heapq
 import io
+import os
+import secrets
 import shutil
-from typing import Iterable
+import stat
+from typing import BinaryIO, Iterable, Iterator
 
 from backend.core.settings import get_settings
-from backend.storage.typing_ import FileName, FilePath
+from backend.storage.typing_ import BytesChunk, FileName, FilePath
+
+# Files being written aside, see `OSFileMetaDAO.stage`. The name has no file type, so it can't be a stored file
+TEMP_FILE_PREFIX = ".~upload-"
 
 
 class OSFileMetaDAO:
@@ -11,18 +19,48 @@ class OSFileMetaDAO:
         with path.open("rb") as raw_file:
             return io.BytesIO(raw_file.read())
 
+    def get_stream(self, path: FilePath) -> BinaryIO:
+        return path.open("rb")
+
     def rename(self, *, old_path: FilePath, new_path: FilePath) -> None:
         self.check_exists(old_path)
         self.check_exists(new_path.parent)
 
         _ = old_path.rename(new_path)
 
-    def create(self, *, path: FilePath, filename: FileName, data: io.BytesIO, replace: bool) -> None:
-        self.check_exists(path)
+    def create(self, *, path: FilePath, filename: FileName, data: Iterable[BytesChunk], replace: bool) -> None:
         if not replace:
-            self._check_not_exists(path / filename)
+            self.check_not_exists(path / filename)
+
+        self.commit(self.stage(path=path, data=data), path=path, filename=filename)
+
+    def stage(self, *, path: FilePath, data: Iterable[BytesChunk]) -> FilePath:
+        """
+        Write `data` aside into a temp file of directory `path`, returns its path for `commit` or `discard`.
+
+        Files are written aside and moved in place, so readers (which may `mmap` the file) never see them half-written.
+        """
+        self.check_exists(path)
+
+        # Created like `open(..., "wb")` does
+        temp_path = path / f"{TEMP_FILE_PREFIX}{secrets.token_hex(8)}"
+        with temp_path.open("xb") as f:
+            try:
+                f.writelines(data)
+            except BaseException:
+                f.close()
+                temp_path.unlink()
+                raise
+        return temp_path
 
-        _ = (path / filename).write_bytes(data.read())
+    def commit(self, temp_path: FilePath, *, path: FilePath, filename: FileName) -> None:
+        """Atomically move a staged file in place of `filename`, a replaced file keeps its mode."""
+        with contextlib.suppress(FileNotFoundError):
+            temp_path.chmod(stat.S_IMODE((path / filename).stat().st_mode))
+        _ = temp_path.replace(path / filename)
+
+    def discard(self, temp_path: FilePath) -> None:
+        temp_path.unlink(missing_ok=True)
 
     def create_dir(self, *, path: FilePath, filename: FileName, exist_ok: bool = True) -> FilePath:
         full_path = path / filename
@@ -38,19 +76,54 @@ class OSFileMetaDAO:
     def ls(self, path: FilePath) -> Iterable[FilePath]:
         yield from path.iterdir()
 
-    def get_all(self) -> Iterable[FilePath]:
-        settings = get_settings()
+    def get_names(self, path: FilePath) -> set[FileName]:
+        """Names in directory `path` from a single `scandir`, empty if it doesn't exist. Temp files are skipped."""
+        try:
+            with os.scandir(path) as entries:
+                return {FileName(entry.name) for entry in entries if not _is_temp_file(entry)}
+        except (FileNotFoundError, NotADirectoryError):
+            return set()
+
+    def get_root(self) -> FilePath:
+        return get_settings().storage_path
+
+    def walk_sorted(self) -> Iterator[tuple[FilePath, list[tuple[FileName, bool]]]]:
+        """
+        Yield every directory of the storage with its `(name, is_dir)` entries sorted by name.
+
+        Directories come in order of their path strings, like the `(path, filename)` index of file meta:
+        they are taken from a heap, and a subdirectory always sorts after its parent. Temp files are skipped.
+        """
+        directories = [str(self.get_root())]
 
-        for item in settings.storage_path.rglob("*"):
-            yield FilePath(item)
+        while directories:
+            directory = heapq.heappop(directories)
+            try:
+                with os.scandir(directory) as scanned:
+                    entries = sorted(
+                        (FileName(entry.name), entry.is_dir(follow_symlinks=False))
+                        for entry in scanned
+                        if not _is_temp_file(entry)
+                    )
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for name, is_dir in entries:
+                if is_dir:
+                    heapq.heappush(directories, os.path.join(directory, name))  # noqa: PTH118
+            yield FilePath(directory), entries
 
     def check_exists(self, path: FilePath) -> None:
         if not self.is_exists(path):
             raise FileNotFoundError(f"{path} not found in OS")
 
-    def _check_not_exists(self, path: FilePath) -> None:
+    def check_not_exists(self, path: FilePath) -> None:
         if self.is_exists(path):
             raise FileExistsError(f"{path} found in OS")
 
     def is_exists(self, path: FilePath) -> bool:
         return path.exists()
+
+
+def _is_temp_file(entry: os.DirEntry[str]) -> bool:
+    return entry.name.startswith(TEMP_FILE_PREFIX) and not entry.is_dir(follow_symlinks=False)
@@ -1,6 +1,10 @@
 import datetime as dt
 import io
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any
 
+from beanie import PydanticObjectId
 from bson.binary import Binary
 from pydantic import (
     BaseModel,
@@ -10,7 +14,7 @@ from pydantic import (
     field_validator,
 )
 
-from backend.storage.constants import SupportedFileTypes
+from backend.storage.constants import CipherAlgorithm, CompressionAlgorithm, SupportedFileTypes
 from backend.storage.typing_ import FileName, FilePath
 
 
@@ -21,7 +25,16 @@ class FileMetaDAOSchema(BaseModel):
     filename: FileName
     type_: SupportedFileTypes
     icon: io.BytesIO | None = None
+    icon_hash: str | None = None
+    icon_pending: bool = False
+    renditions: dict[str, str] = {}
     nonce: bytes
+    data_key: bytes | None = None
+    key_id: str | None = None
+    cipher: CipherAlgorithm | None = None
+    compression: CompressionAlgorithm | None = None
+    compression_level: int | None = None
+    size: int = 0
     created_date: dt.datetime = Field(default_factory=dt.datetime.utcnow)
     updated_date: dt.datetime | None = None
 
@@ -43,6 +56,10 @@ class FileMetaDAOSchema(BaseModel):
         return io.BytesIO(icon) if isinstance(icon, (Binary, bytes)) else icon
 
 
+class FileThumbnailSourceDAOSchema(FileMetaDAOSchema):
+    id: PydanticObjectId = Field(alias="_id")
+
+
 class DirMetaDAOSchema(BaseModel):
     path: FilePath
     filename: FileName
@@ -58,3 +75,64 @@ class DirMetaDAOSchema(BaseModel):
             msg = "Unsupported type_. Use FileMetaDAOSchema instead"
             raise ValueError(msg)
         return v
+
+
+class DirStatsDAOSchema(BaseModel):
+
+    """Totals of files in a directory and all its subdirectories."""
+
+    size: int = 0
+    files_count: int = 0
+    last_modified: dt.datetime | None = None
+
+
+class FileKeyDAOSchema(BaseModel):
+    id: PydanticObjectId = Field(alias="_id")
+    data_key: bytes | None = None
+    key_id: str | None = None
+
+
+class ListingCursor(BaseModel):
+
+    """Position in a directory listing, the last item of the previous page."""
+
+    is_dir: bool
+    filename: FileName
+    created_date: dt.datetime | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class FileListItem:
+
+    """
+    Listing row: no icon, key or nonce binaries are read from mongo.
+
+    Rows are read in bulk from documents written by `MongoFileMetaDAO` after validation, so they're built without it,
+    see `backend.benchmarks.file_listing`. `size` of a directory is the total of its subtree.
+    """
+
+    path: FilePath
+    filename: FileName
+    type_: SupportedFileTypes
+    icon_hash: str | None
+    size: int
+    created_date: dt.datetime | None
+    updated_date: dt.datetime | None
+
+    @classmethod
+    def from_document(cls, document: Mapping[str, Any], path: FilePath) -> "FileListItem":
+        """Build a row from a raw document of directory `path`, the `Path` is shared by rows of one directory."""
+        return cls(
+            path=path,
+            filename=document["filename"],
+            type_=SupportedFileTypes(document["type_"]),
+            icon_hash=document.get("icon_hash"),
+            size=document.get("size", 0),
+            created_date=_parse_date(document.get("created_date")),
+            updated_date=_parse_date(document.get("updated_date")),
+        )
+
+
+def _parse_date(value: str | dt.datetime | None) -> dt.datetime | None:
+    # Dates are stored as strings, see `FileMetaDocument.Settings.bson_encoders`
+    return dt.datetime.fromisoformat(value) if isinstance(value, str) else value
@@ -12,9 +12,10 @@ from beanie import (
     before_event,
 )
 from beanie.odm.custom_types.bson.binary import BsonBinary
+from pydantic import Field
 from pymongo import IndexModel
 
-from backend.storage.constants import SupportedFileTypes
+from backend.storage.constants import CipherAlgorithm, CompressionAlgorithm, SupportedFileTypes
 from backend.storage.typing_ import FileName, FilePath
 
 
@@ -22,8 +23,22 @@ class FileMetaDocument(Document):
     path: FilePath
     filename: Annotated[FileName, Indexed()]
     type_: SupportedFileTypes
-    icon: BsonBinary | None
+    # Icons of files created before the thumbnail store, new files keep only `icon_hash`
+    icon: BsonBinary | None = None
+    icon_hash: str | None = None
+    icon_pending: bool = False
+    renditions: dict[str, str] = Field(default_factory=dict)
     nonce: bytes | None = None
+    data_key: bytes | None = None
+    key_id: Annotated[str | None, Indexed()] = None
+    cipher: CipherAlgorithm | None = None
+    compression: CompressionAlgorithm | None = None
+    compression_level: int | None = None
+    # Raw size of a file. A directory has totals of files in its whole subtree instead,
+    # kept up to date with `$inc` by `MongoFileMetaDAO` writes
+    size: int = 0
+    files_count: int = 0
+    last_modified: dt.datetime | None = None
     created_date: Annotated[
         dt.datetime | None,
         Indexed(index_type=pymongo.DESCENDING),
@@ -46,7 +61,26 @@ class FileMetaDocument(Document):
             IndexModel(
                 keys=[("path", pymongo.ASCENDING), ("filename", pymongo.ASCENDING)],
                 name="unique file path",
-                unique=False,
+                unique=True,
+            ),
+            # Directory listing pages, see `MongoFileMetaDAO.ls_page`
+            IndexModel(
+                keys=[("path", pymongo.ASCENDING), ("type_", pymongo.ASCENDING), ("filename", pymongo.ASCENDING)],
+                name="listing by name",
+            ),
+            IndexModel(
+                keys=[
+                    ("path", pymongo.ASCENDING),
+                    ("type_", pymongo.ASCENDING),
+                    ("created_date", pymongo.ASCENDING),
+                    ("filename", pymongo.ASCENDING),
+                ],
+                name="listing by created date",
+            ),
+            IndexModel(
+                keys=[("icon_pending", pymongo.ASCENDING)],
+                name="pending icons",
+                partialFilterExpression={"icon_pending": True},
             ),
         ]
 
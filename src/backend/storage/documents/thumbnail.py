@@ -0,0 +1,15 @@
+from beanie import Document
+from beanie.odm.custom_types.bson.binary import BsonBinary
+
+from backend.storage.constants import ThumbnailFormat
+
+
+class ThumbnailDocument(Document):
+
+    """Icon or rendition image in every stored format, kept once and keyed by sha256 of its PNG."""
+
+    id: str  # pyright: ignore reportIncompatibleVariableOverride
+    data: dict[ThumbnailFormat, BsonBinary]
+
+    class Settings:
+        name = "thumbnails"
@@ -1,55 +1,351 @@
+import itertools
+import mmap
 import os
+import struct
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
 from io import BytesIO
-from typing import BinaryIO
+from typing import TYPE_CHECKING, BinaryIO, TypeAlias
 
-from Cryptodome.Cipher import AES
+from Cryptodome.Cipher import AES, ChaCha20_Poly1305
+from Cryptodome.Random import get_random_bytes
 
 from backend.core.settings import get_settings
+from backend.storage.constants import CipherAlgorithm
+from backend.storage.typing_ import BytesChunk
 
+if TYPE_CHECKING:
+    from Cryptodome.Cipher._mode_eax import EaxMode
+    from Cryptodome.Cipher._mode_gcm import GcmMode
+    from Cryptodome.Cipher.ChaCha20_Poly1305 import ChaCha20Poly1305Cipher
 
-def encrypt(raw_file: BinaryIO) -> tuple[BytesIO, bytes]:
-    aes_key = _get_aes_key()
+    AEADCipher: TypeAlias = EaxMode | GcmMode | ChaCha20Poly1305Cipher
 
-    cipher = AES.new(key=aes_key, mode=AES.MODE_EAX)
-    encrypted_file = BytesIO()
+# Segmented container layout:
+#   header  = magic | format version | algorithm id | segment size | nonce prefix
+#   segment = ciphertext (<= segment size) | tag
+# Every segment has its own nonce (nonce prefix | segment index | last segment flag)
+# and authenticates the header, so segments can't be reordered, truncated or moved between blobs.
+MAGIC = b"DSEG"
+FORMAT_VERSION = 1
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+_HEADER = struct.Struct(">4sBBI7s")
+# Ids are written into blob headers, so never reuse or renumber them
+ALGORITHM_IDS = {
+    CipherAlgorithm.AES_EAX: 1,
+    CipherAlgorithm.AES_GCM: 2,
+    CipherAlgorithm.CHACHA20_POLY1305: 3,
+}
+_ALGORITHMS = {algorithm_id: algorithm for algorithm, algorithm_id in ALGORITHM_IDS.items()}
+_LEGACY_CHUNK_SIZE = 1024 * AES.block_size
+_SEGMENTS_PER_WORKER = 2
 
-    while True:
-        chunk = raw_file.read(1024 * AES.block_size)
-        if not chunk:
-            _ = encrypted_file.write(cipher.digest())
-            _ = encrypted_file.seek(os.SEEK_SET)
-            _ = raw_file.seek(os.SEEK_SET)
 
-            return encrypted_file, cipher.nonce
+def encrypt(
+    raw_file: BinaryIO,
+    *,
+    cipher: CipherAlgorithm | None = None,
+    key: bytes | None = None,
+) -> tuple[BytesIO, bytes]:
+    nonce = new_nonce()
+    encrypted_file = BytesIO()
 
-        encrypted_chunk = cipher.encrypt(chunk)
+    for encrypted_chunk in encrypt_stream(raw_file, nonce, cipher=cipher, key=key, reuse_buffers=True):
         _ = encrypted_file.write(encrypted_chunk)
 
+    _ = encrypted_file.seek(os.SEEK_SET)
+    _ = raw_file.seek(os.SEEK_SET)
+    return encrypted_file, nonce
 
-def decrypt(encrypted_file: BinaryIO, nonce: bytes) -> BytesIO:
-    aes_key = _get_aes_key()
 
-    cipher = AES.new(key=aes_key, mode=AES.MODE_EAX, nonce=nonce)
+def decrypt(
+    encrypted_file: BinaryIO,
+    nonce: bytes,
+    *,
+    cipher: CipherAlgorithm | None = None,
+    key: bytes | None = None,
+) -> BytesIO:
     raw_file = BytesIO()
 
-    digest = _get_digest(encrypted_file)
+    for chunk in decrypt_stream(encrypted_file, nonce, cipher=cipher, key=key, reuse_buffers=True):
+        _ = raw_file.write(chunk)
+
+    _ = raw_file.seek(os.SEEK_SET)
+    return raw_file
+
+
+def new_nonce() -> bytes:
+    return get_random_bytes(NONCE_PREFIX_SIZE)
+
+
+def encrypt_stream(  # noqa: PLR0913
+    raw_file: BinaryIO,
+    nonce: bytes,
+    *,
+    cipher: CipherAlgorithm | None = None,
+    key: bytes | None = None,
+    segment_size: int | None = None,
+    workers: int | None = None,
+    reuse_buffers: bool = False,
+) -> Iterator[BytesChunk]:
+    """
+    Encrypt `raw_file` from its current position into the segmented format.
+
+    Yields the header and then one encrypted segment at a time, so only a couple of segments
+    (a few per worker when `workers` > 1) are kept in memory.
+    `cipher` defaults to `SECURITY_CIPHER` setting and is recorded in the header,
+    `key` (the data key of the file) defaults to `SECURITY_AES_KEY` setting.
+    With `reuse_buffers` segments are yielded as views of preallocated buffers, which are valid only
+    until the next segment is requested, so consumers must write them out right away.
+    """
+    if len(nonce) != NONCE_PREFIX_SIZE:
+        raise ValueError(f"Nonce must be {NONCE_PREFIX_SIZE} bytes long")
+
+    cipher = cipher or _get_cipher()
+    segment_size = segment_size or _get_segment_size()
+    workers = workers or _get_encryption_workers()
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, ALGORITHM_IDS[cipher], segment_size, nonce)
+    yield header
+
+    encrypt_segment = partial(_encrypt_segment, partial(_new_segment_cipher, key or _get_aes_key(), header=header))
+    segments = _iter_file_segments(raw_file, _buffer_ring(segment_size, workers=workers))
+    outputs = _buffer_ring(segment_size + TAG_SIZE, workers=workers)
+
+    for encrypted_segment in _map_segments(encrypt_segment, segments, outputs, workers=workers):
+        yield encrypted_segment if reuse_buffers else bytes(encrypted_segment)
+
+
+def decrypt_stream(  # noqa: PLR0913
+    encrypted_file: BinaryIO,
+    nonce: bytes,
+    *,
+    cipher: CipherAlgorithm | None = None,
+    key: bytes | None = None,
+    workers: int | None = None,
+    reuse_buffers: bool = False,
+) -> Iterator[BytesChunk]:
+    """
+    Decrypt `encrypted_file` and yield plaintext chunks.
+
+    The algorithm is taken from the header; `cipher`, when known from metadata, must match it.
+    Segmented blobs are verified segment by segment and read through `mmap` when the file allows it.
+    Legacy single-tag EAX blobs are verified in a first pass and decrypted in a second one,
+    so no plaintext is released before its tag is checked.
+    `key` and `reuse_buffers` work the same way as in `encrypt_stream`.
+    """
+    header = encrypted_file.read(_HEADER.size)
+    if not _is_segmented(header, nonce):
+        if cipher not in (None, CipherAlgorithm.AES_EAX):
+            raise ValueError(f"Blob has no {cipher.value} header")
+
+        _ = encrypted_file.seek(os.SEEK_SET)
+        yield from _decrypt_legacy_stream(encrypted_file, nonce, key or _get_aes_key())
+        return
+
+    _, version, algorithm_id, segment_size, _ = _HEADER.unpack(header)
+    if version != FORMAT_VERSION or algorithm_id not in _ALGORITHMS:
+        raise ValueError(f"Unsupported encryption format: version {version}, algorithm {algorithm_id}")
+    if cipher and ALGORITHM_IDS[cipher] != algorithm_id:
+        raise ValueError(f"Blob is encrypted with {_ALGORITHMS[algorithm_id].value}, not {cipher.value}")
+
+    workers = workers or _get_encryption_workers()
+    record_size = segment_size + TAG_SIZE
+    decrypt_segment = partial(_decrypt_segment, partial(_new_segment_cipher, key or _get_aes_key(), header=header))
+
+    view = _get_view(encrypted_file)
+    if view is None:
+        records = _iter_file_segments(encrypted_file, _buffer_ring(record_size, workers=workers))
+    else:
+        records = _iter_view_segments(view[encrypted_file.tell() :], record_size)
+    outputs = _buffer_ring(segment_size, workers=workers)
+
+    for segment in _map_segments(decrypt_segment, records, outputs, workers=workers):
+        yield segment if reuse_buffers else bytes(segment)
+
+
+def _encrypt_segment(
+    new_cipher: Callable[..., "AEADCipher"],
+    segment: memoryview,
+    output: memoryview,
+    *,
+    index: int,
+    is_last: bool,
+) -> memoryview:
+    size = len(segment)
+    cipher = new_cipher(index=index, is_last=is_last)
+
+    _ = cipher.encrypt(segment, output=output[:size])
+    output[size : size + TAG_SIZE] = cipher.digest()
+    return output[: size + TAG_SIZE]
+
+
+def _decrypt_segment(
+    new_cipher: Callable[..., "AEADCipher"],
+    record: memoryview,
+    output: memoryview,
+    *,
+    index: int,
+    is_last: bool,
+) -> memoryview:
+    if len(record) < TAG_SIZE:
+        raise ValueError("Encrypted segment is truncated")
+
+    size = len(record) - TAG_SIZE
+    cipher = new_cipher(index=index, is_last=is_last)
+
+    _ = cipher.decrypt(record[:size], output=output[:size])
+    cipher.verify(record[size:])
+    return output[:size]
+
+
+def _iter_file_segments(file_: BinaryIO, buffers: Iterator[memoryview]) -> Iterator[tuple[memoryview, int, bool]]:
+    segment = _readinto_exactly(file_, next(buffers))
+    index = 0
     while True:
-        encrypted_chunk = encrypted_file.read(1024 * AES.block_size)
-        if not encrypted_chunk:
-            cipher.verify(digest)
-            _ = raw_file.seek(os.SEEK_SET)
-            return raw_file
+        next_segment = _readinto_exactly(file_, next(buffers))
+        is_last = not next_segment
+        yield segment, index, is_last
 
-        chunk = cipher.decrypt(encrypted_chunk)
-        _ = raw_file.write(chunk)
+        if is_last:
+            return
 
+        segment = next_segment
+        index += 1
 
-def _get_digest(encrypted_file: BinaryIO) -> bytes:
-    encrypted_data_size = encrypted_file.seek(-AES.block_size, os.SEEK_END)  # Note minus sign
-    digest = encrypted_file.read()
-    _ = encrypted_file.truncate(encrypted_data_size)
+
+def _iter_view_segments(view: memoryview, segment_size: int) -> Iterator[tuple[memoryview, int, bool]]:
+    offset = 0
+    index = 0
+    while True:
+        segment = view[offset : offset + segment_size]
+        offset += segment_size
+        is_last = offset >= len(view)
+        yield segment, index, is_last
+
+        if is_last:
+            return
+
+        index += 1
+
+
+def _map_segments(
+    func: Callable[..., memoryview],
+    segments: Iterator[tuple[memoryview, int, bool]],
+    outputs: Iterator[memoryview],
+    *,
+    workers: int,
+) -> Iterator[memoryview]:
+    """Apply `func` to segments in order, on a thread pool when `workers` > 1."""
+    if workers <= 1:
+        for (segment, index, is_last), output in zip(segments, outputs):
+            yield func(segment, output, index=index, is_last=is_last)
+        return
+
+    pool = _get_segment_pool(workers)
+    pending: deque[Future[memoryview]] = deque()
+    try:
+        for (segment, index, is_last), output in zip(segments, outputs):
+            pending.append(pool.submit(func, segment, output, index=index, is_last=is_last))
+            if len(pending) >= workers * _SEGMENTS_PER_WORKER:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            _ = future.cancel()
+
+
+def _buffer_ring(size: int, *, workers: int) -> Iterator[memoryview]:
+    # A buffer is handed out again only after all segments that may still use it
+    # (in flight, read ahead, or yielded to the consumer) are done with it
+    count = max(workers, 1) * _SEGMENTS_PER_WORKER + 2
+    return itertools.cycle([memoryview(bytearray(size)) for _ in range(count)])
+
+
+def _get_view(file_: BinaryIO) -> memoryview | None:
+    if isinstance(file_, BytesIO):
+        return file_.getbuffer()
+
+    try:
+        # Closed on garbage collection: memoryviews of the map may still be alive in the worker threads
+        mapped_file = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return memoryview(mapped_file)
+
+
+def _readinto_exactly(file_: BinaryIO, buffer: memoryview) -> memoryview:
+    size = 0
+    while size < len(buffer):
+        read_size = file_.readinto(buffer[size:])  # pyright: ignore reportAttributeAccessIssue
+        if not read_size:
+            break
+        size += read_size
+    return buffer[:size]
+
+
+def _decrypt_legacy_stream(encrypted_file: BinaryIO, nonce: bytes, aes_key: bytes) -> Iterator[bytes]:
+    encrypted_data_size, digest = _get_digest(encrypted_file)
+
+    cipher = AES.new(key=aes_key, mode=AES.MODE_EAX, nonce=nonce)
+    for encrypted_chunk in _iter_legacy_chunks(encrypted_file, encrypted_data_size):
+        _ = cipher.decrypt(encrypted_chunk)
+    cipher.verify(digest)
+
+    cipher = AES.new(key=aes_key, mode=AES.MODE_EAX, nonce=nonce)
+    for encrypted_chunk in _iter_legacy_chunks(encrypted_file, encrypted_data_size):
+        yield cipher.decrypt(encrypted_chunk)
+
+
+def _iter_legacy_chunks(encrypted_file: BinaryIO, encrypted_data_size: int) -> Iterator[bytes]:
     _ = encrypted_file.seek(os.SEEK_SET)
-    return digest
+    left = encrypted_data_size
+
+    while left > 0:
+        encrypted_chunk = encrypted_file.read(min(_LEGACY_CHUNK_SIZE, left))
+        if not encrypted_chunk:
+            return
+        left -= len(encrypted_chunk)
+        yield encrypted_chunk
+
+
+def _get_digest(encrypted_file: BinaryIO) -> tuple[int, bytes]:
+    encrypted_data_size = max(encrypted_file.seek(0, os.SEEK_END) - AES.block_size, 0)
+    _ = encrypted_file.seek(encrypted_data_size)
+    digest = encrypted_file.read()
+    return encrypted_data_size, digest
+
+
+def _is_segmented(header: bytes, nonce: bytes) -> bool:
+    return len(header) == _HEADER.size and header.startswith(MAGIC) and header.endswith(nonce)
+
+
+def _new_segment_cipher(aes_key: bytes, *, header: bytes, index: int, is_last: bool) -> "AEADCipher":
+    _, _, algorithm_id, _, nonce_prefix = _HEADER.unpack(header)
+    segment_nonce = nonce_prefix + index.to_bytes(4, "big") + (b"\x01" if is_last else b"\x00")
+
+    cipher: AEADCipher
+    match _ALGORITHMS[algorithm_id]:
+        case CipherAlgorithm.AES_EAX:
+            cipher = AES.new(key=aes_key, mode=AES.MODE_EAX, nonce=segment_nonce)
+        case CipherAlgorithm.AES_GCM:
+            cipher = AES.new(key=aes_key, mode=AES.MODE_GCM, nonce=segment_nonce)
+        case CipherAlgorithm.CHACHA20_POLY1305:
+            cipher = ChaCha20_Poly1305.new(key=aes_key, nonce=segment_nonce)
+
+    _ = cipher.update(header)
+    return cipher
+
+
+@lru_cache
+def _get_segment_pool(workers: int) -> ThreadPoolExecutor:
+    # pycryptodome releases the GIL in its C code, so threads are enough to use all cores
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment-crypto")
 
 
 def _get_aes_key() -> bytes:
@@ -57,6 +353,25 @@ def _get_aes_key() -> bytes:
     return settings.security.aes_key
 
 
+def _get_cipher() -> CipherAlgorithm:
+    settings = get_settings()
+    return settings.security.cipher
+
+
+def _get_segment_size() -> int:
+    settings = get_settings()
+    return settings.security.encryption_segment_size
+
+
+def _get_encryption_workers() -> int:
+    settings = get_settings()
+    return settings.security.encryption_workers
+
+
+# Worker threads don't survive fork, so a pool inherited by a process pool worker must not be reused
+os.register_at_fork(after_in_child=_get_segment_pool.cache_clear)
+
+
 if __name__ == "__main__":
     from backend.storage.constants import PDF_THUMBNAIL
 
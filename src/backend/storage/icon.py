@@ -1,26 +1,165 @@
+import hashlib
 import io
+import math
+import pathlib
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
 from typing import BinaryIO
 
-from PIL import Image
+from PIL import Image, features
 
-from backend.storage.constants import PDF_THUMBNAIL, THUMBNAIL_SIZE, SupportedFileTypes
+from backend.core.settings import get_settings
+from backend.storage.constants import (
+    ICON_RENDITION,
+    PDF_PREVIEW,
+    PDF_THUMBNAIL,
+    THUMBNAIL_SIZE,
+    SupportedFileTypes,
+    ThumbnailFormat,
+)
+
+Size = tuple[int, int]
+Rendition = dict[ThumbnailFormat, io.BytesIO]
+
+_REDUCING_GAP = 2.0
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+class UndecodableImageError(ValueError):
+    pass
 
 
 def get_thumbnail(*, file_type: SupportedFileTypes, file_: BinaryIO | None = None) -> io.BytesIO:
-    output_file = io.BytesIO()
+    renditions = get_renditions(file_type=file_type, file_=file_, sizes={ICON_RENDITION: THUMBNAIL_SIZE})
+    return renditions[ICON_RENDITION][ThumbnailFormat.PNG]
+
+
+def get_thumbnail_hash(thumbnail: bytes) -> str:
+    return hashlib.sha256(thumbnail).hexdigest()
+
+
+def get_rendition_sizes() -> dict[str, Size]:
+    settings = get_settings()
+    return {ICON_RENDITION: THUMBNAIL_SIZE} | settings.storage_renditions
 
+
+def get_thumbnail_formats() -> list[ThumbnailFormat]:
+    settings = get_settings()
+
+    if settings.storage_thumbnail_webp and features.check("webp"):
+        return [ThumbnailFormat.PNG, ThumbnailFormat.WEBP]
+    return [ThumbnailFormat.PNG]
+
+
+def get_renditions(
+    *,
+    file_type: SupportedFileTypes,
+    sizes: Mapping[str, Size],
+    file_: BinaryIO | None = None,
+    formats: Sequence[ThumbnailFormat] = (ThumbnailFormat.PNG,),
+) -> dict[str, Rendition]:
+    """
+    Build every size in `sizes` in every one of `formats`, decoding the image only once.
+
+    Raises `ImageTooLargeError` without decoding, if the image doesn't fit `STORAGE_THUMBNAIL_MAX_PIXELS`.
+    """
     if file_type == SupportedFileTypes.PDF:
-        with PDF_THUMBNAIL.open("rb") as f:
-            output_file = io.BytesIO(f.read())
+        renditions = {name: _get_pdf_icon(size, formats) for name, size in sizes.items()}
 
     elif file_type in [SupportedFileTypes.JPEG, SupportedFileTypes.JPG, SupportedFileTypes.PNG] and file_:
-        image = Image.open(file_)
-        image.thumbnail(THUMBNAIL_SIZE)
-        image.save(output_file, format="PNG")
-
-        _ = file_.seek(0)
+        try:
+            renditions = _get_image_renditions(file_, sizes, formats)
+        finally:
+            _ = file_.seek(0)
     else:
         raise ValueError("Invalid file type")
 
-    _ = output_file.seek(0)
+    for rendition in renditions.values():
+        for output_file in rendition.values():
+            _ = output_file.seek(0)
+    return renditions
+
+
+def _get_image_renditions(
+    file_: BinaryIO,
+    sizes: Mapping[str, Size],
+    formats: Sequence[ThumbnailFormat],
+) -> dict[str, Rendition]:
+    renditions: dict[str, Rendition] = {}
+
+    with _open_image(file_) as image:
+        # JPEG is scaled by 1/2, 1/4 or 1/8 right while decoding (in DCT domain), other formats ignore it.
+        # The size is enough for the biggest rendition, so the image is decoded once for all of them
+        _ = image.draft(None, _get_draft_size(image.size, sizes))
+
+        width, height = image.size
+        if width * height > _get_max_pixels():
+            raise ImageTooLargeError(f"Image of {width}x{height} pixels is too large to decode")
+        _ = image.load()
+
+        for name, size in sizes.items():
+            resized_image = image.copy()
+            # Shrinks by an integer factor with `reduce` first, then resamples the rest
+            resized_image.thumbnail(size, reducing_gap=_REDUCING_GAP)
+
+            renditions[name] = {image_format: _save(resized_image, image_format) for image_format in formats}
+
+    return renditions
+
+
+def get_fallback_renditions(sizes: Mapping[str, Size], formats: Sequence[ThumbnailFormat]) -> dict[str, Rendition]:
+    """Build placeholder renditions for images which can't be decoded within the pixel budget."""
+    return {
+        name: {image_format: io.BytesIO(_get_fallback_icon(size, image_format)) for image_format in formats}
+        for name, size in sizes.items()
+    }
+
+
+def _open_image(file_: BinaryIO) -> Image.Image:
+    # Pillow's decompression bomb check stays the outer bound, the pixel budget is checked before `load`.
+    # Its warning isn't silenced: `warnings.catch_warnings` isn't thread safe, images are opened in a thread pool
+    try:
+        return Image.open(file_)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+
+
+def _save(image: Image.Image, image_format: ThumbnailFormat) -> io.BytesIO:
+    output_file = io.BytesIO()
+    image.save(output_file, format=image_format.value)
     return output_file
+
+
+def _get_draft_size(image_size: Size, sizes: Mapping[str, Size]) -> Size:
+    width, height = image_size
+    scale = max(min(max_width / width, max_height / height) for max_width, max_height in sizes.values())
+    # Same margin as `Image.thumbnail` keeps for the final resampling, so quality doesn't change
+    return math.ceil(width * scale * _REDUCING_GAP), math.ceil(height * scale * _REDUCING_GAP)
+
+
+def _get_pdf_icon(size: Size, formats: Sequence[ThumbnailFormat]) -> Rendition:
+    path = PDF_THUMBNAIL if max(size) <= max(THUMBNAIL_SIZE) else PDF_PREVIEW
+    return {image_format: io.BytesIO(_read_static_icon(path, image_format)) for image_format in formats}
+
+
+@lru_cache
+def _get_fallback_icon(size: Size, image_format: ThumbnailFormat) -> bytes:
+    side = min(size)
+    return _save(Image.new(mode="RGB", size=(side, side), color="lightgray"), image_format).getvalue()
+
+
+def _get_max_pixels() -> int:
+    settings = get_settings()
+    return settings.storage_thumbnail_max_pixels
+
+
+@lru_cache
+def _read_static_icon(path: pathlib.Path, image_format: ThumbnailFormat) -> bytes:
+    if image_format == ThumbnailFormat.PNG:
+        return path.read_bytes()
+
+    with Image.open(path) as image:
+        return _save(image, image_format).getvalue()
@@ -0,0 +1,83 @@
+"""
+Envelope encryption.
+
+Every blob is encrypted with its own random data key. The data key is stored in file meta wrapped
+(encrypted) by the master key `SECURITY_AES_KEY` together with the master key id, so rotating
+the master key only re-wraps these few bytes per file and never touches blobs.
+"""
+import hashlib
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Random import get_random_bytes
+
+from backend.core.settings import get_settings
+
+DATA_KEY_SIZE = 32
+
+_WRAP_NONCE_SIZE = 12
+_WRAP_TAG_SIZE = 16
+
+
+def new_data_key() -> bytes:
+    return get_random_bytes(DATA_KEY_SIZE)
+
+
+def get_current_key_id() -> str:
+    return get_key_id(_get_master_key())
+
+
+def rewrap_key(wrapped_key: bytes | None, key_id: str | None) -> tuple[bytes, str]:
+    """Wrap the data key of a file with the current master key."""
+    return wrap_key(get_data_key(wrapped_key, key_id))
+
+
+def get_data_key(wrapped_key: bytes | None, key_id: str | None) -> bytes:
+    """Return the key a blob is encrypted with, files without a wrapped key use the legacy master key directly."""
+    if wrapped_key is None or key_id is None:
+        return _get_legacy_master_key()
+    return unwrap_key(wrapped_key, key_id)
+
+
+def wrap_key(data_key: bytes) -> tuple[bytes, str]:
+    """Wrap `data_key` with the current master key, returns the wrapped key and the master key id."""
+    master_key = _get_master_key()
+    key_id = get_key_id(master_key)
+
+    cipher = AES.new(key=master_key, mode=AES.MODE_GCM, nonce=get_random_bytes(_WRAP_NONCE_SIZE))
+    _ = cipher.update(key_id.encode())
+    wrapped_key, digest = cipher.encrypt_and_digest(data_key)
+    return cipher.nonce + wrapped_key + digest, key_id
+
+
+def unwrap_key(wrapped_key: bytes, key_id: str) -> bytes:
+    master_key = _get_master_keys().get(key_id)
+    if master_key is None:
+        raise ValueError(f"Master key {key_id} is unknown, add it to SECURITY_PREVIOUS_AES_KEYS")
+
+    nonce, wrapped_key, digest = (
+        wrapped_key[:_WRAP_NONCE_SIZE],
+        wrapped_key[_WRAP_NONCE_SIZE:-_WRAP_TAG_SIZE],
+        wrapped_key[-_WRAP_TAG_SIZE:],
+    )
+    cipher = AES.new(key=master_key, mode=AES.MODE_GCM, nonce=nonce)
+    _ = cipher.update(key_id.encode())
+    return cipher.decrypt_and_verify(wrapped_key, digest)
+
+
+def _get_legacy_master_key() -> bytes:
+    settings = get_settings()
+    return settings.security.previous_aes_keys[-1] if settings.security.previous_aes_keys else _get_master_key()
+
+
+def _get_master_keys() -> dict[str, bytes]:
+    settings = get_settings()
+    return {get_key_id(key): key for key in [settings.security.aes_key, *settings.security.previous_aes_keys]}
+
+
+def _get_master_key() -> bytes:
+    settings = get_settings()
+    return settings.security.aes_key
+
+
+def get_key_id(master_key: bytes) -> str:
+    return hashlib.sha256(master_key).hexdigest()[:16]
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from backend.storage.controllers.file_meta import FileMetaController
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+
+logger = logging.getLogger(__name__)
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_NOT_SUPPORTED = 40573
+
+
+async def build_pending_icons(controller: FileMetaController, *, interval: float) -> None:
+    """
+    Background pass for lazy thumbnails mode.
+
+    Icons are built one by one, so the pass never holds more than one executor slot
+    and foreground uploads and downloads don't queue behind it. Files go in `_id` order and a file which fails
+    stays behind, so it doesn't block the rest: it's retried when the queue starts over, after `interval`.
+    A failed read of the queue is logged and retried after `interval` too.
+    """
+    after = None
+    while True:
+        try:
+            if last_id := await controller.build_pending_icons(limit=1, after=after):
+                after = last_id
+                continue
+            after = None
+        except Exception:
+            logger.exception("Can't build pending icons")
+
+        await asyncio.sleep(interval)
+
+
+async def invalidate_file_meta_cache(
+    db_dao: MongoFileMetaDAO,
+    *,
+    ttl: float,
+    fallback_ttl: float,
+    retry_interval: float,
+) -> None:
+    """
+    Keep the file meta cache in sync with writes of other workers and nodes by following a change stream.
+
+    While the stream is open cached entries live for `ttl`. When change streams are unavailable (standalone
+    server, connection lost) events may be missed, so the cache is cleared and entries live for `fallback_ttl`
+    until the stream is reopened, which is retried every `retry_interval` seconds. On a standalone server
+    the TTL fallback is permanent.
+    """
+    while True:
+        try:
+            async with db_dao.watch_changes() as stream:
+                # Reads started before the stream was opened may have missed a change
+                db_dao.cache.ttl = ttl
+                db_dao.cache.clear()
+                async for change in stream:
+                    db_dao.invalidate_changed(change)
+        except PyMongoError as e:
+            if isinstance(e, OperationFailure) and e.code == CHANGE_STREAMS_NOT_SUPPORTED:
+                logger.info("Mongo doesn't support change streams, file meta cache falls back to TTL")
+                return
+            logger.warning("File meta change stream is unavailable, cache falls back to TTL", exc_info=True)
+        finally:
+            db_dao.cache.ttl = fallback_ttl
+            db_dao.cache.clear()
+
+        await asyncio.sleep(retry_interval)
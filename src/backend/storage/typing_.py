@@ -3,6 +3,7 @@ from typing import NotRequired, TypeAlias, TypedDict
 
 FileName: TypeAlias = str
 FilePath: TypeAlias = Path
+BytesChunk: TypeAlias = bytes | memoryview
 
 
 class OptionalFileAttributes(TypedDict):
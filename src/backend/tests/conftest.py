@@ -10,14 +10,18 @@ from fastapi import FastAPI
 from httpx import AsyncClient
 from PIL import Image
 
+from backend.core.cache import LRUCache
 from backend.core.events import setup_mongo, teardown_mongo
+from backend.core.metrics import MetricsRegistry
 from backend.create_app import create_app
 from backend.storage.constants import SupportedFileTypes
 from backend.storage.controllers.dir_meta import DirMetaController
 from backend.storage.controllers.file_meta import FileMetaController
-from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao.mongo_file_meta import FileMetaCache, MongoFileMetaDAO, get_file_meta_cache
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
 from backend.storage.dao.os_file_meta import OSFileMetaDAO
 from backend.storage.documents.file_meta import FileMetaDocument
+from backend.storage.documents.thumbnail import ThumbnailDocument
 
 if TYPE_CHECKING:
     from faker import Faker
@@ -50,18 +54,37 @@ def override_settings(app: FastAPI) -> Callable[[Any, Any], contextlib.AbstractC
 @pytest.fixture()
 async def _init_beanie() -> AsyncGenerator[None]:  # pyright: ignore reportUnusedFunction
     await setup_mongo()
+    get_file_meta_cache().clear()
 
     yield
 
     await teardown_mongo()
 
 
+@pytest.fixture()
+def file_meta_cache() -> FileMetaCache:
+    # Enabled, like the cache of a process following a change stream. The default one is off in tests
+    return LRUCache(
+        "test_file_meta",
+        max_entries=100,
+        max_bytes=1024 * 1024,
+        ttl=60,
+        get_size=lambda _: 1,
+        metrics=MetricsRegistry(),
+    )
+
+
 @pytest.fixture()
 def file_meta_controller_factory():
-    def wrapper(db_dao: MongoFileMetaDAO | None = None, os_dao: OSFileMetaDAO | None = None) -> FileMetaController:
+    def wrapper(
+        db_dao: MongoFileMetaDAO | None = None,
+        os_dao: OSFileMetaDAO | None = None,
+        thumbnail_dao: MongoThumbnailDAO | None = None,
+    ) -> FileMetaController:
         db_dao = db_dao or MongoFileMetaDAO()
         os_dao = os_dao or OSFileMetaDAO()
-        return FileMetaController(db_dao=db_dao, os_dao=os_dao)
+        thumbnail_dao = thumbnail_dao or MongoThumbnailDAO()
+        return FileMetaController(db_dao=db_dao, os_dao=os_dao, thumbnail_dao=thumbnail_dao)
 
     return wrapper
 
@@ -100,6 +123,8 @@ async def file_meta_document_factory(_init_beanie: None, file_meta_document_tear
             nonce=kwargs.get("nonce", None if type_ == SupportedFileTypes.DIR else faker.pystr().encode()),
         )
         d = await document.create()
+        # Documents are created behind the DAO's back
+        get_file_meta_cache().clear()
         return d
 
     return wrapper
@@ -109,3 +134,4 @@ async def file_meta_document_factory(_init_beanie: None, file_meta_document_tear
 async def file_meta_document_teardown():
     yield
     _ = await FileMetaDocument.delete_all()
+    _ = await ThumbnailDocument.delete_all()
@@ -0,0 +1,84 @@
+import hashlib
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from typing import Any
+
+import httpx
+import pytest
+from fastapi import FastAPI, status
+
+from backend.core.api.endpoints.icons import CACHE_CONTROL
+from backend.storage.constants import ThumbnailFormat
+from backend.storage.dao.mongo_thumbnail import MongoThumbnailDAO
+
+PNG_ICON = b"png"
+WEBP_ICON = b"webp"
+ICON_HASH = hashlib.sha256(PNG_ICON).hexdigest()
+PNG_ONLY_ICON_HASH = hashlib.sha256(b"png only").hexdigest()
+WEBP_ACCEPT = "image/avif,image/webp,*/*;q=0.8"
+
+
+class InMemoryThumbnailDAO:
+    async def get(self, thumbnail_hash: str) -> dict[ThumbnailFormat, bytes] | None:
+        return {
+            ICON_HASH: {ThumbnailFormat.PNG: PNG_ICON, ThumbnailFormat.WEBP: WEBP_ICON},
+            PNG_ONLY_ICON_HASH: {ThumbnailFormat.PNG: PNG_ICON},
+        }.get(thumbnail_hash)
+
+
+@pytest.mark.parametrize(
+    ("thumbnail_hash", "headers", "status_code", "content"),
+    [
+        (ICON_HASH, {}, status.HTTP_200_OK, PNG_ICON),
+        (ICON_HASH, {"Accept": WEBP_ACCEPT}, status.HTTP_200_OK, WEBP_ICON),
+        (ICON_HASH, {"Accept": "image/webp;q=0, image/png"}, status.HTTP_200_OK, PNG_ICON),
+        (PNG_ONLY_ICON_HASH, {"Accept": WEBP_ACCEPT}, status.HTTP_200_OK, PNG_ICON),
+        (ICON_HASH, {"If-None-Match": f'"foo", W/"{ICON_HASH}.png"'}, status.HTTP_304_NOT_MODIFIED, None),
+        (ICON_HASH, {"If-None-Match": f'"{ICON_HASH}.webp"'}, status.HTTP_200_OK, PNG_ICON),
+        (
+            ICON_HASH,
+            {"If-None-Match": f'"{ICON_HASH}.webp"', "Accept": WEBP_ACCEPT},
+            status.HTTP_304_NOT_MODIFIED,
+            None,
+        ),
+        (ICON_HASH, {"If-None-Match": "*"}, status.HTTP_304_NOT_MODIFIED, None),
+        ("0" * 64, {}, status.HTTP_404_NOT_FOUND, None),
+        ("0" * 64, {"If-None-Match": "*"}, status.HTTP_404_NOT_FOUND, None),
+        ("0" * 64, {"If-None-Match": f'"{"0" * 64}.png"'}, status.HTTP_404_NOT_FOUND, None),
+        (
+            PNG_ONLY_ICON_HASH,
+            {"If-None-Match": f'"{PNG_ONLY_ICON_HASH}.webp"', "Accept": WEBP_ACCEPT},
+            status.HTTP_200_OK,
+            PNG_ICON,
+        ),
+    ],
+)
+async def test_icon(
+    app: FastAPI,
+    test_client: httpx.AsyncClient,
+    override_settings: Callable[[Any, Any], AbstractContextManager[None]],
+    *,
+    thumbnail_hash: str,
+    headers: dict[str, str],
+    status_code: int,
+    content: bytes | None,
+):
+    with override_settings(MongoThumbnailDAO, InMemoryThumbnailDAO):
+        url = app.router.url_path_for("icon", thumbnail_hash=thumbnail_hash)
+        response = await test_client.get(url, headers=headers)
+
+    assert response.status_code == status_code
+    if content is not None:
+        image_format = ThumbnailFormat.WEBP if content == WEBP_ICON else ThumbnailFormat.PNG
+        assert response.content == content
+        assert response.headers["content-type"] == f"image/{image_format.value}"
+        assert response.headers["etag"] == f'"{thumbnail_hash}.{image_format.value}"'
+        assert response.headers["cache-control"] == CACHE_CONTROL
+        assert response.headers["vary"] == "Accept"
+
+
+async def test_invalid_hash(app: FastAPI, test_client: httpx.AsyncClient):
+    url = app.router.url_path_for("icon", thumbnail_hash="foo")
+    response = await test_client.get(url)
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
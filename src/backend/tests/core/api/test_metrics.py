@@ -0,0 +1,35 @@
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from typing import Any
+
+import httpx
+import pytest
+from fastapi import FastAPI, status
+
+from backend.core.metrics import MetricsRegistry, get_metrics_registry
+
+
+@pytest.mark.asyncio()
+async def test_metrics(
+    app: FastAPI,
+    test_client: httpx.AsyncClient,
+    override_settings: Callable[[Any, Any], AbstractContextManager[None]],
+):
+    counter_value, gauge_value = 2, 5
+    registry = MetricsRegistry()
+    registry.counter("foo").inc(counter_value)
+    registry.gauge("bar").set(gauge_value)
+    registry.histogram("baz").observe(0.2)
+
+    with override_settings(get_metrics_registry, lambda: registry):
+        url = app.router.url_path_for("metrics")
+        response = await test_client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["foo"] == counter_value
+        assert data["bar"] == gauge_value
+        assert data["baz"]["count"] == 1
+        assert data["baz"]["buckets"]["0.1"] == 0
+        assert data["baz"]["buckets"]["0.5"] == 1
+        assert data["baz"]["buckets"]["+Inf"] == 1
@@ -0,0 +1,100 @@
+import pytest
+from pytest_mock import MockerFixture
+
+from backend.core.cache import LRUCache
+from backend.core.metrics import MetricsRegistry
+
+MISSING = object()
+
+
+class TestLRUCache:
+    def test_get(self):
+        cache = make_cache()
+        cache.set("foo", "bar")
+
+        assert cache.get("foo", MISSING) == "bar"
+        assert cache.get("baz", MISSING) is MISSING
+
+    def test_evicts_least_recently_used(self):
+        cache = make_cache(max_entries=2)
+        cache.set("foo", "1")
+        cache.set("bar", "2")
+        _ = cache.get("foo", MISSING)
+
+        cache.set("baz", "3")
+
+        assert cache.get("bar", MISSING) is MISSING
+        assert cache.get("foo", MISSING) == "1"
+        assert cache.get("baz", MISSING) == "3"
+
+    def test_max_bytes(self):
+        cache = make_cache(max_bytes=10)
+        cache.set("foo", "x" * 6)
+        cache.set("bar", "x" * 6)
+        cache.set("baz", "x" * 11)
+
+        assert cache.get("foo", MISSING) is MISSING
+        assert cache.get("bar", MISSING) == "x" * 6
+        assert cache.get("baz", MISSING) is MISSING
+
+    def test_ttl(self, mocker: MockerFixture):
+        monotonic = mocker.patch("backend.core.cache.time.monotonic", return_value=100)
+        cache = make_cache(ttl=5)
+        cache.set("foo", "bar")
+
+        monotonic.return_value = 105
+
+        assert cache.get("foo", MISSING) is MISSING
+
+    @pytest.mark.parametrize(("max_entries", "ttl"), [(0, 60), (10, 0)])
+    def test_disabled(self, max_entries: int, ttl: int):
+        cache = make_cache(max_entries=max_entries, ttl=ttl)
+        cache.set("foo", "bar")
+
+        assert cache.get("foo", MISSING) is MISSING
+
+    def test_stale_set_is_skipped(self):
+        cache = make_cache()
+        generation = cache.generation
+
+        cache.invalidate("foo")
+        cache.set("foo", "stale", generation=generation)
+
+        assert cache.get("foo", MISSING) is MISSING
+
+    def test_invalidate_where(self):
+        cache = make_cache()
+        cache.set("/a/b", "1")
+        cache.set("/a/bc", "2")
+
+        cache.invalidate_where(lambda key: key.startswith("/a/b/") or key == "/a/b")
+
+        assert cache.get("/a/b", MISSING) is MISSING
+        assert cache.get("/a/bc", MISSING) == "2"
+
+    def test_metrics(self):
+        metrics = MetricsRegistry()
+        cache = make_cache(metrics, max_entries=1)
+        cache.set("foo", "bar")
+        _ = cache.get("foo", MISSING)
+        _ = cache.get("baz", MISSING)
+        cache.set("baz", "quux")
+
+        assert metrics.snapshot() == {
+            "test_cache_bytes": 4,
+            "test_cache_entries": 1,
+            "test_cache_evictions_total": 1,
+            "test_cache_hits_total": 1,
+            "test_cache_misses_total": 1,
+        }
+
+
+def make_cache(metrics: MetricsRegistry | None = None, **kwargs: int) -> LRUCache[str, str]:
+    return LRUCache(
+        "test",
+        max_entries=kwargs.get("max_entries", 10),
+        max_bytes=kwargs.get("max_bytes", 1000),
+        ttl=kwargs.get("ttl", 60),
+        get_size=len,
+        metrics=metrics or MetricsRegistry(),
+    )
@@ -0,0 +1,46 @@
+import operator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from backend.core.executor import CPUExecutor
+from backend.core.metrics import MetricsRegistry
+
+
+@pytest.fixture(params=[ThreadPoolExecutor, ProcessPoolExecutor])
+def executor(request: pytest.FixtureRequest):
+    pool = request.param(max_workers=2)
+    executor = CPUExecutor(pool, MetricsRegistry())
+    yield executor
+    executor.shutdown()
+
+
+class TestCPUExecutor:
+    async def test_run(self, executor: CPUExecutor):
+        result = await executor.run(operator.add, 1, 2)
+
+        assert result == 1 + 2
+
+    async def test_run_exception(self, executor: CPUExecutor):
+        with pytest.raises(ZeroDivisionError):
+            _ = await executor.run(operator.truediv, 1, 0)
+
+    async def test_iterate(self, executor: CPUExecutor):
+        data = [item async for item in executor.iterate(iter([1, 2, 3]))]
+
+        assert data == [1, 2, 3]
+
+    async def test_metrics(self):
+        metrics = MetricsRegistry()
+        executor = CPUExecutor(ThreadPoolExecutor(max_workers=1), metrics)
+
+        _ = await executor.run(operator.add, 1, 2)
+        with pytest.raises(ZeroDivisionError):
+            _ = await executor.run(operator.truediv, 1, 0)
+        executor.shutdown()
+
+        snapshot = metrics.snapshot()
+        assert snapshot["executor_tasks_pending"] == 0
+        assert snapshot["executor_tasks_total"] == 1
+        assert snapshot["executor_task_run_seconds"]["count"] == 1
+        assert snapshot["executor_task_wait_seconds"]["count"] == 1
@@ -0,0 +1,46 @@
+from pytest_mock import MockerFixture
+
+from backend.core.metrics import MetricsRegistry
+from backend.core.mongo_monitoring import MongoMetricsListener
+
+
+class TestMongoMetricsListener:
+    def test_commands(self, mocker: MockerFixture):
+        metrics = MetricsRegistry()
+        listener = MongoMetricsListener(metrics)
+
+        listener.succeeded(mocker.Mock(command_name="find", duration_micros=2_000))
+        listener.succeeded(mocker.Mock(command_name="getMore", duration_micros=500))
+        listener.failed(mocker.Mock(command_name="find", duration_micros=7_000_000))
+
+        snapshot = metrics.snapshot()
+        assert snapshot["mongo_command_find_seconds"]["count"] == 2  # noqa: PLR2004
+        assert snapshot["mongo_command_find_seconds"]["sum"] == 7.002  # noqa: PLR2004
+        assert snapshot["mongo_command_getmore_seconds"]["buckets"]["0.001"] == 1
+        assert snapshot["mongo_command_failures_total"] == 1
+
+    def test_pool(self, mocker: MockerFixture):
+        metrics = MetricsRegistry()
+        listener = MongoMetricsListener(metrics)
+        _ = mocker.patch("backend.core.mongo_monitoring.time.perf_counter", side_effect=[10, 10.5, 11, 11.1])
+        event = mocker.Mock()
+
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        listener.connection_check_out_started(event)
+        listener.connection_check_out_failed(event)
+
+        snapshot = metrics.snapshot()
+        assert snapshot["mongo_pool_connections"] == 1
+        assert snapshot["mongo_pool_connections_in_use"] == 1
+        assert snapshot["mongo_pool_checkout_wait_seconds"]["count"] == 2  # noqa: PLR2004
+        assert snapshot["mongo_pool_checkout_wait_seconds"]["buckets"]["0.1"] == 1
+        assert snapshot["mongo_pool_checkout_failures_total"] == 1
+
+        listener.connection_checked_in(event)
+        listener.connection_closed(event)
+
+        snapshot = metrics.snapshot()
+        assert snapshot["mongo_pool_connections"] == 0
+        assert snapshot["mongo_pool_connections_in_use"] == 0
@@ -0,0 +1,53 @@
+import pytest
+from pydantic import ValidationError
+from pytest_mock import MockerFixture
+
+from backend.core.settings import Settings
+from backend.storage.constants import CompressionAlgorithm
+
+
+class TestStorageSettings:
+    def test_zstd_without_zstandard(self, mocker: MockerFixture):
+        _ = mocker.patch("backend.core.settings.storage.importlib.util.find_spec", return_value=None)
+
+        with pytest.raises(ValidationError, match="zstd compression requires `zstandard` package"):
+            _ = Settings(storage_compression=CompressionAlgorithm.ZSTD)  # pyright: ignore reportGeneralTypeIssues
+
+    def test_zlib_without_zstandard(self, mocker: MockerFixture):
+        _ = mocker.patch("backend.core.settings.storage.importlib.util.find_spec", return_value=None)
+
+        settings = Settings(storage_compression=CompressionAlgorithm.ZLIB)  # pyright: ignore reportGeneralTypeIssues
+
+        assert settings.storage_compression == CompressionAlgorithm.ZLIB
+
+    @pytest.mark.parametrize(
+        ("compression", "level"),
+        [
+            (CompressionAlgorithm.ZLIB, 10),
+            (CompressionAlgorithm.ZLIB, -2),
+            (CompressionAlgorithm.ZSTD, 23),
+        ],
+    )
+    def test_invalid_compression_level(self, compression: CompressionAlgorithm, level: int):
+        with pytest.raises(ValidationError, match=f"{compression.value} compression level must be from"):
+            _ = Settings(
+                storage_compression=compression,  # pyright: ignore reportGeneralTypeIssues
+                storage_compression_level=level,  # pyright: ignore reportGeneralTypeIssues
+            )
+
+    @pytest.mark.parametrize(
+        ("compression", "level"),
+        [
+            (CompressionAlgorithm.ZLIB, 9),
+            (CompressionAlgorithm.ZLIB, -1),
+            (CompressionAlgorithm.ZSTD, 22),
+            (None, 100),
+        ],
+    )
+    def test_valid_compression_level(self, compression: CompressionAlgorithm | None, level: int):
+        settings = Settings(
+            storage_compression=compression,  # pyright: ignore reportGeneralTypeIssues
+            storage_compression_level=level,  # pyright: ignore reportGeneralTypeIssues
+        )
+
+        assert settings.storage_compression_level == level
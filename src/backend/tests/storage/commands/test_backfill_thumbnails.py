@@ -0,0 +1,61 @@
+import io
+import tempfile
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pytest
+from PIL import Image
+
+from backend.core.executor import CPUExecutor
+from backend.core.metrics import MetricsRegistry
+from backend.storage.commands.backfill_thumbnails import backfill_thumbnails
+from backend.storage.constants import ICON_RENDITION
+from backend.storage.documents.file_meta import FileMetaDocument
+from backend.storage.typing_ import FileName, FilePath
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+    from backend.storage.controllers.file_meta import FileMetaController
+
+
+@pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+@pytest.mark.parametrize("resume", [False, True])
+async def test_backfill_thumbnails(
+    mocker: "MockerFixture",
+    tmp_path: Path,
+    file_meta_controller_factory: Callable[..., "FileMetaController"],
+    generate_image: Callable[[str], io.BytesIO],
+    *,
+    resume: bool,
+):
+    controller = file_meta_controller_factory()
+    executor = CPUExecutor(ThreadPoolExecutor(max_workers=2), MetricsRegistry())
+    checkpoint = tmp_path / "checkpoint"
+
+    with tempfile.TemporaryDirectory() as temp_dir_name:
+        path = FilePath(temp_dir_name)
+        filenames = [FileName("foo.png"), FileName("bar.jpg"), FileName("baz.png")]
+        for filename in filenames:
+            image_format = "JPEG" if filename.endswith(".jpg") else "PNG"
+            await controller.create_file(path=path, filename=filename, data=generate_image(image_format), replace=False)
+
+        documents = await FileMetaDocument.find_all().sort(+FileMetaDocument.id).to_list()  # pyright: ignore reportGeneralTypeIssues
+        if resume:
+            _ = checkpoint.write_text(str(documents[0].id))
+
+        _ = mocker.patch(
+            "backend.storage.controllers.file_meta.get_rendition_sizes",
+            return_value={ICON_RENDITION: (64, 64)},
+        )
+        updated = await backfill_thumbnails(controller, executor, checkpoint=checkpoint, batch_size=2, max_rate=1000)
+        executor.shutdown()
+
+        assert updated == len(documents) - resume
+        assert not checkpoint.exists()
+        for index, document in enumerate(documents):
+            icon = await controller.get_icon(path=path, filename=document.filename)
+            assert icon
+            assert Image.open(icon).size == ((128, 128) if resume and index == 0 else (64, 64))
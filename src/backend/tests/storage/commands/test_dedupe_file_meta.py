@@ -0,0 +1,34 @@
+import pytest
+
+from backend.storage.commands.dedupe_file_meta import PATH_INDEX_NAME, dedupe_file_meta, make_path_index_unique
+from backend.storage.documents.file_meta import FileMetaDocument
+
+
+@pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+async def test_dedupe_file_meta():
+    collection = FileMetaDocument.get_motor_collection()
+    await collection.drop_index(PATH_INDEX_NAME)
+    _ = await collection.insert_many(
+        [
+            {"path": "/foo", "filename": "bar.pdf", "type_": "pdf", "updated_date": "2024-01-01 00:00:00+00:00"},
+            {"path": "/foo", "filename": "bar.pdf", "type_": "pdf", "updated_date": "2024-01-02 00:00:00+00:00"},
+            {"path": "/foo", "filename": "bar.pdf", "type_": "pdf"},
+            {"path": "/foo", "filename": "baz.pdf", "type_": "pdf"},
+            {"path": "/foo", "filename": "qux.pdf", "type_": "pdf", "icon_hash": "1"},
+            {"path": "/foo", "filename": "qux.pdf", "type_": "pdf", "icon_hash": "2"},
+        ],
+    )
+
+    assert await dedupe_file_meta(collection) == 3  # noqa: PLR2004
+    assert await dedupe_file_meta(collection) == 0
+
+    await make_path_index_unique(collection)
+    await make_path_index_unique(collection)
+
+    documents = await collection.find({}, projection={"_id": False}, sort=[("filename", 1)]).to_list(None)
+    assert documents == [
+        {"path": "/foo", "filename": "bar.pdf", "type_": "pdf", "updated_date": "2024-01-02 00:00:00+00:00"},
+        {"path": "/foo", "filename": "baz.pdf", "type_": "pdf"},
+        {"path": "/foo", "filename": "qux.pdf", "type_": "pdf", "icon_hash": "2"},
+    ]
+    assert (await collection.index_information())[PATH_INDEX_NAME]["unique"]
@@ -0,0 +1,47 @@
+import os
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from backend.core.settings import get_settings
+from backend.storage.commands.rotate_master_key import rotate_master_key
+from backend.storage.constants import SupportedFileTypes
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.documents.file_meta import FileMetaDocument
+from backend.storage.keys import get_data_key, get_key_id, new_data_key, wrap_key
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+
+async def test_rotate_master_key(
+    mocker: "MockerFixture",
+    file_meta_document_factory: Callable[..., Awaitable[FileMetaDocument]],
+):
+    settings = get_settings()
+    old_key, new_key = settings.security.aes_key, os.urandom(32)
+    data_key = new_data_key()
+    wrapped_key, key_id = wrap_key(data_key)
+
+    wrapped_document = await file_meta_document_factory(type_=SupportedFileTypes.PDF)
+    wrapped_document.data_key, wrapped_document.key_id = wrapped_key, key_id
+    _ = await wrapped_document.save()
+    legacy_document = await file_meta_document_factory(type_=SupportedFileTypes.PDF)
+    dir_document = await file_meta_document_factory(type_=SupportedFileTypes.DIR)
+
+    security = settings.security.model_copy(update={"aes_key": new_key, "previous_aes_keys": [old_key]})
+    new_settings = settings.model_copy(update={"security": security})
+    _ = mocker.patch("backend.storage.keys.get_settings", return_value=new_settings)
+
+    rotated = await rotate_master_key(MongoFileMetaDAO(), batch_size=1)
+
+    assert rotated == len([wrapped_document, legacy_document])
+    assert await rotate_master_key(MongoFileMetaDAO()) == 0
+
+    for document, expected_key in [(wrapped_document, data_key), (legacy_document, old_key)]:
+        document_in_db = await FileMetaDocument.get(document.id)
+        assert document_in_db
+        assert document_in_db.key_id == get_key_id(new_key)
+        assert get_data_key(document_in_db.data_key, document_in_db.key_id) == expected_key
+
+    dir_in_db = await FileMetaDocument.get(dir_document.id)
+    assert dir_in_db
+    assert dir_in_db.key_id is None
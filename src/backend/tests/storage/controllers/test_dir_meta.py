@@ -1,3 +1,5 @@
+import datetime as dt
+import io
 import re
 import tempfile
 from typing import TYPE_CHECKING, Awaitable, Callable
@@ -5,7 +7,7 @@ from typing import TYPE_CHECKING, Awaitable, Callable
 import pytest
 
 from backend.core.settings.main import Settings
-from backend.storage.constants import SupportedFileTypes
+from backend.storage.constants import ListingSort, SupportedFileTypes
 from backend.storage.documents.file_meta import FileMetaDocument
 from backend.storage.typing_ import FileName, FilePath
 
@@ -13,6 +15,7 @@ if TYPE_CHECKING:
     from pytest_mock import MockerFixture
 
     from backend.storage.controllers.dir_meta import DirMetaController
+    from backend.storage.controllers.file_meta import FileMetaController
 
 
 class TestRenameDir:
@@ -175,6 +178,37 @@ class TestRenameDir:
             assert file_in_db.created_date == old_db_file.created_date
             assert file_in_db.updated_date != old_db_file.updated_date
 
+    async def test_only_subtree_is_moved(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = dir_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            base_path = FilePath(dir_path)
+            (base_path / "foo").mkdir()
+            # Paths repeating the old name deeper, and a sibling sharing its prefix
+            nested_path = base_path / "foo" / "x" / base_path.relative_to("/") / "foo"
+            for path in [base_path / "foo", nested_path, base_path / "foo.bak", base_path / "foobar"]:
+                _ = await file_meta_document_factory(path=path, filename="baz.pdf", type_=SupportedFileTypes.PDF)
+
+            await controller.rename_dir(
+                old_path=base_path,
+                old_filename=FileName("foo"),
+                new_path=base_path,
+                new_filename=FileName("bar"),
+            )
+
+            documents = await FileMetaDocument.find(FileMetaDocument.filename == "baz.pdf").to_list()
+            paths = {document.path for document in documents}
+            assert paths == {
+                base_path / "bar",
+                base_path / "bar" / "x" / base_path.relative_to("/") / "foo",
+                base_path / "foo.bak",
+                base_path / "foobar",
+            }
+
 
 class TestCreateDir:
     async def test_no_os_parent_dir(self, dir_meta_controller_factory: Callable[..., "DirMetaController"]):
@@ -214,6 +248,7 @@ class TestCreateDir:
         assert dir_in_db.type_ == SupportedFileTypes.DIR
         assert dir_in_db.icon is None
         assert dir_in_db.created_date is not None
+        assert dir_in_db.created_date.tzinfo is not None
 
     @pytest.mark.usefixtures("_init_beanie")
     async def test_success_already_exist_parent_dir_in_os(
@@ -242,6 +277,122 @@ class TestCreateDir:
         assert dir_in_db.type_ == SupportedFileTypes.DIR
         assert dir_in_db.icon is None
         assert dir_in_db.created_date is not None
+        assert dir_in_db.created_date.tzinfo is not None
+
+
+class TestGetDirStats:
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_aggregates(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        controller = dir_meta_controller_factory()
+        file_controller = file_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            root = FilePath(dir_path)
+            foo, bar, baz = root / "foo", root / "foo" / "bar", root / "baz"
+            for directory in (foo, bar, baz):
+                _ = await controller.create_dir(path=directory.parent, filename=directory.name)
+            for path, filename, data in [(bar, "a.pdf", b"12345"), (foo, "b.pdf", b"123"), (foo, "b.pdf", b"1")]:
+                await file_controller.create_file(path=path, filename=filename, data=io.BytesIO(data), replace=True)
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            assert (foo_stats.size, foo_stats.files_count) == (6, 2)
+            assert foo_stats.last_modified
+
+            await file_controller.rename_file(old_path=bar, old_filename="a.pdf", new_path=baz, new_filename="a.pdf")
+            await file_controller.delete_file(path=foo, filename="b.pdf")
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            baz_stats = await controller.get_dir_stats(path=root, filename="baz")
+            assert (foo_stats.size, foo_stats.files_count) == (0, 0)
+            assert (baz_stats.size, baz_stats.files_count) == (5, 1)
+
+            await controller.rename_dir(old_path=root, old_filename="baz", new_path=foo, new_filename="baz")
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            baz_stats = await controller.get_dir_stats(path=foo, filename="baz")
+            assert (foo_stats.size, foo_stats.files_count) == (5, 1)
+            assert (baz_stats.size, baz_stats.files_count) == (5, 1)
+
+            await controller.delete_dir(path=foo, filename="baz")
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            assert (foo_stats.size, foo_stats.files_count) == (0, 0)
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_files_without_size_not_counted(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        controller = dir_meta_controller_factory()
+        file_controller = file_meta_controller_factory()
+        collection = FileMetaDocument.get_motor_collection()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            root = FilePath(dir_path)
+            foo, bar = root / "foo", root / "foo" / "bar"
+            for directory in (foo, bar):
+                _ = await controller.create_dir(path=directory.parent, filename=directory.name)
+            for path, filename in [(bar, "old.pdf"), (foo, "old.pdf")]:
+                await file_controller.create_file(path=path, filename=filename, data=io.BytesIO(b"123"), replace=False)
+            # Saved before sizes were stored, directories were created with zero aggregates
+            dir_type = SupportedFileTypes.DIR.value
+            _ = await collection.update_many({"type_": {"$ne": dir_type}}, {"$unset": {"size": ""}})
+            _ = await collection.update_many({"type_": dir_type}, {"$set": {"size": 0, "files_count": 0}})
+            await file_controller.create_file(path=bar, filename="new.pdf", data=io.BytesIO(b"12"), replace=False)
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            assert (foo_stats.size, foo_stats.files_count) == (2, 1)
+
+            await controller.rename_dir(old_path=foo, old_filename="bar", new_path=root, new_filename="baz")
+            await file_controller.delete_file(path=foo, filename="old.pdf")
+
+            foo_stats = await controller.get_dir_stats(path=root, filename="foo")
+            baz_stats = await controller.get_dir_stats(path=root, filename="baz")
+            assert (foo_stats.size, foo_stats.files_count) == (0, 0)
+            assert (baz_stats.size, baz_stats.files_count) == (2, 1)
+
+            baz = root / "baz"
+            await file_controller.create_file(path=baz, filename="old.pdf", data=io.BytesIO(b"1234"), replace=True)
+
+            baz_stats = await controller.get_dir_stats(path=root, filename="baz")
+            assert (baz_stats.size, baz_stats.files_count) == (6, 2)
+
+    async def test_not_exists(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        mocker: "MockerFixture",
+    ):
+        controller = dir_meta_controller_factory()
+        _ = mocker.patch.object(controller.db_dao, "get_dir_stats", return_value=None)
+
+        with pytest.raises(FileNotFoundError, match="/foo/bar is not exists"):
+            _ = await controller.get_dir_stats(path=FilePath("/foo"), filename="bar")
+
+
+class TestCreateDirs:
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_per_dir_errors(self, dir_meta_controller_factory: Callable[..., "DirMetaController"]):
+        controller = dir_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            path = FilePath(dir_path)
+            (path / "bar").mkdir()
+
+            errors = await controller.create_dirs([(path, FileName("foo")), (path / "baz", "foo"), (path, "bar")])
+
+            assert errors[0] is None
+            assert isinstance(errors[1], FileNotFoundError)
+            assert errors[2] is None
+            assert (path / "foo").is_dir()
+
+            documents = await FileMetaDocument.find(FileMetaDocument.path == path).to_list()
+            assert {document.filename for document in documents} == {"foo", "bar"}
+            assert all(document.type_ == SupportedFileTypes.DIR for document in documents)
 
 
 class TestDeleteDir:
@@ -345,6 +496,22 @@ class TestDeleteDir:
         assert file_in_db == []
 
 
+    async def test_siblings_are_kept(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = dir_meta_controller_factory()
+        dir_path = FilePath("/foo/bar")
+
+        for path in [dir_path, dir_path / "baz", FilePath("/foo/bar.baz"), FilePath("/foo/barbaz")]:
+            _ = await file_meta_document_factory(path=path, filename="foo.pdf", type_=SupportedFileTypes.PDF)
+
+        await controller.delete_dir(path=dir_path.parent, filename=dir_path.name)
+
+        paths = {document.path for document in await FileMetaDocument.find_all().to_list()}
+        assert paths == {FilePath("/foo/bar.baz"), FilePath("/foo/barbaz")}
+
 class TestLs:
     @pytest.mark.usefixtures("_init_beanie")
     async def test_no_dir(self, dir_meta_controller_factory: Callable[..., "DirMetaController"]):
@@ -518,6 +685,135 @@ class TestLs:
             assert len(nested_file_in_db) == 1
 
 
+class TestLsPage:
+    @pytest.mark.parametrize("sort", list(ListingSort))
+    async def test_pages(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+        sort: ListingSort,
+    ):
+        controller = dir_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            filenames = ["c.pdf", "a", "b.png", "d.jpg", "a.pdf", "b"]
+            for index, filename in enumerate(filenames):
+                type_ = SupportedFileTypes.PDF if "." in filename else SupportedFileTypes.DIR
+                (dir_path / filename).touch()
+                document = await file_meta_document_factory(path=dir_path, filename=filename, type_=type_)
+                document.created_date = dt.datetime(2024, 1, 1, second=index, tzinfo=dt.timezone.utc)
+                _ = await document.save()
+            _ = await file_meta_document_factory(path=dir_path / "a", filename="e.pdf", type_=SupportedFileTypes.PDF)
+            (dir_path / "d.jpg").unlink()
+
+            pages: list[list[FilePath]] = []
+            cursor = None
+            while True:
+                page, cursor = await controller.ls_page(path=dir_path, page_size=2, sort=sort, cursor=cursor)
+                pages.append(page)
+                if cursor is None:
+                    break
+
+            expected = {
+                ListingSort.NAME: ["a.pdf", "b.png", "c.pdf", "a", "b"],
+                ListingSort.CREATED_DATE: ["c.pdf", "b.png", "a.pdf", "a", "b"],
+            }[sort]
+            assert [item.name for page in pages for item in page] == expected
+            assert [len(page) for page in pages] == [2, 1, 2]
+
+            items = [item async for item in controller.ls(path=dir_path, sort=sort)]
+            assert items == [dir_path / filename for filename in expected]
+
+    async def test_stale_meta_deleted_in_one_query(
+        self,
+        mocker: "MockerFixture",
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = dir_meta_controller_factory()
+        get_names = mocker.spy(controller.os_dao, "get_names")
+        delete_many = mocker.spy(controller.db_dao, "delete_many")
+
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            (dir_path / "a.pdf").touch()
+            for filename in ["a.pdf", "b.pdf", "c.pdf"]:
+                _ = await file_meta_document_factory(path=dir_path, filename=filename, type_=SupportedFileTypes.PDF)
+
+            items, cursor = await controller.ls_page(path=dir_path, page_size=10)
+
+            assert items == [dir_path / "a.pdf"]
+            assert cursor is None
+            get_names.assert_called_once_with(dir_path)
+            delete_many.assert_called_once_with(path=dir_path, filenames=["b.pdf", "c.pdf"])
+            assert await FileMetaDocument.find(FileMetaDocument.path == dir_path).count() == 1
+
+    async def test_file_created_after_scan_kept(
+        self,
+        mocker: "MockerFixture",
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = dir_meta_controller_factory()
+        # The blob is moved in place right after the scan
+        _ = mocker.patch.object(controller.os_dao, "get_names", return_value=set())
+
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            (dir_path / "a.pdf").touch()
+            for filename in ["a.pdf", "b.pdf"]:
+                _ = await file_meta_document_factory(path=dir_path, filename=filename, type_=SupportedFileTypes.PDF)
+
+            items, _ = await controller.ls_page(path=dir_path, page_size=10)
+
+            assert items == [dir_path / "a.pdf"]
+            documents = await FileMetaDocument.find(FileMetaDocument.path == dir_path).to_list()
+            assert [document.filename for document in documents] == ["a.pdf"]
+
+    async def test_file_created_between_pages_kept(
+        self,
+        mocker: "MockerFixture",
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = dir_meta_controller_factory()
+        _ = mocker.patch("backend.storage.controllers.dir_meta.LS_PAGE_SIZE", 1)
+
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            for filename in ["a.pdf", "c.pdf"]:
+                (dir_path / filename).touch()
+                _ = await file_meta_document_factory(path=dir_path, filename=filename, type_=SupportedFileTypes.PDF)
+
+            items: list[FilePath] = []
+            async for item in controller.ls(path=dir_path):
+                items.append(item)
+                if item.name == "a.pdf":
+                    (dir_path / "b.pdf").touch()
+                    _ = await file_meta_document_factory(path=dir_path, filename="b.pdf", type_=SupportedFileTypes.PDF)
+
+            assert items == [dir_path / filename for filename in ["a.pdf", "b.pdf", "c.pdf"]]
+            assert await FileMetaDocument.find(FileMetaDocument.path == dir_path).count() == 3  # noqa: PLR2004
+
+    async def test_invalid_cursor(self, dir_meta_controller_factory: Callable[..., "DirMetaController"]):
+        controller = dir_meta_controller_factory()
+
+        with pytest.raises(ValueError, match="Invalid listing cursor"):
+            _ = await controller.ls_page(path=FilePath("/foo"), page_size=10, cursor="foo")
+
+    @pytest.mark.parametrize("page_size", [0, -1])
+    async def test_invalid_page_size(
+        self,
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        page_size: int,
+    ):
+        controller = dir_meta_controller_factory()
+
+        with pytest.raises(ValueError, match="Page size must be positive"):
+            _ = await controller.ls_page(path=FilePath("/foo"), page_size=page_size)
+
+
 class TestCheckIntegrity:
     async def test_success_in_db_not_in_os(
         self,
@@ -614,3 +910,61 @@ class TestCheckIntegrity:
             controller = dir_meta_controller_factory()
 
             await controller.check_integrity()
+
+    async def test_repair(
+        self,
+        mocker: "MockerFixture",
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            _ = mocker.patch(
+                "backend.storage.dao.os_file_meta.get_settings",
+                return_value=Settings(storage_path=dir_path),  # pyright: ignore reportGeneralTypeIssues
+            )
+            # "a-b" sorts before "a/..." in mongo, the walk must follow that order
+            for path in [dir_path / "a", dir_path / "a-b", dir_path / "a" / "c"]:
+                path.mkdir()
+                _ = await file_meta_document_factory(path=path.parent, filename=path.name, type_=SupportedFileTypes.DIR)
+            (dir_path / "a" / "new").mkdir()
+            (dir_path / "a-b" / "orphan.pdf").touch()
+            _ = await file_meta_document_factory(path=dir_path / "a", filename="lost.pdf", type_=SupportedFileTypes.PDF)
+            progress = mocker.Mock()
+
+            controller = dir_meta_controller_factory()
+            report = await controller.check_integrity(repair=True, batch_size=2, on_progress=progress)
+
+            assert (report.checked, report.not_in_db, report.not_in_os, report.repaired) == (6, 2, 1, 2)
+            assert progress.call_count == len([2, 4, 6, "final"])
+            assert await FileMetaDocument.find(FileMetaDocument.filename == "lost.pdf").count() == 0
+            assert await FileMetaDocument.find(FileMetaDocument.filename == "new").count() == 1
+
+            with pytest.raises(FileNotFoundError, match=f"NOT IN DB: {dir_path / 'a-b' / 'orphan.pdf'}"):
+                _ = await controller.check_integrity()
+
+
+    async def test_repair_keeps_changed_after_walk(
+        self,
+        mocker: "MockerFixture",
+        dir_meta_controller_factory: Callable[..., "DirMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        with tempfile.TemporaryDirectory() as raw_dir_path:
+            dir_path = FilePath(raw_dir_path)
+            _ = mocker.patch(
+                "backend.storage.dao.os_file_meta.get_settings",
+                return_value=Settings(storage_path=dir_path),  # pyright: ignore reportGeneralTypeIssues
+            )
+            (dir_path / "uploaded.pdf").touch()
+            _ = await file_meta_document_factory(path=dir_path, filename="uploaded.pdf", type_=SupportedFileTypes.PDF)
+            controller = dir_meta_controller_factory()
+            # The walk saw the tree before the upload and before the directory was deleted
+            walk = iter([(dir_path, [("deleted", True)])])
+            _ = mocker.patch.object(controller.os_dao, "walk_sorted", return_value=walk)
+
+            report = await controller.check_integrity(repair=True)
+
+            assert (report.not_in_db, report.not_in_os, report.repaired) == (1, 1, 0)
+            assert await FileMetaDocument.find(FileMetaDocument.filename == "uploaded.pdf").count() == 1
+            assert await FileMetaDocument.find(FileMetaDocument.filename == "deleted").count() == 0
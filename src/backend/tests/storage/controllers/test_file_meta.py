@@ -3,17 +3,26 @@ import tempfile
 from typing import TYPE_CHECKING, Awaitable, Callable, cast
 
 import pytest
-from PIL import UnidentifiedImageError
+from PIL import Image, UnidentifiedImageError
 
-from backend.storage.constants import SupportedFileTypes
+from backend.core.settings import Settings
+from backend.storage.constants import PDF_THUMBNAIL, CompressionAlgorithm, SupportedFileTypes, ThumbnailFormat
+from backend.storage.dao.mongo_file_meta import MongoFileMetaDAO
+from backend.storage.dao_schemas.file_meta import FileMetaDAOSchema
 from backend.storage.documents.file_meta import FileMetaDocument
+from backend.storage.documents.thumbnail import ThumbnailDocument
 from backend.storage.encryption import encrypt
+from backend.storage.icon import get_thumbnail_hash
+from backend.storage.keys import get_current_key_id
+from backend.storage.path_helper import get_file_type
 from backend.storage.typing_ import FileName, FilePath
 
 if TYPE_CHECKING:
     from bson.binary import Binary
+    from pytest_mock import MockerFixture
 
     from backend.storage.controllers.file_meta import FileMetaController
+    from backend.storage.dao.mongo_file_meta import FileMetaCache
 
 
 class TestCreateFile:
@@ -127,8 +136,13 @@ class TestCreateFile:
 
             assert object_in_db
             assert object_in_db.type_ == SupportedFileTypes(suffix.lstrip("."))
-            assert object_in_db.icon is not None
+            assert object_in_db.icon_hash is not None
             assert object_in_db.created_date is not None
+            assert object_in_db.data_key is not None
+            assert object_in_db.key_id == get_current_key_id()
+
+            decoded_file = await controller.get_file(path=path, filename=filename)
+            assert decoded_file.read() == data.getvalue()
 
     @pytest.mark.parametrize("is_exists_in_db", [True, False])
     @pytest.mark.parametrize("is_exists_in_os", [True, False])
@@ -188,8 +202,101 @@ class TestCreateFile:
 
             assert object_in_db
             assert object_in_db.type_ == SupportedFileTypes(suffix.lstrip("."))
-            assert object_in_db.icon is not None
+            assert object_in_db.icon_hash is not None
             assert object_in_db.created_date is not None
+            assert object_in_db.created_date.tzinfo is not None
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_failed_replace_keeps_previous_file(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        controller = file_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            filename = FileName("foo.pdf")
+            await controller.create_file(path=path, filename=filename, data=io.BytesIO(b"old"), replace=False)
+            _ = mocker.patch.object(controller.os_dao, "commit", side_effect=OSError("No space left on device"))
+
+            with pytest.raises(OSError, match="No space left on device"):
+                await controller.create_file(path=path, filename=filename, data=io.BytesIO(b"new"), replace=True)
+
+            assert (await controller.get_file(path=path, filename=filename)).read() == b"old"
+            assert [item.name for item in path.iterdir()] == [filename]
+
+
+class TestCreateFiles:
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    @pytest.mark.parametrize("replace", [False, True])
+    async def test_per_file_errors(
+        self,
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        generate_image: Callable[[str], io.BytesIO],
+        *,
+        replace: bool,
+    ):
+        controller = file_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            old_filename = FileName("old.pdf")
+            await controller.create_file(path=path, filename=old_filename, data=io.BytesIO(b"old"), replace=False)
+            files = [
+                (path, FileName("foo.png"), generate_image("PNG")),
+                (path, FileName("foo.txt"), io.BytesIO(b"bar")),
+                (path, old_filename, io.BytesIO(b"new")),
+                (path / "missing", FileName("bar.pdf"), io.BytesIO(b"bar")),
+                (path, FileName("bar.pdf"), io.BytesIO(b"bar")),
+            ]
+
+            errors = await controller.create_files(files, replace=replace)
+
+            assert errors[0] is None
+            assert isinstance(errors[1], ValueError)
+            assert errors[2] is None if replace else isinstance(errors[2], FileExistsError)
+            assert isinstance(errors[3], FileNotFoundError)
+            assert errors[4] is None
+
+            assert await FileMetaDocument.find(FileMetaDocument.path == path / "missing").count() == 0
+            for file_path, filename, data in [files[0], files[4]]:
+                assert (await controller.get_file(path=file_path, filename=filename)).read() == data.getvalue()
+                assert await controller.get_icon(path=file_path, filename=filename)
+
+            old_data = await controller.get_file(path=path, filename=old_filename)
+            assert old_data.read() == (b"new" if replace else b"old")
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_failed_replace_keeps_previous_file(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        controller = file_meta_controller_factory()
+        commit = controller.os_dao.commit
+
+        def fail_foo(temp_path: FilePath, *, path: FilePath, filename: FileName) -> None:
+            if filename == "foo.pdf":
+                raise OSError("No space left on device")
+            commit(temp_path, path=path, filename=filename)
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            for filename in ["foo.pdf", "bar.pdf"]:
+                await controller.create_file(path=path, filename=filename, data=io.BytesIO(b"old"), replace=False)
+            _ = mocker.patch.object(controller.os_dao, "commit", side_effect=fail_foo)
+
+            errors = await controller.create_files(
+                [(path, FileName("foo.pdf"), io.BytesIO(b"new")), (path, FileName("bar.pdf"), io.BytesIO(b"new"))],
+                replace=True,
+            )
+
+            assert isinstance(errors[0], OSError)
+            assert errors[1] is None
+            assert (await controller.get_file(path=path, filename=FileName("foo.pdf"))).read() == b"old"
+            assert (await controller.get_file(path=path, filename=FileName("bar.pdf"))).read() == b"new"
+            assert sorted(item.name for item in path.iterdir()) == ["bar.pdf", "foo.pdf"]
 
 
 class TestDeleteFile:
@@ -380,6 +487,40 @@ class TestRenameFile:
         assert new_object_in_db.created_date == file_meta_document.created_date
         assert new_object_in_db.created_date != file_meta_document.updated_date
 
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    @pytest.mark.parametrize("target", ["file", "os only", "db only, created after the check"])
+    async def test_target_exists(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        target: str,
+    ):
+        controller = file_meta_controller_factory()
+        old_filename, new_filename = FileName("foo.pdf"), FileName("bar.pdf")
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            await controller.create_file(path=path, filename=old_filename, data=io.BytesIO(b"foo"), replace=False)
+            if target == "os only":
+                _ = (path / new_filename).write_bytes(b"bar")
+            else:
+                await controller.create_file(path=path, filename=new_filename, data=io.BytesIO(b"bar"), replace=False)
+            if target == "db only, created after the check":
+                (path / new_filename).unlink()
+                _ = mocker.patch.object(controller.db_dao, "is_exists", return_value=False)
+
+            with pytest.raises(FileExistsError, match=f"{path / new_filename} (exists in DB|found in OS)"):
+                await controller.rename_file(
+                    old_path=path,
+                    old_filename=old_filename,
+                    new_path=path,
+                    new_filename=new_filename,
+                )
+
+            assert (await controller.get_file(path=path, filename=old_filename)).read() == b"foo"
+            if target == "file":
+                assert (await controller.get_file(path=path, filename=new_filename)).read() == b"bar"
+
 
 class TestGetFile:
     @pytest.mark.parametrize(
@@ -488,3 +629,282 @@ class TestGetFile:
             )
 
             assert decoded_file.read() == original_data.read()
+
+    async def test_cached_meta_is_invalidated(
+        self,
+        file_meta_cache: "FileMetaCache",
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        db_dao = MongoFileMetaDAO(cache=file_meta_cache)
+        path, filename, new_filename = FilePath("/foo"), FileName("test.pdf"), FileName("renamed.pdf")
+        _ = await file_meta_document_factory(filename=filename, path=path, type_=SupportedFileTypes.PDF)
+        assert await db_dao.get(path=path, filename=filename)
+        assert not await db_dao.is_exists(path=path, filename=new_filename)
+
+        await db_dao.update(path=path, filename=filename, data_to_update={"filename": new_filename})
+
+        assert await db_dao.get(path=path, filename=filename) is None
+        assert await db_dao.is_exists(path=path, filename=new_filename)
+
+        await db_dao.delete_subtree(path)
+
+        assert not await db_dao.is_exists(path=path, filename=new_filename)
+
+    async def test_missing_meta_not_cached(
+        self,
+        file_meta_cache: "FileMetaCache",
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        db_dao = MongoFileMetaDAO(cache=file_meta_cache)
+        path, filename = FilePath("/foo"), FileName("test.pdf")
+        assert await db_dao.get(path=path, filename=filename) is None
+        assert not await db_dao.is_exists(path=path, filename=filename)
+
+        # Written by another process, this one isn't notified
+        _ = await file_meta_document_factory(filename=filename, path=path, type_=SupportedFileTypes.PDF)
+
+        assert await db_dao.get(path=path, filename=filename)
+        assert await db_dao.is_exists(path=path, filename=filename)
+
+    async def test_meta_read_again_before_delete(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        controller = file_meta_controller_factory()
+        path, filename = FilePath("/foo"), FileName("test.pdf")
+        db_file = FileMetaDAOSchema(path=path, filename=filename, type_=SupportedFileTypes.PDF, nonce=b"foo")
+        # The first read misses a file another process has just uploaded
+        get = mocker.patch.object(controller.db_dao, "get", side_effect=[None, db_file])
+        _ = mocker.patch.object(controller.os_dao, "is_exists", return_value=True)
+        delete_file = mocker.patch.object(controller, "delete_file")
+        _ = mocker.patch("backend.storage.controllers.file_meta._decrypt_from_os", return_value=io.BytesIO(b"bar"))
+
+        assert (await controller.get_file(path=path, filename=filename)).read() == b"bar"
+
+        get.assert_called_with(filename=filename, path=path, use_cache=False)
+        delete_file.assert_not_called()
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_success_compressed(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+    ):
+        _ = mocker.patch(
+            "backend.storage.compression.get_settings",
+            return_value=Settings(storage_compression=CompressionAlgorithm.ZLIB),  # pyright: ignore reportGeneralTypeIssues
+        )
+        controller = file_meta_controller_factory()
+        filename = FileName("test.pdf")
+        original_data = b"bar" * 1024
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+
+            await controller.create_file(path=path, filename=filename, data=io.BytesIO(original_data), replace=False)
+
+            object_in_db = await FileMetaDocument.find_one(
+                FileMetaDocument.path == path,
+                FileMetaDocument.filename == filename,
+            )
+            assert object_in_db
+            assert object_in_db.compression == CompressionAlgorithm.ZLIB
+            assert (path / filename).stat().st_size < len(original_data)
+
+            decoded_file = await controller.get_file(path=path, filename=filename)
+            assert decoded_file.read() == original_data
+
+            chunks = [chunk async for chunk in controller.stream_file(path=path, filename=filename)]
+            assert b"".join(chunks) == original_data
+
+
+class TestStreamFile:
+    async def test_success(
+        self,
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = file_meta_controller_factory()
+        filename = FileName("test.pdf")
+        original_data = io.BytesIO(b"bar")
+        encoded_data, nonce = encrypt(original_data)
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+
+            filepath = path / filename
+            with filepath.open("wb") as f:
+                _ = f.write(encoded_data.read())
+
+            _ = await file_meta_document_factory(
+                filename=filename,
+                path=path,
+                type_=SupportedFileTypes.PDF,
+                nonce=nonce,
+            )
+
+            chunks = [
+                chunk
+                async for chunk in controller.stream_file(
+                    path=path,
+                    filename=filename,
+                )
+            ]
+
+            assert b"".join(chunks) == original_data.read()
+
+
+class TestLazyThumbnails:
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_get_icon(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        generate_image: Callable[[str], io.BytesIO],
+    ):
+        _ = mocker.patch(
+            "backend.storage.controllers.file_meta.get_settings",
+            return_value=Settings(storage_lazy_thumbnails=True),  # pyright: ignore reportGeneralTypeIssues
+        )
+        controller = file_meta_controller_factory()
+        filename = FileName("test.png")
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+
+            await controller.create_file(path=path, filename=filename, data=generate_image("PNG"), replace=False)
+
+            object_in_db = await FileMetaDocument.find_one(
+                FileMetaDocument.path == path,
+                FileMetaDocument.filename == filename,
+            )
+            assert object_in_db
+            assert object_in_db.icon_hash is None
+            assert object_in_db.icon_pending
+
+            icon = await controller.get_icon(path=path, filename=filename)
+            assert icon
+
+            await object_in_db.sync()
+            assert object_in_db.icon_hash == get_thumbnail_hash(icon.getvalue())
+            assert not object_in_db.icon_pending
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_build_pending_icons(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        generate_image: Callable[[str], io.BytesIO],
+    ):
+        _ = mocker.patch(
+            "backend.storage.controllers.file_meta.get_settings",
+            return_value=Settings(storage_lazy_thumbnails=True),  # pyright: ignore reportGeneralTypeIssues
+        )
+        controller = file_meta_controller_factory()
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            filenames = [FileName("foo.png"), FileName("bar.jpg"), FileName("broken.png")]
+            missing = FileName("missing.png")
+
+            # Pending first, its blob is gone
+            await controller.create_file(path=path, filename=missing, data=generate_image("PNG"), replace=False)
+            (path / missing).unlink()
+            await controller.create_file(path=path, filename=filenames[0], data=generate_image("PNG"), replace=False)
+            await controller.create_file(path=path, filename=filenames[1], data=generate_image("JPEG"), replace=False)
+            await controller.create_file(path=path, filename=filenames[2], data=io.BytesIO(b"foo"), replace=False)
+            await controller.create_file(path=path, filename=FileName("b.pdf"), data=io.BytesIO(b"baz"), replace=False)
+
+            last_id = await controller.build_pending_icons(limit=10)
+            assert last_id
+            assert await controller.build_pending_icons(limit=10, after=last_id) is None
+
+            pending = await controller.db_dao.get_pending_icons(after=None, limit=10)
+            assert [db_file.filename for db_file in pending] == [missing]
+
+            icons = [await controller.get_icon(path=path, filename=filename) for filename in filenames]
+            assert icons[0]
+            assert icons[1]
+            assert icons[2] is None
+
+
+class TestRebuildThumbnails:
+    @pytest.mark.parametrize(
+        ("decrypted", "updated"),
+        [
+            # Unreadable blob may be a transient error, the icon is kept
+            (OSError("Input/output error"), ["foo.pdf"]),
+            # Broken image is stored without icon
+            (io.BytesIO(b"foo"), ["foo.png", "foo.pdf"]),
+        ],
+    )
+    async def test_broken_file(
+        self,
+        mocker: "MockerFixture",
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        decrypted: Exception | io.BytesIO,
+        updated: list[str],
+    ):
+        db_dao = mocker.AsyncMock()
+        db_dao.update_renditions.side_effect = len
+        controller = file_meta_controller_factory(db_dao=db_dao, thumbnail_dao=mocker.AsyncMock())
+        _ = mocker.patch("backend.storage.controllers.file_meta._decrypt_from_os", side_effect=[decrypted])
+        db_files = [
+            FileMetaDAOSchema(path=FilePath("/foo"), filename=filename, type_=get_file_type(filename), nonce=b"1")
+            for filename in [FileName("foo.png"), FileName("foo.pdf")]
+        ]
+
+        assert await controller.rebuild_thumbnails(db_files) == len(updated)
+
+        (renditions,) = db_dao.update_renditions.call_args.args
+        assert [db_file.filename for db_file, _, _ in renditions] == updated
+
+
+class TestGetIcon:
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_deduplicated(
+        self,
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        generate_image: Callable[[str], io.BytesIO],
+    ):
+        controller = file_meta_controller_factory()
+        filenames = [FileName("foo.png"), FileName("bar.png"), FileName("foo.pdf"), FileName("bar.pdf")]
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+
+            for filename in filenames:
+                data = io.BytesIO(b"baz") if filename.endswith(".pdf") else generate_image("PNG")
+                await controller.create_file(path=path, filename=filename, data=data, replace=False)
+
+            icons = [await controller.get_icon(path=path, filename=filename) for filename in filenames]
+
+            assert await ThumbnailDocument.count() == len({icon.getvalue() for icon in icons if icon})
+            assert icons[0]
+            assert icons[2]
+            assert icons[0].getvalue() == cast(io.BytesIO, icons[1]).getvalue()
+            assert icons[2].getvalue() == cast(io.BytesIO, icons[3]).getvalue() == PDF_THUMBNAIL.read_bytes()
+
+            webp_icon = await controller.get_icon(path=path, filename=filenames[0], image_format=ThumbnailFormat.WEBP)
+            assert webp_icon
+            assert Image.open(webp_icon).format == "WEBP"
+
+    async def test_legacy_icon(
+        self,
+        file_meta_controller_factory: Callable[..., "FileMetaController"],
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        controller = file_meta_controller_factory()
+        filename = FileName("test.pdf")
+
+        with tempfile.TemporaryDirectory() as temp_dir_name:
+            path = FilePath(temp_dir_name)
+            (path / filename).touch()
+            document = await file_meta_document_factory(filename=filename, path=path, type_=SupportedFileTypes.PDF)
+
+            icon = await controller.get_icon(path=path, filename=filename)
+
+            assert icon
+            assert icon.getvalue() == document.icon
+            assert await controller.get_icon(path=path, filename=filename, rendition="preview") is None
@@ -0,0 +1,50 @@
+import stat
+import tempfile
+from collections.abc import Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from backend.storage.dao.os_file_meta import TEMP_FILE_PREFIX, OSFileMetaDAO
+from backend.storage.typing_ import FileName, FilePath
+
+
+@pytest.fixture()
+def root(mocker: MockerFixture) -> Iterator[FilePath]:
+    with tempfile.TemporaryDirectory() as raw_path:
+        path = FilePath(raw_path)
+        _ = mocker.patch.object(OSFileMetaDAO, "get_root", return_value=path)
+        yield path
+
+
+class TestCreate:
+    def test_replaced_file_keeps_mode(self, root: FilePath):
+        os_dao = OSFileMetaDAO()
+        (root / "foo.pdf").write_bytes(b"old")
+        (root / "foo.pdf").chmod(0o640)
+
+        os_dao.create(path=root, filename=FileName("foo.pdf"), data=[b"new"], replace=True)
+
+        assert (root / "foo.pdf").read_bytes() == b"new"
+        assert stat.S_IMODE((root / "foo.pdf").stat().st_mode) == 0o640  # noqa: PLR2004
+        assert [item.name for item in root.iterdir()] == ["foo.pdf"]
+
+    def test_failed_write_leaves_nothing(self, root: FilePath):
+        def data() -> Iterator[bytes]:
+            yield b"foo"
+            raise OSError("No space left on device")
+
+        with pytest.raises(OSError, match="No space left on device"):
+            OSFileMetaDAO().create(path=root, filename=FileName("foo.pdf"), data=data(), replace=True)
+
+        assert list(root.iterdir()) == []
+
+
+class TestTempFiles:
+    def test_skipped(self, root: FilePath):
+        os_dao = OSFileMetaDAO()
+        (root / "foo.pdf").touch()
+        (root / f"{TEMP_FILE_PREFIX}123").touch()
+
+        assert os_dao.get_names(root) == {"foo.pdf"}
+        assert list(os_dao.walk_sorted()) == [(root, [("foo.pdf", False)])]
@@ -0,0 +1,91 @@
+import io
+import os
+import zlib
+from typing import TYPE_CHECKING
+
+import pytest
+
+from backend.core.settings import Settings
+from backend.storage.compression import CHUNK_SIZE, IterStream, compress_stream, decompress_stream, get_compression
+from backend.storage.constants import CompressionAlgorithm, SupportedFileTypes
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+DATA = b"scanned text " * CHUNK_SIZE
+
+
+@pytest.fixture(params=list(CompressionAlgorithm))
+def algorithm(request: pytest.FixtureRequest) -> CompressionAlgorithm:
+    if request.param == CompressionAlgorithm.ZSTD:
+        _ = pytest.importorskip("zstandard")
+    return request.param
+
+
+class TestGetCompression:
+    @pytest.mark.parametrize(
+        ("file_type", "expected"),
+        [
+            (SupportedFileTypes.PDF, (CompressionAlgorithm.ZLIB, 9)),
+            (SupportedFileTypes.JPEG, (None, None)),
+            (SupportedFileTypes.PNG, (None, None)),
+        ],
+    )
+    def test_policy(
+        self,
+        mocker: "MockerFixture",
+        file_type: SupportedFileTypes,
+        expected: tuple[CompressionAlgorithm | None, int | None],
+    ):
+        _ = mocker.patch(
+            "backend.storage.compression.get_settings",
+            return_value=Settings(
+                storage_compression=CompressionAlgorithm.ZLIB,
+                storage_compression_level=9,
+            ),  # pyright: ignore reportGeneralTypeIssues
+        )
+
+        assert get_compression(file_type) == expected
+
+    def test_disabled(self, mocker: "MockerFixture"):
+        _ = mocker.patch(
+            "backend.storage.compression.get_settings",
+            return_value=Settings(storage_compression=None),  # pyright: ignore reportGeneralTypeIssues
+        )
+
+        assert get_compression(SupportedFileTypes.PDF) == (None, None)
+
+
+class TestCompressStream:
+    @pytest.mark.parametrize("data", [b"", b"foo", DATA, os.urandom(CHUNK_SIZE * 2)])
+    def test_round_trip(self, algorithm: CompressionAlgorithm, data: bytes):
+        compressed_data = b"".join(compress_stream(io.BytesIO(data), algorithm))
+
+        assert b"".join(decompress_stream([compressed_data], algorithm)) == data
+
+    def test_compress(self, algorithm: CompressionAlgorithm):
+        compressed_data = b"".join(compress_stream(io.BytesIO(DATA), algorithm, level=1))
+
+        assert len(compressed_data) < len(DATA)
+
+    def test_decompress_bounded_chunks(self, algorithm: CompressionAlgorithm):
+        compressed_data = b"".join(compress_stream(io.BytesIO(DATA), algorithm))
+
+        chunks = list(decompress_stream([compressed_data], algorithm))
+
+        assert max(len(chunk) for chunk in chunks) <= CHUNK_SIZE
+
+    def test_zlib_truncated(self):
+        compressed_data = zlib.compress(DATA)
+
+        with pytest.raises(ValueError, match="Compressed stream is truncated"):
+            _ = list(decompress_stream([compressed_data[:-10]], CompressionAlgorithm.ZLIB))
+
+
+class TestIterStream:
+    def test_read(self):
+        stream = io.BufferedReader(IterStream([b"foo", b"", b"bar", b"baz"]))
+
+        assert stream.read(4) == b"foob"
+        assert stream.read() == b"arbaz"
+        assert stream.read(1) == b""
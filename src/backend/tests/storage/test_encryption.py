@@ -0,0 +1,166 @@
+import io
+import os
+from pathlib import Path
+
+import pytest
+from Cryptodome.Cipher import AES
+
+from backend.core.settings import get_settings
+from backend.storage.constants import CipherAlgorithm
+from backend.storage.encryption import (
+    MAGIC,
+    TAG_SIZE,
+    decrypt,
+    decrypt_stream,
+    encrypt,
+    encrypt_stream,
+    new_nonce,
+)
+
+SEGMENT_SIZE = 32
+
+
+class TestEncrypt:
+    @pytest.mark.parametrize("data", [b"", b"foo", os.urandom(SEGMENT_SIZE), os.urandom(SEGMENT_SIZE * 3 + 5)])
+    def test_stream_round_trip(self, data: bytes):
+        nonce = new_nonce()
+
+        encrypted_data = b"".join(encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE))
+
+        assert encrypted_data.startswith(MAGIC)
+        assert b"".join(decrypt_stream(io.BytesIO(encrypted_data), nonce)) == data
+
+    @pytest.mark.parametrize("workers", [2, 3])
+    def test_parallel_round_trip(self, workers: int):
+        data = os.urandom(SEGMENT_SIZE * 10 + 1)
+        nonce = new_nonce()
+
+        encrypted_data = b"".join(encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE, workers=workers))
+        sequential_data = b"".join(encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE, workers=1))
+
+        assert encrypted_data == sequential_data
+        assert b"".join(decrypt_stream(io.BytesIO(encrypted_data), nonce, workers=workers)) == data
+
+    @pytest.mark.parametrize("cipher", list(CipherAlgorithm))
+    def test_cipher_round_trip(self, cipher: CipherAlgorithm):
+        data = os.urandom(SEGMENT_SIZE * 2 + 1)
+        nonce = new_nonce()
+
+        encrypted_data = b"".join(encrypt_stream(io.BytesIO(data), nonce, cipher=cipher, segment_size=SEGMENT_SIZE))
+
+        assert b"".join(decrypt_stream(io.BytesIO(encrypted_data), nonce)) == data
+        assert b"".join(decrypt_stream(io.BytesIO(encrypted_data), nonce, cipher=cipher)) == data
+
+    def test_stream_yields_segments(self):
+        data = os.urandom(SEGMENT_SIZE * 3)
+
+        chunks = list(encrypt_stream(io.BytesIO(data), new_nonce(), segment_size=SEGMENT_SIZE))
+
+        assert [len(chunk) for chunk in chunks[1:]] == [SEGMENT_SIZE + TAG_SIZE] * 3
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_reuse_buffers(self, workers: int):
+        data = os.urandom(SEGMENT_SIZE * 20 + 7)
+        nonce = new_nonce()
+
+        chunks = encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE, workers=workers, reuse_buffers=True)
+        encrypted_data = b"".join(bytes(chunk) for chunk in chunks)
+        raw_chunks = decrypt_stream(io.BytesIO(encrypted_data), nonce, workers=workers, reuse_buffers=True)
+
+        assert encrypted_data == b"".join(encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE))
+        assert b"".join(bytes(chunk) for chunk in raw_chunks) == data
+
+    def test_success(self):
+        raw_file = io.BytesIO(b"bar")
+
+        encrypted_file, nonce = encrypt(raw_file)
+
+        assert raw_file.tell() == 0
+        assert encrypted_file.tell() == 0
+        assert decrypt(encrypted_file, nonce).read() == b"bar"
+
+    def test_invalid_nonce(self):
+        with pytest.raises(ValueError, match="Nonce must be 7 bytes long"):
+            _ = list(encrypt_stream(io.BytesIO(b"bar"), b"foo"))
+
+
+class TestDecrypt:
+    def test_legacy_blob(self):
+        data = os.urandom(AES.block_size * 2048 + 3)
+        encrypted_file, nonce = encrypt_legacy(data)
+
+        assert decrypt(encrypted_file, nonce).read() == data
+
+    @pytest.mark.parametrize("size", [0, SEGMENT_SIZE * 4 + 1])
+    def test_mmap_file(self, tmp_path: Path, size: int):
+        data = os.urandom(size)
+        nonce = new_nonce()
+        path = tmp_path / "blob"
+        _ = path.write_bytes(b"".join(encrypt_stream(io.BytesIO(data), nonce, segment_size=SEGMENT_SIZE)))
+
+        with path.open("rb") as encrypted_file:
+            assert b"".join(decrypt_stream(encrypted_file, nonce, workers=2)) == data
+
+    def test_legacy_blob_invalid_digest(self):
+        encrypted_file, nonce = encrypt_legacy(b"bar")
+        _ = encrypted_file.seek(-1, os.SEEK_END)
+        _ = encrypted_file.write(b"\x00")
+
+        with pytest.raises(ValueError, match="MAC check failed"):
+            _ = decrypt(encrypted_file, nonce)
+
+    def test_cipher_mismatch(self):
+        encrypted_file, nonce = encrypt(io.BytesIO(b"bar"), cipher=CipherAlgorithm.AES_GCM)
+
+        with pytest.raises(ValueError, match="Blob is encrypted with aes-gcm, not chacha20-poly1305"):
+            _ = decrypt(encrypted_file, nonce, cipher=CipherAlgorithm.CHACHA20_POLY1305)
+
+    def test_legacy_blob_with_not_eax_cipher(self):
+        encrypted_file, nonce = encrypt_legacy(b"bar")
+
+        with pytest.raises(ValueError, match="Blob has no aes-gcm header"):
+            _ = decrypt(encrypted_file, nonce, cipher=CipherAlgorithm.AES_GCM)
+
+    def test_tampered_segment(self):
+        nonce = new_nonce()
+        encrypted_data = bytearray(
+            b"".join(encrypt_stream(io.BytesIO(os.urandom(SEGMENT_SIZE * 2)), nonce, segment_size=SEGMENT_SIZE)),
+        )
+        encrypted_data[-1] ^= 1
+
+        with pytest.raises(ValueError, match="MAC check failed"):
+            _ = list(decrypt_stream(io.BytesIO(encrypted_data), nonce))
+
+    def test_parallel_tampered_segment(self):
+        nonce = new_nonce()
+        encrypted_data = bytearray(
+            b"".join(encrypt_stream(io.BytesIO(os.urandom(SEGMENT_SIZE * 8)), nonce, segment_size=SEGMENT_SIZE)),
+        )
+        encrypted_data[-SEGMENT_SIZE * 4] ^= 1
+
+        with pytest.raises(ValueError, match="MAC check failed"):
+            _ = list(decrypt_stream(io.BytesIO(encrypted_data), nonce, workers=4))
+
+    def test_truncated_blob(self):
+        nonce = new_nonce()
+        chunks = list(encrypt_stream(io.BytesIO(os.urandom(SEGMENT_SIZE * 2)), nonce, segment_size=SEGMENT_SIZE))
+
+        with pytest.raises(ValueError, match="MAC check failed"):
+            _ = list(decrypt_stream(io.BytesIO(b"".join(chunks[:-1])), nonce))
+
+    def test_reordered_segments(self):
+        nonce = new_nonce()
+        header, first, second, last = encrypt_stream(
+            io.BytesIO(os.urandom(SEGMENT_SIZE * 3)),
+            nonce,
+            segment_size=SEGMENT_SIZE,
+        )
+
+        with pytest.raises(ValueError, match="MAC check failed"):
+            _ = list(decrypt_stream(io.BytesIO(header + second + first + last), nonce))
+
+
+def encrypt_legacy(data: bytes) -> tuple[io.BytesIO, bytes]:
+    cipher = AES.new(key=get_settings().security.aes_key, mode=AES.MODE_EAX)
+    encrypted_data, digest = cipher.encrypt_and_digest(data)
+    return io.BytesIO(encrypted_data + digest), cipher.nonce
@@ -1,13 +1,17 @@
 import filecmp
 import io
 import tempfile
-from typing import BinaryIO, Callable
+from typing import TYPE_CHECKING, BinaryIO, Callable
 
 import pytest
 from PIL import Image
 
-from backend.storage.constants import PDF_THUMBNAIL, SupportedFileTypes
-from backend.storage.icon import get_thumbnail
+from backend.core.settings import Settings
+from backend.storage.constants import PDF_PREVIEW, PDF_THUMBNAIL, SupportedFileTypes, ThumbnailFormat
+from backend.storage.icon import ImageTooLargeError, get_fallback_renditions, get_renditions, get_thumbnail
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
 
 
 class TestGetThumbnail:
@@ -63,3 +67,73 @@ class TestGetThumbnail:
 
         img = Image.open(data)
         assert img.format == "PNG"
+
+
+class TestGetRenditions:
+    @pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+    def test_images_success(self, image_format: str):
+        file_ = generate_large_image(image_format)
+        sizes = {"icon": (128, 128), "preview": (512, 512), "wide": (1000, 100)}
+
+        formats = list(ThumbnailFormat)
+
+        renditions = get_renditions(file_type=SupportedFileTypes.PNG, file_=file_, sizes=sizes, formats=formats)
+
+        assert file_.tell() == 0
+        for image_format in formats:
+            assert {name: Image.open(data[image_format]).size for name, data in renditions.items()} == {
+                "icon": (128, 64),
+                "preview": (512, 256),
+                "wide": (200, 100),
+            }
+            assert {Image.open(data[image_format]).format for data in renditions.values()} == {image_format.name}
+
+    def test_pdf_success(self):
+        renditions = get_renditions(
+            file_type=SupportedFileTypes.PDF,
+            sizes={"icon": (128, 128), "preview": (512, 512)},
+            formats=list(ThumbnailFormat),
+        )
+
+        assert renditions["icon"][ThumbnailFormat.PNG].read() == PDF_THUMBNAIL.read_bytes()
+        assert renditions["preview"][ThumbnailFormat.PNG].read() == PDF_PREVIEW.read_bytes()
+        assert Image.open(renditions["preview"][ThumbnailFormat.WEBP]).size == Image.open(PDF_PREVIEW).size
+
+
+class TestPixelBudget:
+    @pytest.mark.parametrize(("image_format", "is_too_large"), [("PNG", True), ("JPEG", False)])
+    def test_budget(self, mocker: "MockerFixture", image_format: str, *, is_too_large: bool):
+        # 2000x1000 JPEG is decoded as 250x125 for an icon, PNG can't be downscaled while decoding
+        _ = mocker.patch(
+            "backend.storage.icon.get_settings",
+            return_value=Settings(storage_thumbnail_max_pixels=500 * 250),  # pyright: ignore reportGeneralTypeIssues
+        )
+        file_ = generate_large_image(image_format)
+        load = mocker.spy(Image.Image, "load")
+
+        if is_too_large:
+            with pytest.raises(ImageTooLargeError, match="Image of 2000x1000 pixels is too large to decode"):
+                _ = get_thumbnail(file_type=SupportedFileTypes.PNG, file_=file_)
+            load.assert_not_called()
+        else:
+            assert Image.open(get_thumbnail(file_type=SupportedFileTypes.JPEG, file_=file_)).size == (128, 64)
+        assert file_.tell() == 0
+
+    def test_decompression_bomb(self, mocker: "MockerFixture"):
+        _ = mocker.patch.object(Image, "MAX_IMAGE_PIXELS", 1000)
+
+        with pytest.raises(ImageTooLargeError, match="decompression bomb"):
+            _ = get_thumbnail(file_type=SupportedFileTypes.PNG, file_=generate_large_image("PNG"))
+
+    def test_fallback_renditions(self):
+        renditions = get_fallback_renditions({"icon": (128, 128), "wide": (1000, 100)}, list(ThumbnailFormat))
+
+        for image_format in ThumbnailFormat:
+            assert Image.open(renditions["icon"][image_format]).size == (128, 128)
+            assert Image.open(renditions["wide"][image_format]).size == (100, 100)
+
+
+def generate_large_image(image_format: str) -> io.BytesIO:
+    file_ = io.BytesIO()
+    Image.new(mode="RGB", size=(2000, 1000), color="red").save(file_, format=image_format)
+    return file_
@@ -0,0 +1,95 @@
+import os
+from typing import TYPE_CHECKING
+
+import pytest
+
+from backend.core.settings import get_settings
+from backend.storage.keys import (
+    DATA_KEY_SIZE,
+    get_current_key_id,
+    get_data_key,
+    get_key_id,
+    new_data_key,
+    rewrap_key,
+    unwrap_key,
+    wrap_key,
+)
+
+if TYPE_CHECKING:
+    from pytest_mock import MockerFixture
+
+OLD_KEY = os.urandom(32)
+NEW_KEY = os.urandom(32)
+
+
+def test_wrap_key(mocker: "MockerFixture"):
+    patch_keys(mocker, OLD_KEY)
+    data_key = new_data_key()
+
+    wrapped_key, key_id = wrap_key(data_key)
+
+    assert len(data_key) == DATA_KEY_SIZE
+    assert data_key not in wrapped_key
+    assert key_id == get_key_id(OLD_KEY) == get_current_key_id()
+    assert unwrap_key(wrapped_key, key_id) == data_key
+
+
+def test_unwrap_with_previous_key(mocker: "MockerFixture"):
+    patch_keys(mocker, OLD_KEY)
+    data_key = new_data_key()
+    wrapped_key, key_id = wrap_key(data_key)
+
+    patch_keys(mocker, NEW_KEY, [OLD_KEY])
+
+    assert get_data_key(wrapped_key, key_id) == data_key
+
+    new_wrapped_key, new_key_id = rewrap_key(wrapped_key, key_id)
+    assert new_key_id == get_key_id(NEW_KEY)
+
+    patch_keys(mocker, NEW_KEY)
+    assert unwrap_key(new_wrapped_key, new_key_id) == data_key
+
+
+def test_unknown_master_key(mocker: "MockerFixture"):
+    patch_keys(mocker, OLD_KEY)
+    wrapped_key, key_id = wrap_key(new_data_key())
+
+    patch_keys(mocker, NEW_KEY)
+
+    with pytest.raises(ValueError, match=f"Master key {key_id} is unknown"):
+        _ = unwrap_key(wrapped_key, key_id)
+
+
+def test_tampered_wrapped_key(mocker: "MockerFixture"):
+    patch_keys(mocker, OLD_KEY)
+    wrapped_key, key_id = wrap_key(new_data_key())
+
+    with pytest.raises(ValueError, match="MAC check failed"):
+        _ = unwrap_key(wrapped_key[:-1] + bytes([wrapped_key[-1] ^ 1]), key_id)
+
+
+@pytest.mark.parametrize(
+    ("previous_aes_keys", "legacy_key"),
+    [
+        ([], NEW_KEY),
+        ([os.urandom(32), OLD_KEY], OLD_KEY),
+    ],
+)
+def test_legacy_file_key(mocker: "MockerFixture", previous_aes_keys: list[bytes], legacy_key: bytes):
+    patch_keys(mocker, NEW_KEY, previous_aes_keys)
+
+    assert get_data_key(None, None) == legacy_key
+    wrapped_key, key_id = rewrap_key(None, None)
+    assert unwrap_key(wrapped_key, key_id) == legacy_key
+
+
+def test_previous_key_size():
+    with pytest.raises(ValueError, match="at least 32 bytes"):
+        _ = type(get_settings().security)(aes_key=NEW_KEY, previous_aes_keys=[b"foo"])
+
+
+def patch_keys(mocker: "MockerFixture", aes_key: bytes, previous_aes_keys: list[bytes] | None = None) -> None:
+    settings = get_settings()
+    security = settings.security.model_copy(update={"aes_key": aes_key, "previous_aes_keys": previous_aes_keys or []})
+    settings = settings.model_copy(update={"security": security})
+    _ = mocker.patch("backend.storage.keys.get_settings", return_value=settings)
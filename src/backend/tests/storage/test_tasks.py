@@ -0,0 +1,160 @@
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable
+
+import pytest
+from beanie import PydanticObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+from pytest_mock import MockerFixture
+
+from backend.core.events import get_mongo_client
+from backend.storage.constants import SupportedFileTypes
+from backend.storage.dao.mongo_file_meta import FileMetaCache, MongoFileMetaDAO
+from backend.storage.documents.file_meta import FileMetaDocument
+from backend.storage.tasks import CHANGE_STREAMS_NOT_SUPPORTED, build_pending_icons, invalidate_file_meta_cache
+from backend.storage.typing_ import FileName, FilePath
+
+MISSING = object()
+TTL = 300
+FALLBACK_TTL = 5
+FOO = {"path": "/a", "filename": "foo.pdf"}
+BAR = {"path": "/b", "filename": "bar.pdf"}
+
+
+class TestBuildPendingIcons:
+    async def test_keeps_running_after_error(self, mocker: MockerFixture):
+        controller = mocker.Mock()
+        last_id = PydanticObjectId()
+        controller.build_pending_icons = mocker.AsyncMock(
+            side_effect=[PyMongoError("connection closed"), last_id, None, asyncio.CancelledError()],
+        )
+
+        with pytest.raises(asyncio.CancelledError):
+            await build_pending_icons(controller, interval=0)
+
+        assert controller.build_pending_icons.await_args_list == [
+            mocker.call(limit=1, after=None),
+            mocker.call(limit=1, after=None),
+            mocker.call(limit=1, after=last_id),
+            mocker.call(limit=1, after=None),
+        ]
+
+    async def test_moves_past_failed_file(self, mocker: MockerFixture):
+        controller = mocker.Mock()
+        failed_id, next_id = PydanticObjectId(), PydanticObjectId()
+        # The failed file stays pending, the next pass starts after it
+        controller.build_pending_icons = mocker.AsyncMock(side_effect=[failed_id, next_id, asyncio.CancelledError()])
+
+        with pytest.raises(asyncio.CancelledError):
+            await build_pending_icons(controller, interval=0)
+
+        assert [call.kwargs["after"] for call in controller.build_pending_icons.await_args_list] == [
+            None,
+            failed_id,
+            next_id,
+        ]
+
+
+class TestInvalidateChanged:
+    @pytest.mark.parametrize(
+        ("change", "is_foo_cached", "is_bar_cached"),
+        [
+            ({"operationType": "insert", "fullDocument": FOO}, False, True),
+            ({"operationType": "delete", "fullDocumentBeforeChange": FOO}, False, True),
+            ({"operationType": "delete"}, False, False),
+            (
+                {
+                    "operationType": "update",
+                    "updateDescription": {"updatedFields": {"icon_hash": "1"}},
+                    "fullDocument": FOO,
+                },
+                False,
+                True,
+            ),
+            (
+                {
+                    "operationType": "update",
+                    "updateDescription": {"updatedFields": {"filename": "bar.pdf", "path": "/b"}},
+                    "fullDocumentBeforeChange": FOO,
+                    "fullDocument": BAR,
+                },
+                False,
+                False,
+            ),
+            (
+                {
+                    "operationType": "update",
+                    "updateDescription": {"updatedFields": {"path": "/b"}},
+                    "fullDocument": BAR,
+                },
+                False,
+                False,
+            ),
+            ({"operationType": "drop"}, False, False),
+        ],
+    )
+    def test_invalidated_keys(
+        self,
+        file_meta_cache: FileMetaCache,
+        change: dict[str, Any],
+        *,
+        is_foo_cached: bool,
+        is_bar_cached: bool,
+    ):
+        file_meta_cache.set(("get", FOO["path"], FOO["filename"]), value=True)
+        file_meta_cache.set(("exists", BAR["path"], BAR["filename"]), value=True)
+
+        MongoFileMetaDAO(file_meta_cache).invalidate_changed(change)
+
+        assert (file_meta_cache.get(("get", FOO["path"], FOO["filename"]), MISSING) is not MISSING) == is_foo_cached
+        assert (file_meta_cache.get(("exists", BAR["path"], BAR["filename"]), MISSING) is not MISSING) == is_bar_cached
+
+
+class TestInvalidateFileMetaCache:
+    async def test_standalone_server(self, file_meta_cache: FileMetaCache, mocker: MockerFixture):
+        db_dao = MongoFileMetaDAO(file_meta_cache)
+        _ = mocker.patch.object(
+            db_dao,
+            "watch_changes",
+            side_effect=OperationFailure("Not a replica set", CHANGE_STREAMS_NOT_SUPPORTED),
+        )
+        file_meta_cache.set(("get", FOO["path"], FOO["filename"]), value=True)
+
+        await invalidate_file_meta_cache(db_dao, ttl=TTL, fallback_ttl=FALLBACK_TTL, retry_interval=0)
+
+        assert file_meta_cache.ttl == FALLBACK_TTL
+        assert file_meta_cache.get(("get", FOO["path"], FOO["filename"]), MISSING) is MISSING
+
+    @pytest.mark.usefixtures("_init_beanie", "file_meta_document_teardown")
+    async def test_write_of_other_process(
+        self,
+        file_meta_cache: FileMetaCache,
+        file_meta_document_factory: Callable[..., Awaitable["FileMetaDocument"]],
+    ):
+        if "setName" not in await get_mongo_client().admin.command("hello"):
+            pytest.skip("Change streams need a replica set, e.g. `mongod --replSet rs0`")
+
+        db_dao = MongoFileMetaDAO(file_meta_cache)
+        path, filename = FilePath("/foo"), FileName("test.pdf")
+        _ = await file_meta_document_factory(path=path, filename=filename, type_=SupportedFileTypes.PDF)
+        invalidator = asyncio.create_task(
+            invalidate_file_meta_cache(db_dao, ttl=TTL, fallback_ttl=FALLBACK_TTL, retry_interval=0),
+        )
+        try:
+            while file_meta_cache.ttl != TTL:
+                await asyncio.sleep(0.01)
+            assert await db_dao.is_exists(path=path, filename=filename)
+
+            # Not through the DAO, like another worker does
+            _ = await FileMetaDocument.get_motor_collection().update_one(
+                {"path": str(path), "filename": filename},
+                {"$set": {"path": "/bar"}},
+            )
+
+            async with asyncio.timeout(5):
+                while await db_dao.is_exists(path=path, filename=filename):
+                    await asyncio.sleep(0.01)
+        finally:
+            _ = invalidator.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await invalidator